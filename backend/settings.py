@@ -39,6 +39,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "blog.feeds.FeedFilesMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -78,13 +79,54 @@ DJANGO_VITE = {
 }
 
 DATABASES = {
+    # Falls back to the local SQLite database when DATABASE_URL is not set. DATABASE_CONN_MAX_AGE keeps
+    # connections open between requests, including those of the GraphQL thread pools, in seconds
+    "default": dj_database_url.config(
+        default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
+        conn_max_age=int(os.environ.get('DATABASE_CONN_MAX_AGE', 0)),
+        conn_health_checks=True,
+    ),
+}
+
+CACHES = {
     "default": {
-        # "ENGINE": "django.db.backends.sqlite3",
-        # "NAME": BASE_DIR / "db.sqlite3",
-        dj_database_url.config(default=os.environ.get('DATABASE_URL'))
-    }
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # GraphQL response cache and the cached viewer (blog/viewer.py). Local memory is per process, so use a
+    # shared backend such as django.core.cache.backends.redis.RedisCache or FileBasedCache when running
+    # several workers: invalidation reaches only the process that made the change.
+    "graphql": {
+        "BACKEND": os.environ.get('GRAPHQL_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        "LOCATION": os.environ.get('GRAPHQL_CACHE_LOCATION', 'graphql-responses'),
+    },
 }
 
+GRAPHQL_RESPONSE_CACHE_TTL = int(os.environ.get('GRAPHQL_RESPONSE_CACHE_TTL', 60))  # seconds
+# How long a deactivated or demoted user can keep their old access in other processes, in seconds
+VIEWER_USER_CACHE_TTL = int(os.environ.get('VIEWER_USER_CACHE_TTL', 60))
+# Budget for blog.query_cost; the computed cost is returned in each response's extensions
+GRAPHQL_MAX_QUERY_COST = int(os.environ.get('GRAPHQL_MAX_QUERY_COST', 1000))
+GRAPHQL_MAX_QUERY_DEPTH = int(os.environ.get('GRAPHQL_MAX_QUERY_DEPTH', 10))
+# Serve /graphql/ from the async view; backend/asgi.py turns this on for uvicorn workers
+GRAPHQL_ASYNC = os.environ.get('GRAPHQL_ASYNC', '0') == '1'
+GRAPHQL_ASYNC_WORKERS = int(os.environ.get('GRAPHQL_ASYNC_WORKERS', 8))  # Requests at once
+# Root fields resolved at once, shared by all requests. Each pool thread holds a connection of its own, so a
+# process opens up to GRAPHQL_ASYNC_WORKERS + GRAPHQL_ROOT_FIELD_WORKERS connections for GraphQL
+GRAPHQL_ROOT_FIELD_WORKERS = int(os.environ.get('GRAPHQL_ROOT_FIELD_WORKERS', 4))
+# Public site address and post paths, used for sitemap and feed links
+SITE_URL = os.environ.get('SITE_URL', 'https://addisperspective.onrender.com')
+POST_URL_FORMAT = '/post/{slug}'
+# Generated sitemap and feeds (blog/feeds.py); must be shared by the web and worker processes
+FEEDS_ROOT = os.environ.get('FEEDS_ROOT', str(BASE_DIR / 'feeds'))
+FEEDS_MAX_AGE = int(os.environ.get('FEEDS_MAX_AGE', 3600))  # seconds
+# Background jobs (blog/jobs.py), run by `manage.py run_worker`
+TASK_WORKER_CONCURRENCY = int(os.environ.get('TASK_WORKER_CONCURRENCY', 2))
+TASK_LOCK_TIMEOUT = int(os.environ.get('TASK_LOCK_TIMEOUT', 600))  # seconds before a stuck job is retried
+# App Engine runs no worker process, so cron.yaml calls /tasks/run instead; App Engine sets GAE_ENV
+TASK_CRON_ENABLED = os.environ.get('GAE_ENV') == 'standard'
+# Addresses allowed to scrape /metrics
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -123,6 +165,10 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Resized copies of profile images and book covers (blog/images.py). AVIF needs Pillow 11.2+ or pillow-avif-plugin
+IMAGE_WIDTHS = (320, 640, 1024, 1600)
+IMAGE_FORMATS = ('avif', 'webp', 'jpeg')
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
 
 
 STATICFILES_DIRS = [
@@ -137,6 +183,7 @@ GRAPHENE = {
     "SCHEMA": "blog.schema.schema",
     'MIDDLEWARE': [
         'graphql_jwt.middleware.JSONWebTokenMiddleware',
+        'blog.tracing.TracingMiddleware',
     ],
 }
 
@@ -2,14 +2,19 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from graphene_file_upload.django import FileUploadGraphQLView
 from blog.schema import schema  # or wherever your GraphQL schema is
-from blog.views import get_csrf_token
+from blog.views import BlogGraphQLView, async_graphql_view, get_csrf_token, metrics, posts_ndjson, run_jobs
+
+# The ASGI server (backend/asgi.py) serves GraphQL from the async view; WSGI keeps the plain view
+graphql_endpoint = async_graphql_view if settings.GRAPHQL_ASYNC else BlogGraphQLView.as_view(graphiql=True, schema=schema)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("csrf/", get_csrf_token),  # Just GET this before your GraphQL calls
-    path('graphql/', FileUploadGraphQLView.as_view(graphiql=True, schema=schema)),
+    path('graphql/', graphql_endpoint),
+    path('metrics', metrics),  # Prometheus scrape target, local addresses only
+    path('posts.ndjson', posts_ndjson),  # Staff bulk export (GET) and import (POST)
+    path('tasks/run', run_jobs),  # Background jobs for App Engine cron, see cron.yaml
 ]
 
 # Serve static and media files only in development
@@ -0,0 +1,112 @@
+# blog/ad_tracking.py
+"""
+Buffered ad impression and click counters.
+
+Page views only bump in-memory counters; a background timer flushes them with
+one ``UPDATE ... SET impressions = impressions + n`` per ad unit, so hot ad
+units no longer take a row lock per view. Counts recorded since the last flush
+are lost if the process is killed, which is acceptable for ad statistics; a
+flush that fails puts the counts it could not write back into the buffer.
+
+Only ids of existing ad units are counted, so clients cannot grow the buffer
+with made-up keys. The ids are cached for KNOWN_IDS_TTL; saving or deleting an
+ad unit refreshes this process's copy (blog/signals.py), other processes pick
+it up when their copy expires.
+"""
+import atexit
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F
+
+from blog.models import AdUnit
+
+FLUSH_INTERVAL = getattr(settings, 'AD_TRACKING_FLUSH_INTERVAL', 10)  # seconds
+KNOWN_IDS_TTL = getattr(settings, 'AD_TRACKING_KNOWN_IDS_TTL', 60)  # seconds
+
+
+class AdCounterBuffer:
+    def __init__(self, flush_interval=FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._impressions = Counter()
+        self._clicks = Counter()
+        self._timer = None
+        self._known_ids = None
+        self._known_ids_loaded = 0
+
+    def known_ids(self):
+        """Primary keys of the existing ad units, loaded at most once per KNOWN_IDS_TTL."""
+        known_ids = self._known_ids
+        if known_ids is None or time.monotonic() - self._known_ids_loaded > KNOWN_IDS_TTL:
+            known_ids = frozenset(AdUnit.objects.values_list('pk', flat=True))
+            self._known_ids, self._known_ids_loaded = known_ids, time.monotonic()
+        return known_ids
+
+    def forget_known_ids(self):
+        self._known_ids = None
+
+    def record_impressions(self, ad_ids):
+        return self._record(self._impressions, ad_ids)
+
+    def record_clicks(self, ad_ids):
+        return self._record(self._clicks, ad_ids)
+
+    def _record(self, counter, ad_ids):
+        """Count the ids of existing ad units and return how many were counted. Raises ValueError for non-integers."""
+        ad_ids = [int(ad_id) for ad_id in ad_ids]
+        known_ids = self.known_ids()
+        ad_ids = [ad_id for ad_id in ad_ids if ad_id in known_ids]
+        if not ad_ids:
+            return 0
+        with self._lock:
+            counter.update(ad_ids)
+            self._schedule_flush()
+        return len(ad_ids)
+
+    def _schedule_flush(self):
+        if self._timer is None and self.flush_interval:
+            self._timer = threading.Timer(self.flush_interval, self._flush_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_in_background(self):
+        close_old_connections()
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    def flush(self):
+        """Write the buffered counts, one UPDATE per ad unit. Returns the number of ad units updated."""
+        with self._lock:
+            impressions, clicks = self._impressions, self._clicks
+            self._impressions, self._clicks = Counter(), Counter()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        ad_ids = sorted(impressions.keys() | clicks.keys())
+        written = 0
+        try:
+            for ad_id in ad_ids:
+                AdUnit.objects.filter(pk=ad_id).update(
+                    impressions=F('impressions') + impressions[ad_id],
+                    clicks=F('clicks') + clicks[ad_id],
+                )
+                written += 1
+        except Exception:
+            # Put back what was not written, for the next flush
+            unwritten = ad_ids[written:]
+            with self._lock:
+                self._impressions.update({ad_id: impressions[ad_id] for ad_id in unwritten if impressions[ad_id]})
+                self._clicks.update({ad_id: clicks[ad_id] for ad_id in unwritten if clicks[ad_id]})
+                self._schedule_flush()
+            raise
+        return len(ad_ids)
+
+
+ad_counters = AdCounterBuffer()
+atexit.register(ad_counters.flush)
@@ -1,8 +1,10 @@
 from django.contrib import admin
 
 from blog.models import Profile, Post, Tag, Interaction, Book
+from blog.search import matching_posts
 from django import forms
 from django.db import models
+from django.db.models import Q
 
 
 
@@ -53,10 +55,9 @@ class PostAdmin(admin.ModelAdmin):
         "published",
         "body",
     )
-    search_fields = (
+    search_fields = (  # Searched through the full-text index, see get_search_results
         "title",
         "subtitle",
-        "slug",
         "body",
     )
     prepopulated_fields = {
@@ -68,6 +69,13 @@ class PostAdmin(admin.ModelAdmin):
     date_hierarchy = "publish_date"
     save_on_top = True
 
+    def get_search_results(self, request, queryset, search_term):
+        # Use the full-text index instead of ILIKE over every body; slugs are not indexed, so match them by prefix
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(matching_posts(search_term) | Q(slug__startswith=search_term)), False
+
 
 @admin.register(Book)
 class TagAdmin(admin.ModelAdmin):
@@ -0,0 +1,8 @@
+"""
+GraphQL load benchmarks.
+
+``seed`` fills an empty database with deterministic sample data and ``suite``
+drives the real schema through the Django test client, reporting latency
+percentiles, SQL queries and allocations per operation. Run both through
+``manage.py benchmark_graphql``, which works in a throwaway test database.
+"""
@@ -0,0 +1,118 @@
+# blog/benchmarks/seed.py
+"""Deterministic sample data for benchmarks: the same options always produce the same rows."""
+import random
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from blog import search
+from blog.models import AdUnit, Interaction, Post, Profile, Tag, TagIndex, make_excerpt
+
+WORDS = (
+    'addis ababa coffee ceremony highland market culture history music injera festival river mountain '
+    'school library football runner marathon journalism election economy harvest rain season city road '
+    'railway startup teff wedding church mosque museum language poetry novel radio television film art'
+).split()
+TAG_NAMES = (
+    'Culture', 'Politics', 'Economy', 'Sport', 'Music', 'Food', 'Travel', 'History', 'Technology', 'Opinion',
+    'Books', 'Film', 'Health', 'Education', 'Environment', 'Business', 'Religion', 'Fashion', 'Science', 'Local',
+)
+AD_POSITIONS = ('header', 'sidebar', 'inline', 'footer')
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def sentence(rng, words=12):
+    text = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + '.'
+
+
+def html_body(rng, paragraphs):
+    """A body shaped like the editor's output: headings, paragraphs, emphasis, links and lists."""
+    parts = []
+    for i in range(paragraphs):
+        if i and i % 4 == 0:
+            parts.append(f'<h2>{sentence(rng, 4)}</h2>')
+        text = ' '.join(sentence(rng, rng.randint(8, 20)) for _ in range(rng.randint(3, 6)))
+        emphasized = rng.choice(WORDS)
+        text = text.replace(f' {emphasized} ', f' <strong>{emphasized}</strong> ', 1)
+        parts.append(f'<p>{text} <a href="https://example.com/{rng.choice(WORDS)}">{rng.choice(WORDS)}</a></p>')
+        if i % 5 == 2:
+            items = ''.join(f'<li>{sentence(rng, 5)}</li>' for _ in range(rng.randint(2, 5)))
+            parts.append(f'<ul>{items}</ul>')
+    return '\n'.join(parts)
+
+
+@transaction.atomic
+def seed(profiles=20, posts=500, tags=20, interactions=5000, ad_units=12, paragraphs=12, seed=1):
+    """Create the sample rows and return the number created per model."""
+    rng = random.Random(seed)
+
+    users = User.objects.bulk_create(User(username=f'bench-author-{i}') for i in range(profiles))
+    authors = Profile.objects.bulk_create(
+        Profile(user=user, bio=sentence(rng, 8), website=f'https://example.com/{user.username}') for user in users
+    )
+    tag_rows = Tag.objects.bulk_create(Tag(name=name) for name in (TAG_NAMES * (tags // len(TAG_NAMES) + 1))[:tags])
+
+    post_rows = []
+    for i in range(posts):
+        body = html_body(rng, paragraphs)
+        title = f'{sentence(rng, rng.randint(4, 9))[:-1]} {i}'
+        published = rng.random() < 0.9
+        post_rows.append(Post(
+            title=title,
+            subtitle=sentence(rng, 10),
+            slug=f'bench-post-{i}',
+            body=body,
+            excerpt=make_excerpt(body),
+            meta_description=sentence(rng, 12)[:150],
+            published=published,
+            publish_date=EPOCH + timedelta(hours=i) if published else None,
+            author=rng.choice(authors),
+        ))
+    # bulk_create skips Post.save and its signals, so slugs, excerpts, search documents and the tag index
+    # are filled in here
+    post_rows = Post.objects.bulk_create(post_rows)
+    Post.tags.through.objects.bulk_create(
+        Post.tags.through(post_id=post.pk, tag_id=tag.pk)
+        for post in post_rows
+        for tag in rng.sample(tag_rows, k=min(len(tag_rows), rng.randint(1, 4)))
+    )
+    for post in post_rows:
+        search.index_post(post.pk)
+    TagIndex.refresh([tag.pk for tag in tag_rows])
+
+    # Popularity follows a long tail, so a few posts collect most of the interactions
+    weights = [1 / (rank + 1) for rank in range(len(post_rows))]
+    actions = [action for action, _ in Interaction.ACTION_CHOICES]
+    Interaction.objects.bulk_create(
+        (
+            Interaction(
+                post=post,
+                action=rng.choice(actions),
+                actor_key=Interaction.actor_key_for(client_key=f'bench-reader-{i}'),
+            )
+            for i, post in enumerate(rng.choices(post_rows, weights=weights, k=interactions))
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    Post.recount_interactions()
+
+    AdUnit.objects.bulk_create(
+        AdUnit(
+            name=f'Bench ad {i}',
+            position=AD_POSITIONS[i % len(AD_POSITIONS)],
+            width=rng.choice((300, 728, 970)),
+            height=rng.choice((90, 250, 600)),
+            custom_ad=f'<div class="ad">{sentence(rng, 6)}</div>',
+        )
+        for i in range(ad_units)
+    )
+    return {
+        'profiles': len(authors),
+        'tags': len(tag_rows),
+        'posts': len(post_rows),
+        'interactions': Interaction.objects.count(),
+        'ad_units': ad_units,
+    }
@@ -0,0 +1,186 @@
+# blog/benchmarks/suite.py
+"""The benchmarked GraphQL operations, their runner and comparison against a stored baseline."""
+import itertools
+import platform
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import Client
+from graphql_jwt.shortcuts import get_token
+
+from blog.models import Post, Profile, Tag
+
+POST_FIELDS = 'id title slug excerpt formattedDate likeCount author { id user { username } } tags { name }'
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class Operation:
+    """One GraphQL request to time; ``variables(i, data)`` builds the variables of the i-th call."""
+
+    def __init__(self, name, query, variables=None, staff=False):
+        self.name = name
+        self.query = query
+        self.variables = variables or (lambda i, data: {})
+        self.staff = staff
+
+
+OPERATIONS = [
+    Operation(
+        'allPosts',
+        'query ($page: Int) { allPosts(page: $page, pageSize: 10) { totalCount posts { %s } } }' % POST_FIELDS,
+        lambda i, data: {'page': i % 5 + 1},
+    ),
+    Operation(
+        'postBySlug',
+        'query ($slug: String) { postBySlug(slug: $slug) { %s body subtitle metaDescription } }' % POST_FIELDS,
+        lambda i, data: {'slug': data['slugs'][i % len(data['slugs'])]},
+    ),
+    Operation(
+        'postsConnection',
+        'query { postsConnection(first: 20) { totalCount edges { cursor node { %s } } } }' % POST_FIELDS,
+    ),
+    Operation(
+        'searchPosts',
+        'query ($q: String!) { searchPosts(query: $q, first: 10) { edges { node { rank snippet post { id title } } } } }',
+        lambda i, data: {'q': ('coffee', 'marathon runner', 'highland festival', 'teff harvest')[i % 4]},
+    ),
+    Operation(
+        'postsByTag',
+        'query ($tag: String) { postsByTag(tag: $tag) { id title slug } }',
+        lambda i, data: {'tag': data['tags'][i % len(data['tags'])].lower()},
+    ),
+    Operation('adUnits', 'query { adUnits(position: "sidebar") { id name width height customAd } }'),
+    Operation(
+        'recordInteractions',
+        'mutation ($events: [InteractionEventInput!]!) { recordInteractions(events: $events) { success counts { postId likeCount } } }',
+        lambda i, data: {'events': [
+            {'postId': data['post_ids'][(i + n) % len(data['post_ids'])], 'action': 'like', 'clientKey': f'bench-run-{i}'}
+            for n in range(20)
+        ]},
+    ),
+    Operation(
+        'createPost',
+        '''mutation ($input: CreatePostInput!) { createPost(input: $input) { success message post { id slug } } }''',
+        lambda i, data: {'input': {
+            'title': f'Benchmark draft {i}', 'subtitle': '', 'slug': 'benchmark-draft', 'tags': data['tag_ids'][:2],
+            'body': '<p>Draft body</p>' * 20, 'author': data['staff'],
+            'createdAt': data['now'], 'updatedAt': data['now'],
+        }},
+        staff=True,
+    ),
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))]
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run(operations=None, iterations=50, warmup=5, cold_cache=True, stdout=None):
+    """Time every operation and return the results as a JSON-serializable dict."""
+    operations = OPERATIONS if operations is None else operations
+    staff, _ = User.objects.get_or_create(username='bench-editor', defaults={'is_staff': True})
+    Profile.objects.get_or_create(user=staff)
+    data = {
+        'post_ids': list(Post.objects.order_by('pk').values_list('pk', flat=True)),
+        'slugs': list(Post.objects.order_by('pk').values_list('slug', flat=True)),
+        'tags': list(Tag.objects.order_by('pk').values_list('name', flat=True)) or ['Culture'],
+        'tag_ids': [str(pk) for pk in Tag.objects.order_by('pk').values_list('pk', flat=True)],
+        'staff': staff.username,
+        'now': datetime.now(timezone.utc).isoformat(),
+    }
+    if not data['post_ids']:
+        raise BenchmarkError('The database has no posts; seed it first')
+    client = Client()
+    headers = {'HTTP_AUTHORIZATION': f'JWT {get_token(staff)}'}
+    calls = itertools.count()  # Unique per call, so writes never collide with earlier ones
+
+    def call(operation):
+        if cold_cache:
+            caches['graphql'].clear()
+        payload = {'query': operation.query, 'variables': operation.variables(next(calls), data)}
+        return client.post(
+            '/graphql/', payload, content_type='application/json', **(headers if operation.staff else {})
+        )
+
+    results = {}
+    for operation in operations:
+        for _ in range(warmup):
+            call(operation)
+        latencies, query_counts = [], []
+        for _ in range(iterations):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                start = time.perf_counter()
+                response = call(operation)
+                latencies.append(time.perf_counter() - start)
+            query_counts.append(counter.count)
+            body = response.json()
+            if response.status_code != 200 or body.get('errors'):
+                raise BenchmarkError(f'{operation.name} failed: {response.status_code} {body.get("errors")}')
+
+        # Allocation tracing slows everything down, so it gets a call of its own
+        tracemalloc.start()
+        call(operation)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[operation.name] = {
+            'iterations': iterations,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+            'queries': max(query_counts),
+            'peak_alloc_kib': round(peak / 1024, 1),
+        }
+        if stdout is not None:
+            r = results[operation.name]
+            stdout.write(
+                f"{operation.name:<20} p50 {r['p50_ms']:>8.2f} ms  p95 {r['p95_ms']:>8.2f} ms  "
+                f"p99 {r['p99_ms']:>8.2f} ms  {r['queries']:>3} queries  {r['peak_alloc_kib']:>8.1f} KiB"
+            )
+    return {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'iterations': iterations,
+            'cold_cache': cold_cache,
+        },
+        'operations': results,
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """Return a message for every operation that got slower than ``tolerance`` allows or runs more queries."""
+    regressions = []
+    for name, current in results['operations'].items():
+        previous = baseline.get('operations', {}).get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {previous[metric]} -> {current[metric]}')
+        if current['queries'] > previous['queries']:
+            regressions.append(f'{name}: queries {previous["queries"]} -> {current["queries"]}')
+    return regressions
@@ -0,0 +1,117 @@
+# blog/concurrent_execution.py
+"""
+Concurrent resolution of independent root fields.
+
+graphql-core 2 resolves a query's root fields one after another on the
+calling thread. For the async endpoint, a query such as
+``{ allPosts { ... } adUnits { ... } tags { ... } }`` is split into one
+document per root field. Selections that share a response key, such as
+``posts { id } posts { title }``, stay in one document so graphql-core merges
+them as usual. The documents run side by side on a bounded thread pool, each
+with its own database connection, and their data is merged back in the order
+the fields were asked for. Mutations keep their serial execution.
+
+Pool threads outlive requests, so their connections follow CONN_MAX_AGE like
+a request's would. With the default of 0 every part opens and closes a
+connection of its own; set DATABASE_CONN_MAX_AGE so the threads keep theirs.
+
+A traced request gives every part a Trace of its own, counting the SQL of the
+pool thread's connection, and merges them into the request's trace when the
+parts are done.
+"""
+import copy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+
+from blog import response_cache, tracing
+
+ROOT_FIELD_WORKERS = getattr(settings, 'GRAPHQL_ROOT_FIELD_WORKERS', 4)
+
+executor = ThreadPoolExecutor(max_workers=ROOT_FIELD_WORKERS, thread_name_prefix='graphql-field')
+
+
+def split_root_fields(document_ast, operation_name=None):
+    """Return one document per response key of the query to run, or None when it should run as a whole."""
+    operations = [
+        definition for definition in document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition)
+        and (operation_name is None or (definition.name and definition.name.value == operation_name))
+    ]
+    if len(operations) != 1 or operations[0].operation != 'query':
+        return None
+    operation = operations[0]
+    selections = operation.selection_set.selections
+    if len(selections) < 2 or not all(isinstance(selection, ast.Field) for selection in selections):
+        return None
+    # Fields asked for under the same key are merged into one value, so they must run in the same part
+    by_key = OrderedDict()
+    for selection in selections:
+        by_key.setdefault((selection.alias or selection.name).value, []).append(selection)
+    if len(by_key) < 2:
+        return None
+    fragments = [definition for definition in document_ast.definitions if isinstance(definition, ast.FragmentDefinition)]
+    return [
+        ast.Document(definitions=[
+            ast.OperationDefinition(
+                operation='query',
+                selection_set=ast.SelectionSet(selections=key_selections),
+                name=operation.name,
+                variable_definitions=operation.variable_definitions,
+                directives=operation.directives,
+            ),
+            *fragments,
+        ])
+        for key_selections in by_key.values()
+    ]
+
+
+def execute_part(schema, document_ast, context, kwargs):
+    # Pool threads hold their own connections; close them the way Django does around a request, which keeps
+    # them open for reuse when CONN_MAX_AGE allows
+    close_old_connections()
+    trace = getattr(context, 'graphql_trace', None)
+    try:
+        if trace is None:
+            return execute(schema, document_ast, context_value=context, **kwargs)
+        # The request's SQL wrapper is installed on the calling thread's connection, not on this one
+        with connection.execute_wrapper(trace.execute_wrapper):
+            return execute(schema, document_ast, context_value=context, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def execute_concurrently(schema, parts, context_value, **kwargs):
+    """Execute the documents from split_root_fields on the pool and merge them into one result."""
+    # Authenticate once up front instead of once per part
+    response_cache.viewer_class(context_value)
+    # Each part gets its own copy of the request, so per-request loaders and traces are never shared between threads
+    request_trace = getattr(context_value, 'graphql_trace', None)
+    contexts = []
+    for _ in parts:
+        context = copy.copy(context_value)
+        if request_trace is not None:
+            context.graphql_trace = tracing.Trace(request_trace.operation_name)
+        contexts.append(context)
+    futures = [
+        executor.submit(execute_part, schema, part, context, kwargs) for part, context in zip(parts, contexts)
+    ]
+    data, errors = OrderedDict(), []
+    for future in futures:
+        result = future.result()
+        data.update(result.data or {})
+        errors.extend(result.errors or ())
+
+    if request_trace is not None:
+        for context in contexts:
+            request_trace.merge(context.graphql_trace)
+
+    modified = [getattr(context, 'posts_last_modified', None) for context in contexts]
+    modified = [value for value in modified if value is not None]
+    if modified:
+        context_value.posts_last_modified = max(modified)
+    return ExecutionResult(data=data, errors=errors or None)
@@ -0,0 +1,183 @@
+# blog/feeds.py
+"""
+Sitemap and RSS/Atom feeds, written as static files.
+
+``/sitemap.xml`` is a sitemap index pointing at ``/sitemap-<n>.xml`` shards.
+Shard n lists the published posts with ids in ``[n * SITEMAP_SHARD_SIZE,
+(n + 1) * SITEMAP_SHARD_SIZE)``, so no shard exceeds the 50,000 URL limit
+and a post always stays in the same shard. ``/feed.xml`` (RSS 2.0) and
+``/atom.xml`` hold the latest FEED_SIZE posts.
+
+Saving or deleting a post queues a job (blog/tasks.py) that rewrites only
+that post's shard, the index and the feeds. Each file is replaced atomically
+and gets a gzipped copy. FeedFilesMiddleware serves the files with
+WhiteNoise. Because workers rewrite them at runtime, it re-checks them on
+every request for one of these paths. FEEDS_ROOT must therefore be on disk
+that both the web and worker processes can see.
+"""
+import gzip
+import os
+import re
+import tempfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import F, Max
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from blog.models import Post
+
+SITE_URL = getattr(settings, 'SITE_URL', 'http://localhost:8000').rstrip('/')
+FEEDS_ROOT = str(getattr(settings, 'FEEDS_ROOT', settings.BASE_DIR / 'feeds'))
+SITEMAP_SHARD_SIZE = getattr(settings, 'SITEMAP_SHARD_SIZE', 50000)
+FEED_SIZE = getattr(settings, 'FEED_SIZE', 50)
+FEED_TITLE = getattr(settings, 'FEED_TITLE', 'Addis Perspective')
+FEED_DESCRIPTION = getattr(settings, 'FEED_DESCRIPTION', 'Latest posts from Addis Perspective')
+FEEDS_MAX_AGE = getattr(settings, 'FEEDS_MAX_AGE', 3600)  # seconds
+
+FILE_URL = re.compile(r'/(sitemap|sitemap-\d+|feed|atom)\.xml')
+SHARD_FILE = re.compile(r'sitemap-(\d+)\.xml')
+FEEDS = {'feed.xml': Rss201rev2Feed, 'atom.xml': Atom1Feed}
+
+
+def absolute_url(path):
+    return SITE_URL + path
+
+
+def shard_of(post_id):
+    return post_id // SITEMAP_SHARD_SIZE
+
+
+def shard_file(shard):
+    return f'sitemap-{shard}.xml'
+
+
+def published_posts():
+    return Post.objects.filter(published=True)
+
+
+def write(name, content):
+    """Atomically replace ``name`` in FEEDS_ROOT and its ``.gz`` copy."""
+    os.makedirs(FEEDS_ROOT, exist_ok=True)
+    for target, data in ((name, content), (name + '.gz', gzip.compress(content, mtime=0))):
+        fd, temporary = tempfile.mkstemp(dir=FEEDS_ROOT, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, os.path.join(FEEDS_ROOT, target))
+
+
+def remove(name):
+    for target in (name, name + '.gz'):
+        try:
+            os.remove(os.path.join(FEEDS_ROOT, target))
+        except FileNotFoundError:
+            pass
+
+
+def existing_shards():
+    try:
+        names = os.listdir(FEEDS_ROOT)
+    except FileNotFoundError:
+        return set()
+    return {int(match.group(1)) for match in map(SHARD_FILE.fullmatch, names) if match}
+
+
+def shard_lastmods():
+    """shard -> newest updated_at of its published posts, for shards that have any."""
+    rows = (
+        published_posts().annotate(shard=F('pk') / SITEMAP_SHARD_SIZE)
+        .values('shard').annotate(lastmod=Max('updated_at')).order_by('shard')
+    )
+    return {row['shard']: row['lastmod'] for row in rows}
+
+
+def build_shard(shard):
+    posts = (
+        published_posts().filter(pk__gte=shard * SITEMAP_SHARD_SIZE, pk__lt=(shard + 1) * SITEMAP_SHARD_SIZE)
+        .only('slug', 'updated_at').order_by('pk')
+    )
+    lines = [
+        f'<url><loc>{escape(absolute_url(post.get_absolute_url()))}</loc>'
+        f'<lastmod>{post.updated_at.isoformat()}</lastmod></url>'
+        for post in posts.iterator(chunk_size=2000)
+    ]
+    if not lines:
+        remove(shard_file(shard))
+        return
+    write(shard_file(shard), '\n'.join([
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+        *lines,
+        '</urlset>',
+    ]).encode())
+
+
+def build_index(lastmods):
+    write('sitemap.xml', '\n'.join([
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+        *(
+            f'<sitemap><loc>{escape(absolute_url("/" + shard_file(shard)))}</loc>'
+            f'<lastmod>{lastmod.isoformat()}</lastmod></sitemap>'
+            for shard, lastmod in sorted(lastmods.items())
+        ),
+        '</sitemapindex>',
+    ]).encode())
+
+
+def build_feeds():
+    posts = list(
+        published_posts().select_related('author__user').prefetch_related('tags').defer('body')
+        .order_by('-publish_date', '-pk')[:FEED_SIZE]
+    )
+    for name, feed_class in FEEDS.items():
+        feed = feed_class(
+            title=FEED_TITLE, link=absolute_url('/'), description=FEED_DESCRIPTION,
+            feed_url=absolute_url('/' + name), language='en',
+        )
+        for post in posts:
+            link = absolute_url(post.get_absolute_url())
+            feed.add_item(
+                title=post.title, link=link, unique_id=link, description=post.excerpt,
+                pubdate=post.publish_date or post.created_at, updateddate=post.updated_at,
+                author_name=post.author.user.username, categories=[tag.name for tag in post.tags.all()],
+            )
+        write(name, feed.writeString('utf-8').encode())
+
+
+def update(shards=None):
+    """
+    Rewrite the given sitemap shards (every shard by default), any shard file that is missing, the sitemap
+    index and the feeds.
+    """
+    lastmods = shard_lastmods()
+    on_disk = existing_shards()
+    if shards is None:
+        shards = set(lastmods) | on_disk  # Shards left without published posts are removed
+    else:
+        shards = set(shards) | (set(lastmods) - on_disk)
+    for shard in sorted(shards):
+        build_shard(shard)
+    build_index(lastmods)
+    build_feeds()
+    return len(shards)
+
+
+class FeedFilesMiddleware:
+    """Serves the files under FEEDS_ROOT through WhiteNoise, with their gzipped copies and conditional GETs."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # autorefresh looks files up on every request instead of once at startup, since workers replace them
+        self.files = WhiteNoise(None, autorefresh=True, max_age=FEEDS_MAX_AGE)
+        self.files.add_files(FEEDS_ROOT, prefix='/')
+
+    def __call__(self, request):
+        if FILE_URL.fullmatch(request.path_info):
+            static_file = self.files.find_file(request.path_info)
+            if static_file is not None:
+                return WhiteNoiseMiddleware.serve(static_file, request)
+        return self.get_response(request)
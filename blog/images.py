@@ -0,0 +1,171 @@
+# blog/images.py
+"""
+Resized derivatives of uploaded images.
+
+Profile images and book covers are uploaded as they come off the phone. When
+one is saved with a new file, a job (blog/tasks.py) resizes it to each of
+IMAGE_WIDTHS that is not wider than the original and encodes every size in
+IMAGE_FORMATS. The files are stored next to the original as
+``<name>.<hash>.<width>w.<ext>``, where the hash is taken from the original's
+content, so a replaced image never reuses a cached URL. What was generated is
+recorded in a JSON field on the model (``image_variants`` on Profile,
+``cover_variants`` on Book) for the GraphQL ``srcset`` fields to read.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import Q
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from blog import response_cache, viewer
+from blog.models import Book, Profile
+
+try:
+    import pillow_avif  # noqa: F401 Registers the AVIF encoder on Pillow versions without one
+except ImportError:
+    pass
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WIDTHS = tuple(sorted(getattr(settings, 'IMAGE_WIDTHS', (320, 640, 1024, 1600))))
+IMAGE_FORMATS = tuple(getattr(settings, 'IMAGE_FORMATS', ('avif', 'webp', 'jpeg')))
+IMAGE_QUALITY = {'avif': 50, 'webp': 75, 'jpeg': 80, **getattr(settings, 'IMAGE_QUALITY', {})}
+IMAGE_WORKERS = getattr(settings, 'IMAGE_WORKERS', 2)  # Threads used by generate_image_variants
+
+EXTENSIONS = {'avif': 'avif', 'webp': 'webp', 'jpeg': 'jpg'}
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+# model -> (image field, field holding its derivatives)
+IMAGE_FIELDS = {
+    Profile: ('image', 'image_variants'),
+    Book: ('cover_image', 'cover_variants'),
+}
+
+def supported_formats():
+    """The configured formats this Pillow build can encode, best compression first."""
+    Image.init()
+    return [fmt for fmt in IMAGE_FORMATS if fmt.upper() in Image.SAVE]
+
+
+def target_widths(source_width):
+    """IMAGE_WIDTHS narrower than the original, plus the original width capped at the widest size. Never upscales."""
+    widths = [width for width in IMAGE_WIDTHS if width < source_width]
+    widths.append(min(source_width, IMAGE_WIDTHS[-1]))
+    return sorted(set(widths))
+
+
+def derivative_name(source_name, digest, width, fmt):
+    stem = posixpath.splitext(source_name)[0]
+    return f'{stem}.{digest}.{width}w.{EXTENSIONS[fmt]}'
+
+
+def encode(image, fmt):
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        # JPEG has no alpha channel: flatten transparent areas onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    output = io.BytesIO()
+    options = {'quality': IMAGE_QUALITY[fmt]}
+    if fmt == 'jpeg':
+        options.update(optimize=True, progressive=True)
+    image.save(output, fmt.upper(), **options)
+    return output.getvalue()
+
+
+def generate(field_file, overwrite=False):
+    """
+    Write the derivatives of an image file that are not in storage yet (all of them with ``overwrite``)
+    and return the record to keep on the model. Raises ValueError when the file is not an image.
+    """
+    storage = field_file.storage
+    with storage.open(field_file.name, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    try:
+        original = Image.open(io.BytesIO(content))
+        original = ImageOps.exif_transpose(original)  # Phone photos are often stored sideways
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError(f'{field_file.name} is not a readable image') from e
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info or 'A' in original.getbands() else 'RGB')
+
+    variants = []
+    for width in target_widths(original.width):
+        height = max(1, round(original.height * width / original.width))
+        resized = None
+        for fmt in supported_formats():
+            name = derivative_name(field_file.name, digest, width, fmt)
+            if overwrite and storage.exists(name):
+                storage.delete(name)
+            if not storage.exists(name):
+                if resized is None:
+                    resized = original.resize((width, height), Image.LANCZOS)
+                storage.save(name, ContentFile(encode(resized, fmt)))
+            variants.append({'name': name, 'width': width, 'height': height, 'format': fmt})
+    return {
+        'source': field_file.name,
+        'width': original.width,
+        'height': original.height,
+        'variants': variants,
+    }
+
+
+def needs_processing(instance):
+    image_field, variants_field = IMAGE_FIELDS[type(instance)]
+    name = getattr(instance, image_field).name or ''
+    return (getattr(instance, variants_field) or {}).get('source', '') != name
+
+
+def process(model, pk, force=False):
+    """
+    Bring the derivatives of one row up to date with its image, or regenerate them all with ``force``.
+    Returns True when the row was updated.
+    """
+    image_field, variants_field = IMAGE_FIELDS[model]
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or not (force or needs_processing(instance)):
+        return False
+    field_file = getattr(instance, image_field)
+    previous = getattr(instance, variants_field) or {}
+    record = {}
+    if field_file:
+        try:
+            record = generate(field_file, overwrite=force)
+        except (ValueError, FileNotFoundError):
+            logger.warning('Skipping image derivatives for %s %s', model.__name__, pk, exc_info=True)
+            record = {'source': field_file.name, 'variants': []}
+    # Only record the result if nobody replaced the image in the meantime
+    if field_file.name:
+        unchanged = Q(**{image_field: field_file.name})
+    else:
+        unchanged = Q(**{f'{image_field}__isnull': True}) | Q(**{image_field: ''})
+    updated = model.objects.filter(unchanged, pk=pk).update(**{variants_field: record})
+    if updated:
+        # update() sends no signals, so drop the cached copies the save handlers would have
+        response_cache.invalidate()
+        if model is Profile:
+            viewer.forget_user(instance.user_id)
+        kept = {variant['name'] for variant in record.get('variants', ())}
+        for variant in previous.get('variants', ()):
+            if variant['name'] not in kept:
+                field_file.storage.delete(variant['name'])
+    return bool(updated)
+
+
+def record_for(field_file):
+    """The derivatives record kept next to an image field's file."""
+    instance = field_file.instance
+    return getattr(instance, IMAGE_FIELDS[type(instance)][1]) or {}
+
+
+def srcset(record, fmt, storage):
+    """``url 320w, url 640w`` for one format of a derivatives record."""
+    return ', '.join(
+        f"{storage.url(variant['name'])} {variant['width']}w"
+        for variant in (record or {}).get('variants', ()) if variant['format'] == fmt
+    )
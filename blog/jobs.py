@@ -0,0 +1,175 @@
+# blog/jobs.py
+"""
+Database-backed job queue for slow side effects of saving content.
+
+Functions decorated with ``@task`` gain a ``delay(*args)`` method that inserts
+a Job row in the current transaction, so a job becomes visible to workers
+exactly when the change that caused it commits and the request returns
+without doing the work itself. An identical job that is still waiting is not
+queued twice. ``manage.py run_worker`` claims jobs with ``SELECT ... FOR
+UPDATE SKIP LOCKED`` where the database supports it and with a conditional
+UPDATE per job elsewhere (SQLite), runs them, deletes them when they succeed
+and retries failures with exponential backoff until ``max_attempts``. Jobs
+left running by a worker that died are put back after TASK_LOCK_TIMEOUT.
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from blog.models import Job
+
+logger = logging.getLogger(__name__)
+
+WORKER_CONCURRENCY = getattr(settings, 'TASK_WORKER_CONCURRENCY', 2)
+POLL_INTERVAL = getattr(settings, 'TASK_POLL_INTERVAL', 1.0)  # seconds
+LOCK_TIMEOUT = getattr(settings, 'TASK_LOCK_TIMEOUT', 600)  # seconds
+RETRY_DELAY = getattr(settings, 'TASK_RETRY_DELAY', 10)  # seconds, doubled after every failure
+
+
+def task(function=None, max_attempts=5):
+    """Register a function as a job; call ``function.delay(*args)`` to queue it. Arguments must be JSON."""
+    def register(function):
+        function.task_name = f'{function.__module__}.{function.__qualname__}'
+        function.max_attempts = max_attempts
+        function.delay = lambda *args: enqueue(function, *args)
+        return function
+    return register(function) if function is not None else register
+
+
+def job_key(name, args):
+    return hashlib.sha256(json.dumps([name, args], sort_keys=True).encode()).hexdigest()
+
+
+def enqueue(function, *args):
+    """Queue ``function(*args)`` unless the same call is already waiting."""
+    args = list(args)
+    Job.objects.bulk_create(
+        [Job(name=function.task_name, args=args, key=job_key(function.task_name, args), max_attempts=function.max_attempts)],
+        ignore_conflicts=True,  # The partial unique index on pending keys drops duplicates
+    )
+
+
+def resolve_task(name):
+    function = import_string(name)
+    if getattr(function, 'task_name', None) != name:
+        raise ImportError(f'{name} is not a registered task')
+    return function
+
+
+class Worker:
+    def __init__(self, name=None):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+
+    def claim(self, limit=1):
+        """Mark up to ``limit`` due jobs as running by this worker and return them."""
+        now = timezone.now()
+        ready = Job.objects.filter(status=Job.PENDING, run_at__lte=now).order_by('run_at', 'pk')
+        lock = {'status': Job.RUNNING, 'locked_by': self.name, 'locked_at': now, 'attempts': F('attempts') + 1}
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                claimed = list(ready.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+                Job.objects.filter(pk__in=claimed).update(**lock)
+        else:
+            # No row locks (SQLite): claim each candidate with a compare-and-set on its status
+            claimed = [
+                pk for pk in ready.values_list('pk', flat=True)[:limit]
+                if Job.objects.filter(pk=pk, status=Job.PENDING).update(**lock)
+            ]
+        return list(Job.objects.filter(pk__in=claimed).order_by('run_at', 'pk'))
+
+    def run(self, job):
+        """Run one claimed job. Returns True when it succeeded."""
+        try:
+            resolve_task(job.name)(*job.args)
+        except Exception:
+            logger.exception('Job %s failed (attempt %s of %s)', job, job.attempts, job.max_attempts)
+            self.failed(job, traceback.format_exc())
+            return False
+        Job.objects.filter(pk=job.pk).delete()
+        return True
+
+    def failed(self, job, error):
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, last_error=error, locked_by='', locked_at=None)
+            return
+        retry_at = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+        try:
+            with transaction.atomic():
+                Job.objects.filter(pk=job.pk).update(
+                    status=Job.PENDING, run_at=retry_at, last_error=error, locked_by='', locked_at=None
+                )
+        except IntegrityError:
+            # The same call was queued again meanwhile; that job will do the work
+            Job.objects.filter(pk=job.pk).delete()
+
+    def run_pending(self, limit=None):
+        """Run due jobs one at a time until there are none left (or ``limit`` ran). Returns how many ran."""
+        count = 0
+        while limit is None or count < limit:
+            jobs = self.claim()
+            if not jobs:
+                break
+            for job in jobs:
+                self.run(job)
+                count += 1
+        return count
+
+
+def release_stale_jobs():
+    """Put back jobs whose worker has held them for longer than LOCK_TIMEOUT. Returns how many."""
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - timedelta(seconds=LOCK_TIMEOUT))
+    released = 0
+    for job in stale:
+        # The timed out attempt counts as a failure. Matching on the lock skips jobs finished since the query
+        status = Job.FAILED if job.attempts >= job.max_attempts else Job.PENDING
+        try:
+            with transaction.atomic():
+                released += Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_at=job.locked_at).update(
+                    status=status, locked_by='', locked_at=None, last_error='Lock timed out'
+                )
+        except IntegrityError:
+            Job.objects.filter(pk=job.pk).delete()
+    return released
+
+
+def run_pending(limit=None):
+    """Run due jobs in the calling thread, for tests and one-off commands."""
+    return Worker().run_pending(limit)
+
+
+def work(stop, concurrency=WORKER_CONCURRENCY, poll_interval=POLL_INTERVAL):
+    """Run ``concurrency`` worker threads until the ``stop`` event is set."""
+    def loop(worker):
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                ran = worker.run_pending(limit=100)
+            except Exception:
+                logger.exception('Worker %s failed to claim jobs', worker.name)
+                ran = 0
+            if not ran:
+                stop.wait(poll_interval)
+        connection.close()
+
+    threads = []
+    for i in range(concurrency):
+        worker = Worker(f'{socket.gethostname()}:{os.getpid()}:{i}')
+        thread = threading.Thread(target=loop, args=(worker,), name=f'jobs-{i}', daemon=True)
+        thread.start()
+        threads.append(thread)
+    while not stop.wait(LOCK_TIMEOUT / 10):
+        close_old_connections()
+        release_stale_jobs()
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from blog.benchmarks import seed, suite
+
+
+class Command(BaseCommand):
+    help = "Seed a throwaway test database and benchmark the main GraphQL operations"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument('--tags', type=int, default=20)
+        parser.add_argument('--interactions', type=int, default=5000)
+        parser.add_argument('--ad-units', type=int, default=12)
+        parser.add_argument('--seed', type=int, default=1, help="Random seed for the sample data")
+        parser.add_argument('--iterations', type=int, default=50, help="Timed calls per operation")
+        parser.add_argument('--warmup', type=int, default=5, help="Untimed calls per operation")
+        parser.add_argument('--operation', action='append', dest='operations', help="Only run this operation (repeatable)")
+        parser.add_argument('--warm-cache', action='store_true', help="Let repeated reads hit the response cache")
+        parser.add_argument('--output', help="Write the results to this JSON file")
+        parser.add_argument('--baseline', help="Compare against the results in this JSON file")
+        parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed slowdown against the baseline")
+
+    def handle(self, *args, **options):
+        operations = suite.OPERATIONS
+        if options['operations']:
+            known = {operation.name: operation for operation in suite.OPERATIONS}
+            unknown = set(options['operations']) - set(known)
+            if unknown:
+                raise CommandError(f"Unknown operations: {', '.join(sorted(unknown))}")
+            operations = [known[name] for name in options['operations']]
+
+        # Never touch the configured database: seed and measure in a fresh test database
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            counts = seed.seed(
+                profiles=options['profiles'], posts=options['posts'], tags=options['tags'],
+                interactions=options['interactions'], ad_units=options['ad_units'], seed=options['seed'],
+            )
+            self.stdout.write(f"Seeded {', '.join(f'{n} {model}' for model, n in counts.items())}")
+            results = suite.run(
+                operations, iterations=options['iterations'], warmup=options['warmup'],
+                cold_cache=not options['warm_cache'], stdout=self.stdout,
+            )
+        except suite.BenchmarkError as e:
+            raise CommandError(str(e))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        results['meta']['seed'] = {**counts, 'seed': options['seed']}
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = suite.compare(results, json.load(f), options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog import feeds
+
+
+class Command(BaseCommand):
+    help = "Rebuild every sitemap shard, the sitemap index and the RSS/Atom feeds"
+
+    def handle(self, *args, **options):
+        shards = feeds.update()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {shards} sitemap shards and the feeds to {feeds.FEEDS_ROOT}"))
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Case, CharField, F, Max, Min, Value, When, Window
+from django.db.models.functions import Cast, Concat, RowNumber
+
+from blog.models import Interaction, Post
+
+
+class Command(BaseCommand):
+    help = "Delete repeated interactions by the same reader, keeping the earliest one"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report how many rows would be deleted")
+        parser.add_argument('--posts-per-scan', type=int, default=1000, help="Post id range examined per window query")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Rows deleted per transaction")
+
+    def handle(self, *args, dry_run=False, posts_per_scan=1000, chunk_size=1000, **options):
+        bounds = Interaction.objects.aggregate(low=Min('post_id'), high=Max('post_id'))
+        if bounds['low'] is None:
+            self.stdout.write("No interactions")
+            return
+
+        found = 0
+        for start in range(bounds['low'], bounds['high'] + 1, posts_per_scan):
+            end = start + posts_per_scan
+            duplicates = list(self.duplicate_ids(start, end))
+            found += len(duplicates)
+            if not dry_run:
+                for i in range(0, len(duplicates), chunk_size):
+                    self.delete(duplicates[i:i + chunk_size])
+            if duplicates:
+                self.stdout.write(f"Posts {start}-{end - 1}: {len(duplicates)} duplicates")
+
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {found} duplicate interactions"))
+
+    def duplicate_ids(self, start, end):
+        """(id, post_id) of every interaction after the first by the same reader in [start, end)."""
+        # Members are one reader however their rows were keyed; rows from before actor keys existed
+        # carry a per-row key but still have the user set.
+        reader = Case(
+            When(user__isnull=False, then=Concat(Value('u:'), Cast('user_id', CharField()))),
+            default=F('actor_key'),
+        )
+        return (
+            Interaction.objects.filter(post_id__gte=start, post_id__lt=end)
+            .annotate(
+                position=Window(RowNumber(), partition_by=[F('post_id'), F('action'), reader], order_by=F('id').asc())
+            )
+            .filter(position__gt=1)
+            .values_list('id', 'post_id')
+            .iterator()
+        )
+
+    def delete(self, rows):
+        # A plain DELETE skips loading every row for the per-row counter signal; the touched posts are
+        # recounted in the same transaction instead.
+        ids = [pk for pk, _ in rows]
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {Interaction._meta.db_table} WHERE id IN ({', '.join(['%s'] * len(ids))})", ids
+                )
+            Post.recount_interactions(Post.objects.filter(pk__in={post_id for _, post_id in rows}))
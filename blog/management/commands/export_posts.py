@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from blog import post_transfer
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = "Write posts as NDJSON, one post per line, in id order"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="Output file, '-' for stdout")
+        parser.add_argument('--batch-size', type=int, default=post_transfer.BATCH_SIZE, help="Posts read per query")
+        parser.add_argument('--after-id', type=int, default=0, help="Only export posts with a larger id")
+        parser.add_argument('--published', action='store_true', help="Only export published posts")
+
+    def handle(self, *args, path='-', batch_size=post_transfer.BATCH_SIZE, after_id=0, published=False, **options):
+        queryset = Post.objects.filter(published=True) if published else None
+        lines = post_transfer.export_lines(queryset=queryset, batch_size=batch_size, after_id=after_id)
+        if path == '-':
+            # Write through self.stdout so call_command(stdout=...) captures the lines
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        count = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            for count, line in enumerate(lines, 1):
+                f.write(line)
+        self.stderr.write(f"Exported {count} posts to {path}")
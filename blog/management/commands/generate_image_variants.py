@@ -0,0 +1,41 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
+
+from blog import images
+from blog.models import Book, Profile
+
+MODELS = {'profile': Profile, 'book': Book}
+
+
+class Command(BaseCommand):
+    help = "Generate the resized copies of existing profile images and book covers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=sorted(MODELS), action='append', dest='models', help="Only this model (repeatable)")
+        parser.add_argument('--force', action='store_true', help="Regenerate files that already exist")
+        parser.add_argument('--workers', type=int, default=images.IMAGE_WORKERS, help="Images resized at once")
+
+    def handle(self, *args, models=None, force=False, workers=1, **options):
+        for model in [MODELS[name] for name in models or sorted(MODELS)]:
+            image_field, _ = images.IMAGE_FIELDS[model]
+            pks = list(
+                model.objects.exclude(Q(**{f'{image_field}__isnull': True}) | Q(**{image_field: ''}))
+                .order_by('pk').values_list('pk', flat=True)
+            )
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    updated = sum(pool.map(lambda pk: self.process_in_thread(model, pk, force), pks))
+            else:
+                updated = sum(images.process(model, pk, force) for pk in pks)
+            self.stdout.write(f"{model.__name__}: updated {updated} of {len(pks)} images")
+        self.stdout.write(self.style.SUCCESS("Image variants are up to date"))
+
+    def process_in_thread(self, model, pk, force):
+        close_old_connections()
+        try:
+            return images.process(model, pk, force)
+        finally:
+            close_old_connections()
@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from blog import post_transfer
+
+
+class Command(BaseCommand):
+    help = "Create posts from NDJSON, one post per line, in batches; posts whose slug exists are skipped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, '-' for stdin")
+        parser.add_argument('--batch-size', type=int, default=post_transfer.BATCH_SIZE, help="Posts inserted per transaction")
+        parser.add_argument('--checkpoint', help="File recording the last imported line; an existing one resumes from there")
+
+    def handle(self, *args, path, batch_size=post_transfer.BATCH_SIZE, checkpoint=None, **options):
+        importer = post_transfer.Importer(batch_size=batch_size, checkpoint=checkpoint)
+        source = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        reported = 0
+        try:
+            for progress in importer.run(source):
+                self.stdout.write(
+                    f"Line {progress['line']}: {progress['imported']} imported, "
+                    f"{progress['skipped']} skipped, {progress['errors']} errors"
+                )
+                for number, message in importer.errors[reported:]:
+                    self.stderr.write(f"Line {number}: {message}")
+                reported = len(importer.errors)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        summary = importer.summary()
+        message = f"Imported {summary['imported']} posts, skipped {summary['skipped']}, {summary['errors']} errors"
+        self.stdout.write((self.style.WARNING if summary['errors'] else self.style.SUCCESS)(message))
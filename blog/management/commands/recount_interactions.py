@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Post
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored like, dislike and share counters on every post"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, action='append', dest='post_ids', help="Only recount this post id (repeatable)")
+
+    def handle(self, *args, post_ids=None, **options):
+        queryset = Post.objects.filter(pk__in=post_ids) if post_ids else None
+        updated = Post.recount_interactions(queryset)
+        self.stdout.write(self.style.SUCCESS(f"Recounted interactions for {updated} posts"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from blog import rollups
+
+
+class Command(BaseCommand):
+    help = "Add interactions recorded since the last run to the hourly and daily rollups; schedule it with cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=rollups.CHUNK_SIZE, help="Interactions counted per transaction")
+        parser.add_argument('--settle-seconds', type=int, default=rollups.SETTLE_SECONDS, help="Leave interactions younger than this for the next run")
+        parser.add_argument('--rebuild', action='store_true', help="Drop the rollups and count every interaction again")
+
+    def handle(self, *args, chunk_size=rollups.CHUNK_SIZE, settle_seconds=rollups.SETTLE_SECONDS, rebuild=False, **options):
+        roll_up = rollups.rebuild if rebuild else rollups.roll_up
+        counted = roll_up(chunk_size=chunk_size, settle_seconds=settle_seconds)
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {counted} interactions"))
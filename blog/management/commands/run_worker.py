@@ -0,0 +1,29 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from blog import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (search indexing, tag counts, image variants)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=jobs.WORKER_CONCURRENCY, help="Jobs run at once")
+        parser.add_argument('--poll-interval', type=float, default=jobs.POLL_INTERVAL, help="Seconds between polls when idle")
+        parser.add_argument('--once', action='store_true', help="Run the jobs that are due and exit")
+
+    def handle(self, *args, concurrency=1, poll_interval=1.0, once=False, **options):
+        if once:
+            jobs.release_stale_jobs()
+            ran = jobs.run_pending()
+            self.stdout.write(self.style.SUCCESS(f"Ran {ran} jobs"))
+            return
+
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+        self.stdout.write(f"Running jobs with {concurrency} threads")
+        jobs.work(stop, concurrency=concurrency, poll_interval=poll_interval)
+        self.stdout.write("Stopped")
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:11
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    Interaction = apps.get_model('blog', 'Interaction')
+    counters = {}
+    for action in ('like', 'dislike', 'share'):
+        counts = (
+            Interaction.objects.filter(post=models.OuterRef('pk'), action=action)
+            .order_by()
+            .values('post')
+            .annotate(total=models.Count('id'))
+            .values('total')
+        )
+        counters[f'{action}_count'] = Coalesce(models.Subquery(counts), 0)
+    Post.objects.update(**counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_book'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='share_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
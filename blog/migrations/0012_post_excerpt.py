@@ -0,0 +1,41 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:12
+
+import html
+import re
+
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+
+# A copy of blog.models.make_excerpt as of this migration, so later changes to it do not alter history
+def make_excerpt(body):
+    text = strip_tags(re.sub(r'>\s*<', '> <', body or ''))
+    return re.sub(r'\s+', ' ', html.unescape(text)).strip()[:240].rstrip()
+
+
+def backfill_excerpts(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    batch = []
+    for post in Post.objects.only('id', 'body').iterator(chunk_size=500):
+        post.excerpt = make_excerpt(post.body)
+        batch.append(post)
+        if len(batch) == 500:
+            Post.objects.bulk_update(batch, ['excerpt'])
+            batch = []
+    Post.objects.bulk_update(batch, ['excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_post_interaction_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=240),
+        ),
+        migrations.RunPython(backfill_excerpts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,121 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:14
+
+import html
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils.html import strip_tags
+
+
+# A copy of blog.models.html_to_text as of this migration, so later changes to it do not alter history
+def html_to_text(value):
+    text = strip_tags(re.sub(r'>\s*<', '> <', value or ''))
+    return re.sub(r'\s+', ' ', html.unescape(text)).strip()
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE blog_postsearchindex ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A')
+        || setweight(to_tsvector('english', subtitle), 'B')
+        || setweight(to_tsvector('english', tags), 'B')
+        || setweight(to_tsvector('english', body), 'D')
+    ) STORED
+    """,
+    "CREATE INDEX blog_postsearchindex_vector_gin ON blog_postsearchindex USING GIN (search_vector)",
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE blog_postsearchindex_fts USING fts5(
+        title, subtitle, tags, body, content='blog_postsearchindex', content_rowid='post_id'
+    )
+    """,
+    """
+    CREATE TRIGGER blog_postsearchindex_ai AFTER INSERT ON blog_postsearchindex BEGIN
+        INSERT INTO blog_postsearchindex_fts(rowid, title, subtitle, tags, body)
+        VALUES (new.post_id, new.title, new.subtitle, new.tags, new.body);
+    END
+    """,
+    """
+    CREATE TRIGGER blog_postsearchindex_ad AFTER DELETE ON blog_postsearchindex BEGIN
+        INSERT INTO blog_postsearchindex_fts(blog_postsearchindex_fts, rowid, title, subtitle, tags, body)
+        VALUES ('delete', old.post_id, old.title, old.subtitle, old.tags, old.body);
+    END
+    """,
+    """
+    CREATE TRIGGER blog_postsearchindex_au AFTER UPDATE ON blog_postsearchindex BEGIN
+        INSERT INTO blog_postsearchindex_fts(blog_postsearchindex_fts, rowid, title, subtitle, tags, body)
+        VALUES ('delete', old.post_id, old.title, old.subtitle, old.tags, old.body);
+        INSERT INTO blog_postsearchindex_fts(rowid, title, subtitle, tags, body)
+        VALUES (new.post_id, new.title, new.subtitle, new.tags, new.body);
+    END
+    """,
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS blog_postsearchindex_ai",
+    "DROP TRIGGER IF EXISTS blog_postsearchindex_ad",
+    "DROP TRIGGER IF EXISTS blog_postsearchindex_au",
+    "DROP TABLE IF EXISTS blog_postsearchindex_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # Postgres keeps a generated tsvector column under a GIN index; SQLite mirrors the table into FTS5
+    statements = {'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_REVERSE:
+            schema_editor.execute(statement)
+
+
+def backfill_search_index(apps, schema_editor):
+    Post = apps.get_model('blog', 'Post')
+    PostSearchIndex = apps.get_model('blog', 'PostSearchIndex')
+    tags = {}
+    for post_id, name in Post.tags.through.objects.values_list('post_id', 'tag__name'):
+        tags.setdefault(post_id, []).append(name)
+    documents = (
+        PostSearchIndex(
+            post_id=post['id'],
+            title=post['title'],
+            subtitle=post['subtitle'],
+            tags=' '.join(tags.get(post['id'], [])),
+            body=html_to_text(post['body']),
+        )
+        for post in Post.objects.values('id', 'title', 'subtitle', 'body').iterator(chunk_size=500)
+    )
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == 500:
+            PostSearchIndex.objects.bulk_create(batch)
+            batch = []
+    PostSearchIndex.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_post_excerpt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostSearchIndex',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_index', serialize=False, to='blog.post')),
+                ('title', models.TextField(blank=True)),
+                ('subtitle', models.TextField(blank=True)),
+                ('tags', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(backfill_search_index, migrations.RunPython.noop),
+    ]
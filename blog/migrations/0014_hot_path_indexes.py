@@ -0,0 +1,34 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:19
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_post_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='adunit',
+            index=models.Index(fields=['position'], name='blog_adunit_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='interaction',
+            index=models.Index(fields=['post', 'action'], name='blog_interact_post_action_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-publish_date', '-id'], name='blog_post_publish_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['published', '-publish_date'], name='blog_post_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='blog_tag_name_upper_idx'),
+        ),
+    ]
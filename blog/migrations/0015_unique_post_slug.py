@@ -0,0 +1,39 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:21
+
+import re
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def dedupe_slugs(apps, schema_editor):
+    # Slugs supplied through createPost were never checked, so give every duplicate but the oldest a free suffix
+    Post = apps.get_model('blog', 'Post')
+    duplicates = (
+        Post.objects.values('slug').annotate(total=models.Count('id')).filter(total__gt=1).values_list('slug', flat=True)
+    )
+    for slug in list(duplicates):
+        base = slugify(slug) or 'post'
+        pattern = re.compile(rf'{re.escape(base)}(?:-(\d+))?')
+        taken = Post.objects.filter(slug__startswith=base).values_list('slug', flat=True)
+        next_suffix = max((int(match.group(1) or 0) for match in map(pattern.fullmatch, taken) if match), default=0) + 1
+        for post in Post.objects.filter(slug=slug).order_by('id')[1:]:
+            post.slug = f'{base}-{next_suffix}'
+            post.save(update_fields=['slug'])
+            next_suffix += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='post',
+            name='slug',
+            field=models.SlugField(max_length=255, unique=True),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:24
+
+from django.db import migrations, models
+
+
+def backfill_actor_keys(apps, schema_editor):
+    # Members are keyed by user id. The sessions Interaction.save used to create were never sent to a
+    # browser, so every anonymous row stays distinct under its own session key.
+    Interaction = apps.get_model('blog', 'Interaction')
+    rows = Interaction.objects.order_by('post_id', 'action', 'id').values_list(
+        'id', 'post_id', 'action', 'user_id', 'session_id_id'
+    )
+    seen, current_post, batch = set(), None, []
+    for pk, post_id, action, user_id, session_key in rows.iterator(chunk_size=2000):
+        if post_id != current_post:
+            seen, current_post = set(), post_id
+        if user_id is not None:
+            actor_key = f'u:{user_id}'
+        elif session_key:
+            actor_key = f's:{session_key[:38]}'
+        else:
+            actor_key = f'i:{pk}'
+        if (action, actor_key) in seen:
+            # Keep duplicates distinct so the unique index can be built; dedupe_interactions removes them
+            actor_key = f'i:{pk}'
+        seen.add((action, actor_key))
+        batch.append(Interaction(id=pk, actor_key=actor_key))
+        if len(batch) == 2000:
+            Interaction.objects.bulk_update(batch, ['actor_key'])
+            batch = []
+    Interaction.objects.bulk_update(batch, ['actor_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_unique_post_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interaction',
+            name='actor_key',
+            field=models.CharField(default='', editable=False, max_length=40),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_actor_keys, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='interaction',
+            unique_together={('post', 'actor_key', 'action')},
+        ),
+        migrations.RemoveField(
+            model_name='interaction',
+            name='session_id',
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# A copy of blog.models.normalize_tag_name as of this migration, so later changes to it do not alter history
+def normalize_tag_name(name):
+    return ' '.join(name.split()).casefold()
+
+
+def build_tag_index(apps, schema_editor):
+    Tag = apps.get_model('blog', 'Tag')
+    TagIndex = apps.get_model('blog', 'TagIndex')
+    published = models.Q(post__published=True)
+    stats = Tag.objects.annotate(
+        published_count=models.Count('post', filter=published),
+        latest=models.Max('post__publish_date', filter=published),
+    ).values_list('pk', 'name', 'published_count', 'latest')
+    TagIndex.objects.bulk_create(
+        (
+            TagIndex(tag_id=pk, normalized_name=normalize_tag_name(name), post_count=count, last_published=latest)
+            for pk, name, count, latest in stats.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0016_interaction_actor_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagIndex',
+            fields=[
+                ('tag', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='index', serialize=False, to='blog.tag')),
+                ('normalized_name', models.CharField(db_index=True, max_length=100)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+                ('last_published', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-post_count', 'normalized_name'], name='blog_tagindex_cloud_idx')],
+            },
+        ),
+        migrations.RunPython(build_tag_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0017_tag_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='cover_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.3 on 2026-10-18 12:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0019_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyInteractionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('like', 'Like'), ('dislike', 'Dislike'), ('share', 'Share')], max_length=10)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HourlyInteractionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('like', 'Like'), ('dislike', 'Dislike'), ('share', 'Share')], max_length=10)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.post')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dailyinteractionrollup',
+            constraint=models.UniqueConstraint(fields=('post', 'bucket', 'action'), name='blog_daily_rollup_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyinteractionrollup',
+            constraint=models.UniqueConstraint(fields=('post', 'bucket', 'action'), name='blog_hourly_rollup_uniq'),
+        ),
+    ]
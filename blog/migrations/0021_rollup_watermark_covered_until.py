@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0020_interaction_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupwatermark',
+            name='covered_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
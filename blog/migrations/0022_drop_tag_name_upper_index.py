@@ -0,0 +1,17 @@
+# Generated by Django 5.0.3 on 2026-10-18 13:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0021_rollup_watermark_covered_until'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='tag',
+            name='blog_tag_name_upper_idx',
+        ),
+    ]
@@ -1,12 +1,31 @@
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Coalesce
 from django.db.models.signals import pre_delete
-from django.contrib.sessions.models import Session
 from django.utils import timezone
+from django.utils.crypto import salted_hmac
 from django.dispatch import receiver
-from django.shortcuts import reverse
+from django.utils.html import strip_tags
 from django.utils.text import slugify
 from tinymce.models import HTMLField
+import html
+import re
+import uuid
+
+EXCERPT_LENGTH = 240
+SLUG_ATTEMPTS = 5
+
+
+def html_to_text(value):
+    """Strip tags and entities from an HTML fragment and collapse its whitespace."""
+    # Separate adjacent tags first so "</p><p>" does not glue paragraphs together
+    text = strip_tags(re.sub(r'>\s*<', '> <', value or ''))
+    return re.sub(r'\s+', ' ', html.unescape(text)).strip()
+
+
+def make_excerpt(body):
+    return html_to_text(body)[:EXCERPT_LENGTH].rstrip()
 
 
 class Profile(models.Model):
@@ -14,6 +33,7 @@ class Profile(models.Model):
     website = models.URLField(blank=True, null=True)
     bio = models.CharField(max_length=240, blank=True, null=True)
     image = models.ImageField(upload_to='profile_images/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)  # Resized copies, see blog/images.py
 
     def __str__(self):
         return self.user.username
@@ -29,11 +49,17 @@ class Tag(models.Model):
 class Post(models.Model):
     class Meta:
         ordering = ["-publish_date"]
+        indexes = [
+            # Default ordering and the postsConnection keyset
+            models.Index(fields=['-publish_date', '-id'], name='blog_post_publish_idx'),
+            # Published listings (feeds, sitemap, tag counts)
+            models.Index(fields=['published', '-publish_date'], name='blog_post_published_idx'),
+        ]
 
     id = models.AutoField(primary_key=True)
     title = models.CharField(max_length=255, unique=True)
     subtitle = models.CharField(max_length=255, blank=True, null=False)
-    slug = models.SlugField(max_length=255, unique=False)
+    slug = models.SlugField(max_length=255, unique=True)
     body = HTMLField()
     meta_description = models.CharField(max_length=150, blank=True, null=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -42,37 +68,143 @@ class Post(models.Model):
     published = models.BooleanField(default=False)
     author = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='posts')
     tags = models.ManyToManyField(Tag, blank=True)
-
-    @property
-    def excerpt(self):
-        return self.body[:240]
+    # Plain-text preview of the body, refreshed on save so listings never need to load the body
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, editable=False)
+    # Denormalized interaction counters, kept in sync by the Interaction signals in blog/signals.py
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    dislike_count = models.PositiveIntegerField(default=0, editable=False)
+    share_count = models.PositiveIntegerField(default=0, editable=False)
 
     def get_absolute_url(self):
-        return reverse("blog:post", kwargs={"slug": self.slug})
+        # Posts are rendered by the frontend; there is no Django view to reverse
+        return settings.POST_URL_FORMAT.format(slug=self.slug)
 
     def delete(self, *args, **kwargs):
         # Delete all interactions associated with the post
         self.interactions.all().delete()
         super().delete(*args, **kwargs)
 
+    def allocate_slug(self, base, reserved=()):
+        """
+        Return ``base``, or ``base-N`` past the highest suffix already taken, using a single query.
+        ``reserved`` holds slugs about to be used by rows that are not saved yet.
+        """
+        pattern = re.compile(rf'{re.escape(base)}(?:-(\d+))?')
+        taken = Post.objects.filter(slug__startswith=base).exclude(pk=self.pk).values_list('slug', flat=True)
+        taken = [*taken, *reserved]
+        suffixes = [int(match.group(1) or 0) for match in map(pattern.fullmatch, taken) if match]
+        if not suffixes:
+            return base
+        suffix = f'-{max(suffixes) + 1}'
+        return base[:self._meta.get_field('slug').max_length - len(suffix)] + suffix
+
     def save(self, *args, **kwargs):
-        # Generate a unique slug based on the post's title
-        if not self.slug:
-            self.slug = slugify(self.title)
-            num = 1
-            while Post.objects.filter(slug=self.slug).exists():
-                self.slug = f'{slugify(self.title)}-{num}'
-                num += 1
-        super().save(*args, **kwargs)
+        # New posts and posts with a blank slug get a unique slug, based on the title if none was given
+        allocate_slug = self._state.adding or not self.slug
+        base = slugify(self.slug or self.title) or 'post'
+        # Refresh the excerpt whenever the body is loaded, without forcing a deferred body to load
+        if 'body' not in self.get_deferred_fields():
+            self.excerpt = make_excerpt(self.body)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'body' in update_fields:
+                kwargs['update_fields'] = {*update_fields, 'excerpt'}
+        if not allocate_slug:
+            return super().save(*args, **kwargs)
+
+        # The unique constraint settles races between concurrent inserts; the loser picks the next suffix
+        for attempt in range(SLUG_ATTEMPTS):
+            self.slug = self.allocate_slug(base)
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                slug_taken = Post.objects.filter(slug=self.slug).exclude(pk=self.pk).exists()
+                if not slug_taken or attempt == SLUG_ATTEMPTS - 1:
+                    raise
+
+    @staticmethod
+    def counter_field(action):
+        return f'{action}_count'
 
-    def like_count(self):
-        return self.interactions.filter(like=True).count()
+    @classmethod
+    def add_interactions(cls, counts):
+        """Add ``{(post id, action): count}`` to the stored counters with a single UPDATE."""
+        post_ids = {post_id for post_id, _ in counts}
+        counters = {}
+        for action, _ in Interaction.ACTION_CHOICES:
+            whens = [models.When(pk=post_id, then=count) for (post_id, a), count in counts.items() if a == action]
+            if whens:
+                field = cls.counter_field(action)
+                counters[field] = models.F(field) + models.Case(*whens, default=0)
+        return cls.objects.filter(pk__in=post_ids).update(**counters)
 
-    def dislike_count(self):
-        return self.interactions.filter(dislike=True).count()
+    @classmethod
+    def recount_interactions(cls, queryset=None):
+        """Rebuild the stored interaction counters with a single UPDATE."""
+        queryset = cls.objects.all() if queryset is None else queryset
+        counters = {}
+        for action, _ in Interaction.ACTION_CHOICES:
+            counts = (
+                Interaction.objects.filter(post=models.OuterRef('pk'), action=action)
+                .order_by()
+                .values('post')
+                .annotate(total=models.Count('id'))
+                .values('total')
+            )
+            counters[cls.counter_field(action)] = Coalesce(models.Subquery(counts), 0)
+        return queryset.update(**counters)
 
-    def share_count(self):
-        return self.interactions.filter(share=True).count()
+
+class PostSearchIndex(models.Model):
+    """Plain-text search document for a post; the vendor-specific index over it is built in migration 0013."""
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='search_index')
+    title = models.TextField(blank=True)
+    subtitle = models.TextField(blank=True)
+    tags = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+
+    def __str__(self):
+        return self.title
+
+
+def normalize_tag_name(name):
+    return ' '.join(name.split()).casefold()
+
+
+class TagIndex(models.Model):
+    """Per-tag published post count and latest publish date, kept up to date by the signals in blog/signals.py."""
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True, related_name='index')
+    normalized_name = models.CharField(max_length=100, db_index=True)  # casefold() can lengthen a name
+    post_count = models.PositiveIntegerField(default=0)
+    last_published = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # tagCloud
+            models.Index(fields=['-post_count', 'normalized_name'], name='blog_tagindex_cloud_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.normalized_name} ({self.post_count})"
+
+    @classmethod
+    def refresh(cls, tag_ids=None):
+        """Recompute the rows of the given tags (all tags by default) with one aggregate query and one upsert."""
+        tags = Tag.objects.all() if tag_ids is None else Tag.objects.filter(pk__in=list(tag_ids))
+        published = models.Q(post__published=True)
+        stats = tags.annotate(
+            published_count=models.Count('post', filter=published),
+            latest=models.Max('post__publish_date', filter=published),
+        ).values_list('pk', 'name', 'published_count', 'latest')
+        cls.objects.bulk_create(
+            [
+                cls(tag_id=pk, normalized_name=normalize_tag_name(name), post_count=count, last_published=latest)
+                for pk, name, count, latest in stats
+            ],
+            update_conflicts=True,
+            unique_fields=['tag'],
+            update_fields=['normalized_name', 'post_count', 'last_published'],
+        )
 
 
 class Interaction(models.Model):
@@ -84,7 +216,8 @@ class Interaction(models.Model):
     
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="interactions")
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)  # Optional for anonymous users
-    session_id = models.ForeignKey(Session, on_delete=models.SET_NULL, null=True, blank=True)  # Ensure this is a ForeignKey
+    # Who interacted: "u:<user id>" for members, "c:<keyed hash of the client key>" for anonymous readers
+    actor_key = models.CharField(max_length=40, editable=False)
     action = models.CharField(
     max_length=10, 
     choices=[('like', 'Like'), ('dislike', 'Dislike'), ('share', 'Share')],
@@ -93,18 +226,77 @@ class Interaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ('post', 'user', 'action')  # Prevent duplicate actions per user
+        unique_together = ('post', 'actor_key', 'action')  # Prevent duplicate actions per reader
+        indexes = [
+            # Per-post action counts (recount_interactions)
+            models.Index(fields=['post', 'action'], name='blog_interact_post_action_idx'),
+        ]
     
     def __str__(self):
-        return f"Interaction on {self.post.title} (Session: {self.session_id})"
-    
+        return f"Interaction on {self.post.title} (Actor: {self.actor_key})"
+
+    @staticmethod
+    def actor_key_for(user=None, client_key=None):
+        """
+        Return the actor key for a member or an anonymous client. Client keys are opaque values the
+        browser keeps in a cookie; only a keyed hash of them is stored, so they cannot be forged or
+        read back.
+        """
+        if user is not None and user.is_authenticated:
+            return f'u:{user.pk}'
+        if client_key:
+            return 'c:' + salted_hmac('blog.Interaction.actor_key', client_key).hexdigest()[:32]
+        # A made-up key would let a retried request count twice
+        raise ValueError('A client key is required for anonymous readers')
+
     def save(self, *args, **kwargs):
-        if not self.session_id:
-            session = Session.objects.create(expire_date=timezone.now() + timezone.timedelta(seconds=1209600))  # Set expire_date
-            self.session_id = session.session_key
+        if not self.actor_key:
+            # Rows created in code or the admin without an actor are never retried, so they get a key of their own
+            self.actor_key = self.actor_key_for(user=self.user) if self.user_id else f'c:{uuid.uuid4().hex}'
         super().save(*args, **kwargs)
 
 
+
+class InteractionRollup(models.Model):
+    """Interactions recorded per post, action and time bucket, maintained by ``manage.py rollup_interactions``."""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    action = models.CharField(max_length=10, choices=Interaction.ACTION_CHOICES)
+    bucket = models.DateTimeField()  # Start of the hour or day, UTC
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.post_id} {self.action} {self.bucket.isoformat()}: {self.count}"
+
+
+class HourlyInteractionRollup(InteractionRollup):
+    class Meta:
+        constraints = [
+            # One row per bucket; also serves postEngagement's post and time range lookups
+            models.UniqueConstraint(fields=['post', 'bucket', 'action'], name='blog_hourly_rollup_uniq'),
+        ]
+
+
+class DailyInteractionRollup(InteractionRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'bucket', 'action'], name='blog_daily_rollup_uniq'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """The highest Interaction id already counted by a rollup."""
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    # Every interaction recorded before this has been counted; None before the first complete run
+    covered_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_id}"
+
 class Book(models.Model):
     title = models.CharField(max_length=255)
     description = models.TextField()
@@ -112,6 +304,7 @@ class Book(models.Model):
     published_date = models.DateField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     cover_image= models.ImageField(upload_to='book_covers/', null=True, blank=True)
+    cover_variants = models.JSONField(default=dict, blank=True, editable=False)  # Resized copies, see blog/images.py
     
     @property
     def excerpt(self):
@@ -132,6 +325,11 @@ class AdUnit(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['position'], name='blog_adunit_position_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -142,6 +340,45 @@ class AdUnit(models.Model):
         return revenue
 
 
+class Job(models.Model):
+    """A queued call of a function registered with blog.jobs.task, run by ``manage.py run_worker``."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=200)  # Dotted path of the task function
+    args = models.JSONField(default=list)
+    key = models.CharField(max_length=64)  # Hash of name and args, see blog.jobs.job_key
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Workers polling for the next job
+            models.Index(fields=['status', 'run_at'], name='blog_job_ready_idx'),
+        ]
+        constraints = [
+            # At most one identical job waiting; a running copy may overlap with the next pending one
+            models.UniqueConstraint(
+                fields=['key'], condition=models.Q(status='pending'), name='blog_job_pending_key_uniq'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name}{tuple(self.args)} ({self.status})"
+
+
 @receiver(pre_delete, sender=Post)
 def delete_related_interactions(sender, instance, **kwargs):
     # Delete related interactions
@@ -0,0 +1,115 @@
+# blog/persisted_queries.py
+"""
+Automatic persisted queries and a cache of parsed, validated documents.
+
+Clients send ``extensions.persistedQuery.sha256Hash`` instead of the query text
+and only include the text after a ``PersistedQueryNotFound`` miss, following
+the Apollo APQ protocol. Independently of that, every distinct query string is
+parsed and validated against the schema once and then kept in an LRU cache.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from graphql import parse, validate
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.execution import ExecutionResult, execute
+
+from blog import concurrent_execution, query_cost
+
+CACHE_ALIAS = getattr(settings, 'GRAPHQL_RESPONSE_CACHE_ALIAS', 'graphql')
+DOCUMENT_CACHE_SIZE = getattr(settings, 'GRAPHQL_DOCUMENT_CACHE_SIZE', 1000)
+
+
+class PersistedQueryError(Exception):
+    pass
+
+
+def execute_validated(schema, document_ast, validation_errors, *args, **kwargs):
+    if validation_errors:
+        return ExecutionResult(errors=validation_errors, invalid=True)
+    kwargs.pop('validate', None)
+    # Page sizes usually come in as variables, so the cost is checked on every request
+    cost_errors, extensions = query_cost.analyze(
+        schema, document_ast, kwargs.get('operation_name'), kwargs.get('variable_values')
+    )
+    if cost_errors:
+        return ExecutionResult(errors=cost_errors, invalid=True, extensions=extensions)
+    context = kwargs.get('context_value')
+    parts = None
+    if getattr(context, 'concurrent_root_fields', False):
+        parts = concurrent_execution.split_root_fields(document_ast, kwargs.get('operation_name'))
+    if parts:
+        result = concurrent_execution.execute_concurrently(schema, parts, **kwargs)
+    else:
+        result = execute(schema, document_ast, *args, **kwargs)
+    result.extensions.update(extensions)
+    return result
+
+
+class ValidatedDocumentBackend(GraphQLCoreBackend):
+    """Backend that parses and validates each distinct query once, keeping the results in an LRU cache."""
+
+    def __init__(self, max_size=DOCUMENT_CACHE_SIZE, executor=None):
+        super().__init__(executor=executor)
+        self.max_size = max_size
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def document_from_string(self, schema, document_string):
+        key = (schema, document_string)
+        with self._lock:
+            document = self._documents.get(key)
+            if document is not None:
+                self._documents.move_to_end(key)
+                return document
+
+        # Syntax errors propagate so the view reports them as an invalid request
+        document_ast = parse(document_string)
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=partial(
+                execute_validated, schema, document_ast, validate(schema, document_ast), **self.execute_params
+            ),
+        )
+        with self._lock:
+            self._documents[key] = document
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+        return document
+
+
+document_backend = ValidatedDocumentBackend()
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+def resolve_query(query, extensions):
+    """Return the query text for a request, registering or looking up its persisted hash."""
+    persisted = (extensions or {}).get('persistedQuery')
+    if not persisted:
+        return query
+    if persisted.get('version') != 1:
+        raise PersistedQueryError('PersistedQueryNotSupported')
+    sha256_hash = persisted.get('sha256Hash')
+    if not sha256_hash:
+        raise PersistedQueryError('PersistedQueryNotFound')
+    cache = caches[CACHE_ALIAS]
+    key = f'graphql:apq:{sha256_hash}'
+    if query:
+        if query_hash(query) != sha256_hash:
+            raise PersistedQueryError('provided sha does not match query')
+        cache.set(key, query, None)
+        return query
+    query = cache.get(key)
+    if query is None:
+        raise PersistedQueryError('PersistedQueryNotFound')
+    return query
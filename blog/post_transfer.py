@@ -0,0 +1,225 @@
+# blog/post_transfer.py
+"""
+Bulk import and export of posts as NDJSON, one JSON object per line:
+
+    {"title": ..., "slug": ..., "subtitle": ..., "body": ..., "meta_description": ...,
+     "published": true, "publish_date": "2024-05-01T08:00:00+00:00", "created_at": ...,
+     "updated_at": ..., "author": "<username>", "tags": ["Culture", ...]}
+
+Exports also carry the post ``id``, which imports ignore.
+
+Both directions work in batches, so memory stays flat however long the
+stream is. Each import batch looks up its authors, tags and already-used
+slugs and titles once. It then inserts its posts and tag links with
+bulk_create in one transaction. Search indexing, tag counts and feeds are
+left to jobs (blog/tasks.py). A record whose slug belongs to a post with the
+same title and author is skipped, so running an import again is safe; when
+the slug belongs to a different post the record gets the next free slug,
+the way Post.save allocates one. The checkpoint, when given, records
+the last committed line, so an interrupted import resumes from there.
+"""
+import json
+import os
+import tempfile
+from datetime import timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+
+from blog import feeds, response_cache, tasks
+from blog.models import Post, Profile, Tag, make_excerpt
+
+BATCH_SIZE = 1000
+TIMESTAMP_FIELDS = ('publish_date', 'created_at', 'updated_at')
+TEXT_FIELDS = ('title', 'subtitle', 'slug', 'body', 'meta_description')
+
+
+class RecordError(ValueError):
+    pass
+
+
+def isoformat(value):
+    return value.isoformat() if value else None
+
+
+def export_records(queryset=None, batch_size=BATCH_SIZE, after_id=0):
+    """Yield the posts in id order as dicts, reading ``batch_size`` posts per query."""
+    queryset = Post.objects.all() if queryset is None else queryset
+    queryset = queryset.select_related('author__user').order_by('pk')
+    while True:
+        posts = list(queryset.filter(pk__gt=after_id)[:batch_size])
+        if not posts:
+            return
+        tags = {post.pk: [] for post in posts}
+        links = Post.tags.through.objects.filter(post_id__in=tags).select_related('tag').order_by('tag__name')
+        for link in links:
+            tags[link.post_id].append(link.tag.name)
+        for post in posts:
+            yield {
+                'id': post.pk,
+                **{field: getattr(post, field) for field in TEXT_FIELDS},
+                'published': post.published,
+                **{field: isoformat(getattr(post, field)) for field in TIMESTAMP_FIELDS},
+                'author': post.author.user.username,
+                'tags': tags[post.pk],
+            }
+        after_id = posts[-1].pk
+
+
+def export_lines(**kwargs):
+    for record in export_records(**kwargs):
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def parse_timestamp(value, field):
+    if value in (None, ''):
+        return None
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise RecordError(f'{field} is not an ISO 8601 date and time')
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+
+
+def clean_record(record):
+    """Check one decoded line and return the values it sets, raising RecordError when it cannot be imported."""
+    if not isinstance(record, dict):
+        raise RecordError('Expected a JSON object')
+    if not record.get('title'):
+        raise RecordError('title is required')
+    if not record.get('author'):
+        raise RecordError('author is required')
+    values = {field: str(record.get(field) or '') for field in TEXT_FIELDS}
+    values['slug'] = slugify(values['slug'] or values['title']) or 'post'
+    for field in TEXT_FIELDS:
+        max_length = Post._meta.get_field(field).max_length
+        if max_length and len(values[field]) > max_length:
+            raise RecordError(f'{field} is longer than {max_length} characters')
+    values.update({field: parse_timestamp(record.get(field), field) for field in TIMESTAMP_FIELDS})
+    values['published'] = bool(record.get('published', False))
+    tags = record.get('tags') or []
+    if not isinstance(tags, list) or not all(isinstance(tag, str) and tag for tag in tags):
+        raise RecordError('tags must be a list of names')
+    max_length = Tag._meta.get_field('name').max_length
+    if any(len(tag) > max_length for tag in tags):
+        raise RecordError(f'tag names must be at most {max_length} characters')
+    return values, str(record['author']), list(dict.fromkeys(tags))
+
+
+def restore_timestamps(post, created_at, updated_at):
+    post.created_at = created_at or post.created_at
+    post.updated_at = updated_at or post.updated_at
+    return bool(created_at or updated_at)
+
+
+class Importer:
+    def __init__(self, batch_size=BATCH_SIZE, checkpoint=None):
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.imported = 0
+        self.skipped = 0
+        self.errors = []  # (line number, message)
+
+    def summary(self):
+        return {'imported': self.imported, 'skipped': self.skipped, 'errors': len(self.errors)}
+
+    def resume_line(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint) as f:
+            return json.load(f)['line']
+
+    def save_checkpoint(self, line):
+        if not self.checkpoint:
+            return
+        directory = os.path.dirname(os.path.abspath(self.checkpoint))
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.checkpoint-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'line': line, **self.summary()}, f)
+        os.replace(temporary, self.checkpoint)
+
+    def run(self, lines):
+        """Import an iterable of NDJSON lines, yielding the summary after every committed batch."""
+        committed = self.resume_line()
+        batch = []
+        number = 0
+        for number, line in enumerate(lines, 1):
+            if number <= committed:
+                continue
+            try:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8')
+                if not line.strip():
+                    continue
+                batch.append((number, clean_record(json.loads(line))))
+            except UnicodeDecodeError:
+                self.errors.append((number, 'Not valid UTF-8'))
+            except (json.JSONDecodeError, RecordError) as e:
+                self.errors.append((number, str(e)))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                self.save_checkpoint(number)
+                batch, committed = [], number
+                yield {'line': number, **self.summary()}
+        if number > committed:
+            self.import_batch(batch)
+            self.save_checkpoint(number)
+            yield {'line': number, **self.summary()}
+
+    def import_batch(self, batch):
+        if not batch:
+            return
+        usernames = {author for _, (_, author, _) in batch}
+        authors = dict(Profile.objects.filter(user__username__in=usernames).values_list('user__username', 'pk'))
+        slugs = {values['slug'] for _, (values, _, _) in batch}
+        titles = {values['title'] for _, (values, _, _) in batch}
+        existing = {
+            slug: (title, author_id)
+            for slug, title, author_id in Post.objects.filter(slug__in=slugs).values_list('slug', 'title', 'author_id')
+        }
+        used_slugs = set(existing)
+        used_titles = set(Post.objects.filter(title__in=titles).values_list('title', flat=True))
+
+        posts, post_tags, timestamps = [], [], []
+        for number, (values, author, tag_names) in batch:
+            if existing.get(values['slug']) == (values['title'], authors.get(author)):
+                self.skipped += 1  # Imported before
+                continue
+            if values['title'] in used_titles:
+                self.errors.append((number, f"title {values['title']!r} is already used"))
+                continue
+            if author not in authors:
+                self.errors.append((number, f'unknown author {author!r}'))
+                continue
+            if values['slug'] in used_slugs:
+                # Taken by a different post; only happens on collisions, so the extra query is rare
+                values['slug'] = Post().allocate_slug(values['slug'], reserved=used_slugs)
+            used_slugs.add(values['slug'])
+            used_titles.add(values['title'])
+            posts.append(Post(author_id=authors[author], excerpt=make_excerpt(values['body']), **values))
+            post_tags.append(tag_names)
+            timestamps.append((values['created_at'], values['updated_at']))
+        if not posts:
+            return
+
+        names = {name for tag_names in post_tags for name in tag_names}
+        with transaction.atomic():
+            Tag.objects.bulk_create([Tag(name=name) for name in names], ignore_conflicts=True)
+            tags = dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+            Post.objects.bulk_create(posts)
+            # bulk_create applies auto_now and auto_now_add; put the exported timestamps back
+            restored = [post for post, stamps in zip(posts, timestamps) if restore_timestamps(post, *stamps)]
+            if restored:
+                Post.objects.bulk_update(restored, ['created_at', 'updated_at'])
+            Post.tags.through.objects.bulk_create([
+                Post.tags.through(post_id=post.pk, tag_id=tags[name])
+                for post, tag_names in zip(posts, post_tags) for name in tag_names
+            ])
+            post_ids = [post.pk for post in posts]
+            tasks.index_posts.delay(post_ids)
+            if tags:
+                tasks.refresh_tag_index.delay(sorted(tags.values()))
+            tasks.update_feeds.delay(sorted({feeds.shard_of(pk) for pk in post_ids}))
+        response_cache.invalidate()
+        self.imported += len(posts)
@@ -0,0 +1,160 @@
+# blog/query_cost.py
+"""
+Static cost and depth limits for GraphQL operations.
+
+Every object field costs its weight (1 unless listed in FIELD_WEIGHTS) and
+scalar fields are free. A field with a page size argument (``first``,
+``pageSize``, ``limit``) multiplies the cost of everything below it by that
+size; other list fields are assumed to return LIST_SIZE_ESTIMATE items. The
+cost is worked out per request, because page sizes usually arrive as
+variables.
+"""
+from django.conf import settings
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql.language.visitor import visit
+from graphql.type.definition import GraphQLList, GraphQLNonNull, GraphQLObjectType, GraphQLInterfaceType
+from graphql.validation.rules.base import ValidationRule
+from graphql.validation.validation import ValidationContext
+from graphql.utils.type_info import TypeInfo
+
+MAX_QUERY_COST = getattr(settings, 'GRAPHQL_MAX_QUERY_COST', 1000)
+MAX_QUERY_DEPTH = getattr(settings, 'GRAPHQL_MAX_QUERY_DEPTH', 10)
+LIST_SIZE_ESTIMATE = getattr(settings, 'GRAPHQL_COST_LIST_SIZE', 20)
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+PAGE_SIZE_ARGUMENTS = ('first', 'pageSize', 'limit')
+
+# "Type.field" -> cost of resolving the field once, for fields that do more work than a lookup
+FIELD_WEIGHTS = {
+    'Query.allPostsCount': 1,
+    'Query.searchPosts': 10,
+    'Query.postEngagement': 5,
+    'PostConnection.totalCount': 1,
+    'PaginatedPostType.totalCount': 1,
+    'PaginatedPostType.totalPages': 1,
+    'PostSearchConnection.totalCount': 10,
+    **getattr(settings, 'GRAPHQL_FIELD_WEIGHTS', {}),
+}
+
+
+def is_list(field_type):
+    if isinstance(field_type, GraphQLNonNull):
+        field_type = field_type.of_type
+    return isinstance(field_type, GraphQLList)
+
+
+def named_type(field_type):
+    while isinstance(field_type, (GraphQLList, GraphQLNonNull)):
+        field_type = field_type.of_type
+    return field_type
+
+
+class QueryCostRule(ValidationRule):
+    """Rejects the executed operation when its cost or depth is over budget, keeping both on ``cost`` and ``depth``."""
+
+    def __init__(self, context, operation_name=None, variables=None, max_cost=None, max_depth=None):
+        super().__init__(context)
+        self.operation_name = operation_name
+        self.variables = variables or {}
+        self.max_cost = MAX_QUERY_COST if max_cost is None else max_cost
+        self.max_depth = MAX_QUERY_DEPTH if max_depth is None else max_depth
+        self.cost = 0
+        self.depth = 0
+
+    def enter_OperationDefinition(self, node, *args):
+        if self.operation_name is not None and (node.name is None or node.name.value != self.operation_name):
+            return False
+        schema = self.context.get_schema()
+        root = {
+            'query': schema.get_query_type(),
+            'mutation': schema.get_mutation_type(),
+            'subscription': schema.get_subscription_type(),
+        }[node.operation]
+        self.cost, self.depth = self.selection_cost(node.selection_set, root, sized=False)
+        if self.depth > self.max_depth:
+            self.context.report_error(
+                GraphQLError(f'Query depth {self.depth} exceeds the maximum of {self.max_depth}', [node])
+            )
+        if self.cost > self.max_cost:
+            self.context.report_error(
+                GraphQLError(f'Query cost {self.cost} exceeds the maximum of {self.max_cost}', [node])
+            )
+        return False
+
+    def selection_cost(self, selection_set, parent_type, sized):
+        """(cost, depth) of a selection set; ``sized`` means the enclosing field already bounds the next list."""
+        cost = depth = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                field_cost, field_depth = self.field_cost(selection, parent_type, sized)
+            else:
+                if isinstance(selection, ast.FragmentSpread):
+                    fragment = self.context.get_fragment(selection.name.value)
+                else:
+                    fragment = selection
+                fragment_type = parent_type
+                if fragment.type_condition is not None:
+                    fragment_type = self.context.get_schema().get_type(fragment.type_condition.name.value)
+                field_cost, field_depth = self.selection_cost(fragment.selection_set, fragment_type, sized)
+                field_depth -= 1  # Fragments are not a level of their own
+            cost += field_cost
+            depth = max(depth, field_depth)
+        return cost, depth + 1
+
+    def field_cost(self, node, parent_type, sized):
+        name = node.name.value
+        if name.startswith('__') or not isinstance(parent_type, (GraphQLObjectType, GraphQLInterfaceType)):
+            return 0, 0
+        field = parent_type.fields.get(name)
+        if field is None:
+            return 0, 0
+        field_type = named_type(field.type)
+        if node.selection_set is None:
+            return FIELD_WEIGHTS.get(f'{parent_type.name}.{name}', 0), 0
+
+        weight = FIELD_WEIGHTS.get(f'{parent_type.name}.{name}', 1)
+        page_size = self.page_size(node, field)
+        if page_size is not None:
+            # A paged list is bounded itself; a paged wrapper (connection, page) bounds the list inside it
+            multiplier, sized = page_size, not is_list(field.type)
+        elif is_list(field.type):
+            multiplier, sized = (1 if sized else LIST_SIZE_ESTIMATE), False
+        else:
+            multiplier = 1
+        children_cost, children_depth = self.selection_cost(node.selection_set, field_type, sized)
+        return multiplier * (weight + children_cost), children_depth
+
+    def page_size(self, node, field):
+        size_argument = next((name for name in PAGE_SIZE_ARGUMENTS if name in field.args), None)
+        if size_argument is None:
+            return None
+        default = field.args[size_argument].default_value
+        size = DEFAULT_PAGE_SIZE if default is None else default
+        for argument in node.arguments or ():
+            if argument.name.value != size_argument:
+                continue
+            if isinstance(argument.value, ast.Variable):
+                size = self.variables.get(argument.value.name.value, size)
+            elif isinstance(argument.value, ast.IntValue):
+                size = int(argument.value.value)
+        try:
+            return max(1, min(int(size), MAX_PAGE_SIZE))
+        except (TypeError, ValueError):
+            return DEFAULT_PAGE_SIZE
+
+
+def analyze(schema, document_ast, operation_name=None, variables=None):
+    """Return (errors, extensions) for the operation about to run."""
+    context = ValidationContext(schema, document_ast, TypeInfo(schema))
+    rule = QueryCostRule(context, operation_name, variables)
+    visit(document_ast, rule)
+    extensions = {
+        'cost': {
+            'requestedQueryCost': rule.cost,
+            'maximumAvailable': rule.max_cost,
+            'depth': rule.depth,
+            'maximumDepth': rule.max_depth,
+        }
+    }
+    return context.get_errors(), extensions
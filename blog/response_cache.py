@@ -0,0 +1,108 @@
+# blog/response_cache.py
+"""
+Whole-response cache for public GraphQL read queries.
+
+Entries are keyed on the normalized query document, its variables, the
+operation name and the viewer class, because some PostType fields render
+differently for staff. Any write to the models those queries read bumps a
+generation number that is part of every key, which invalidates all entries at
+once on every cache backend (local memory, file or Redis).
+
+Recording an interaction does not invalidate anything: the counters on Post
+(likeCount, dislikeCount, shareCount) are bumped with F() updates that send
+no signals, so cached counts may lag by up to GRAPHQL_RESPONSE_CACHE_TTL.
+The raw ``interactions`` query is not cached for that reason.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from graphql.language import ast
+from graphql.language.printer import print_ast
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_http_authorization
+
+from blog import viewer
+
+CACHE_ALIAS = getattr(settings, 'GRAPHQL_RESPONSE_CACHE_ALIAS', 'graphql')
+CACHE_TTL = getattr(settings, 'GRAPHQL_RESPONSE_CACHE_TTL', 60)  # seconds
+GENERATION_KEY = 'graphql:response:generation'
+
+# Root fields whose output depends on nothing but the arguments and the viewer class
+CACHEABLE_ROOT_FIELDS = {
+    'allPosts', 'allPostsCount', 'postsConnection', 'searchPosts', 'postBySlug', 'postById',
+    'postsByAuthor', 'postsByTag', 'posts', 'tags', 'tagCloud', 'allProfiles', 'adUnits',
+    'bookDetails', 'authorByUsername', '__typename',
+}
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def viewer_class(request):
+    """Return 'anonymous', 'member' or 'staff', or None when the request carries a token that does not verify."""
+    user = request.user
+    token = get_http_authorization(request)
+    if token and user.is_anonymous:
+        try:
+            user = viewer.user_from_token(token, request)
+        except JSONWebTokenError:
+            return None  # Let the JWT middleware report the error
+        # The JWT middleware skips requests that already have a user
+        request.user = user
+    if user.is_anonymous:
+        return 'anonymous'
+    return 'staff' if user.is_staff or user.is_superuser else 'member'
+
+
+def cacheable_document(document, operation_name):
+    """Return the normalized query text of a parsed document, or None if the operation is not a cacheable read."""
+    operations = [
+        definition for definition in document.document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition)
+        and (operation_name is None or (definition.name and definition.name.value == operation_name))
+    ]
+    if len(operations) != 1 or operations[0].operation != 'query':
+        return None
+    for selection in operations[0].selection_set.selections:
+        if not isinstance(selection, ast.Field) or selection.name.value not in CACHEABLE_ROOT_FIELDS:
+            return None
+    # Documents are shared through the document cache, so normalize each one only once
+    if not hasattr(document, 'normalized'):
+        document.normalized = print_ast(document.document_ast)
+    return document.normalized
+
+
+def cache_key(request, document, variables, operation_name):
+    """Return the cache key for a request, or None if its response must not be cached."""
+    if document is None:
+        return None
+    normalized = cacheable_document(document, operation_name)
+    if normalized is None:
+        return None
+    viewer = viewer_class(request)
+    if viewer is None:
+        return None
+    digest = hashlib.sha256(
+        json.dumps([normalized, variables or {}, operation_name, viewer], sort_keys=True).encode()
+    ).hexdigest()
+    generation = get_cache().get(GENERATION_KEY, 0)
+    return f'graphql:response:{generation}:{digest}'
+
+
+def lookup(key):
+    return get_cache().get(key)
+
+
+def store(key, result):
+    get_cache().set(key, result, CACHE_TTL)
+
+
+def invalidate():
+    cache = get_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
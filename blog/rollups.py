@@ -0,0 +1,138 @@
+# blog/rollups.py
+"""
+Hourly and daily interaction counts per post and action.
+
+``manage.py rollup_interactions`` (run it from cron every few minutes) folds
+interactions with an id above the stored watermark into the rollup tables.
+It works in chunks of ids: each chunk is aggregated by the database, added
+to the existing bucket counts and stored together with the new watermark
+in one transaction, so an interrupted run never counts a row twice. Rows
+younger than SETTLE_SECONDS are left for the next run. Otherwise a slow
+transaction could still commit a lower id behind the watermark.
+
+Rollups count interactions as they were recorded. Deleting interactions
+(dedupe_interactions, post deletion) does not subtract from past buckets;
+``--rebuild`` recounts everything.
+"""
+from collections import OrderedDict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from blog.models import DailyInteractionRollup, HourlyInteractionRollup, Interaction, RollupWatermark
+
+WATERMARK = 'interactions'
+CHUNK_SIZE = getattr(settings, 'INTERACTION_ROLLUP_CHUNK_SIZE', 50000)
+SETTLE_SECONDS = getattr(settings, 'INTERACTION_ROLLUP_SETTLE_SECONDS', 60)
+MAX_ENGAGEMENT_BUCKETS = 1000
+
+# granularity -> (rollup model, truncation, bucket length)
+GRANULARITIES = OrderedDict([
+    ('hour', (HourlyInteractionRollup, TruncHour, timedelta(hours=1))),
+    ('day', (DailyInteractionRollup, TruncDay, timedelta(days=1))),
+])
+
+
+def next_chunk_end(last_id, chunk_size, cutoff):
+    """The highest id of the next chunk of settled interactions, or None when there are none."""
+    settled = Interaction.objects.filter(pk__gt=last_id, created_at__lt=cutoff).order_by('pk')
+    ends = list(settled.values_list('pk', flat=True)[chunk_size - 1:chunk_size])
+    return ends[0] if ends else settled.aggregate(end=Max('pk'))['end']
+
+
+def add_counts(model, truncate, interactions):
+    counts = (
+        interactions.annotate(bucket=truncate('created_at', tzinfo=dt_timezone.utc))
+        .values('post_id', 'action', 'bucket').annotate(count=Count('pk')).order_by()
+    )
+    counts = {(row['post_id'], row['action'], row['bucket']): row['count'] for row in counts}
+    if not counts:
+        return
+    buckets = [bucket for _, _, bucket in counts]
+    # A chunk covers a short stretch of time, so its bucket range bounds the rows to read
+    existing = model.objects.filter(bucket__gte=min(buckets), bucket__lte=max(buckets)).values_list(
+        'post_id', 'action', 'bucket', 'count'
+    )
+    for post_id, action, bucket, count in existing:
+        key = (post_id, action, bucket)
+        if key in counts:
+            counts[key] += count
+    model.objects.bulk_create(
+        [
+            model(post_id=post_id, action=action, bucket=bucket, count=count)
+            for (post_id, action, bucket), count in counts.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['post', 'bucket', 'action'],
+        update_fields=['count'],
+        batch_size=1000,
+    )
+
+
+def roll_up(chunk_size=CHUNK_SIZE, settle_seconds=SETTLE_SECONDS):
+    """Count the interactions recorded since the last run. Returns how many were counted."""
+    counted = 0
+    while True:
+        with transaction.atomic():
+            # The locked watermark keeps concurrent runs from adding the same chunk twice
+            RollupWatermark.objects.get_or_create(name=WATERMARK)
+            watermark = RollupWatermark.objects.select_for_update().get(name=WATERMARK)
+            cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+            end = next_chunk_end(watermark.last_id, chunk_size, cutoff)
+            if end is None:
+                # Caught up: everything recorded before the cutoff is counted, younger rows are not yet
+                watermark.covered_until = cutoff
+                watermark.save(update_fields=['covered_until', 'updated_at'])
+                return counted
+            interactions = Interaction.objects.filter(pk__gt=watermark.last_id, pk__lte=end)
+            for model, truncate, _ in GRANULARITIES.values():
+                add_counts(model, truncate, interactions)
+            counted += interactions.count()
+            watermark.last_id = end
+            watermark.save()
+
+
+def rebuild(**kwargs):
+    """Drop every rollup and count all interactions again."""
+    with transaction.atomic():
+        for model, _, _ in GRANULARITIES.values():
+            model.objects.all().delete()
+        RollupWatermark.objects.filter(name=WATERMARK).delete()
+    return roll_up(**kwargs)
+
+
+def engagement(post_id, start, end, granularity):
+    """
+    One point per bucket in [start, end), with zeros where nothing happened, as dicts with ``bucket`` and a
+    count per action. Raises ValueError when the range is empty or has more than MAX_ENGAGEMENT_BUCKETS buckets.
+    """
+    model, _, step = GRANULARITIES[granularity]
+    first = floor_bucket(start, granularity)
+    if end <= first:
+        raise ValueError('to must be after from')
+    if (end - first) / step > MAX_ENGAGEMENT_BUCKETS:
+        raise ValueError(f'At most {MAX_ENGAGEMENT_BUCKETS} buckets can be requested at once')
+
+    points = OrderedDict()
+    bucket = first
+    while bucket < end:
+        points[bucket] = {'bucket': bucket, **{action: 0 for action, _ in Interaction.ACTION_CHOICES}}
+        bucket += step
+    rows = model.objects.filter(post_id=post_id, bucket__gte=first, bucket__lt=end)
+    for bucket, action, count in rows.values_list('bucket', 'action', 'count'):
+        points[bucket][action] = count
+    return list(points.values())
+
+
+def floor_bucket(moment, granularity):
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == 'day' else moment
+
+
+def rolled_up_until():
+    """The time before which every interaction is counted, or None before the first complete run."""
+    return RollupWatermark.objects.filter(name=WATERMARK).values_list('covered_until', flat=True).first()
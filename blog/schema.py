@@ -4,18 +4,199 @@ from graphene_django import DjangoObjectType
 import graphql_jwt
 from graphql_jwt.shortcuts import  get_token
 from blog import models
+from blog import images
+from blog import rollups
+from blog.query_cost import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from blog import search
+from blog.ad_tracking import ad_counters
 from django.contrib.auth import get_user_model
 from blog.models import Post, Profile
 from social_django.utils import load_strategy
 from social_core.backends.google import GoogleOAuth2
 from social_core.exceptions import AuthTokenError
 from graphql_jwt.shortcuts import get_token
+from promise import Promise
+from promise.dataloader import DataLoader
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql_relay.connection.arrayconnection import cursor_to_offset, offset_to_cursor
+from graphene.utils.str_converters import to_snake_case
+from graphene_file_upload.scalars import Upload
+from django import forms
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.utils import timezone
+import base64
+from collections import Counter
+
+MAX_INTERACTION_BATCH = 500
+MAX_AD_IDS = 50  # Ad units rendered on one page
+
+# Post columns needed by PostType fields that are not plain model fields
+POST_FIELD_COLUMNS = {
+    'formatted_date': ('publish_date',),
+    'author': ('author',),
+}
+
+
+def selected_fields(info, *path):
+    """Return the field names selected below the current field, following ``path`` into nested selections."""
+    selections = [field.selection_set for field in info.field_asts if field.selection_set]
+    for name in (*path, None):
+        fields = {}
+        while selections:
+            selection_set = selections.pop()
+            for selection in selection_set.selections:
+                if isinstance(selection, ast.FragmentSpread):
+                    selections.append(info.fragments[selection.name.value].selection_set)
+                elif isinstance(selection, ast.InlineFragment):
+                    selections.append(selection.selection_set)
+                else:
+                    fields.setdefault(selection.name.value, []).append(selection.selection_set)
+        if name is None:
+            return set(fields)
+        selections = [selection_set for selection_set in fields.get(name, []) if selection_set]
+    return set()
+
+
+def only_selected_post_columns(queryset, info, *path, extra=()):
+    """Restrict a Post queryset to the columns the query selected, so unrequested bodies are never loaded."""
+    concrete = {field.name for field in models.Post._meta.concrete_fields}
+    columns = {'id', 'updated_at', *extra}
+    for name in selected_fields(info, *path):
+        name = to_snake_case(name)
+        if name in concrete:
+            columns.add(name)
+        columns.update(POST_FIELD_COLUMNS.get(name, ()))
+    return queryset.only(*columns)
+
+
+# limit/offset for list root fields that return a plain list; limit is what the cost rule multiplies by
+LIST_ARGUMENTS = {'limit': graphene.Int(default_value=MAX_PAGE_SIZE), 'offset': graphene.Int(default_value=0)}
+
+
+def list_page(queryset, limit, offset):
+    """At most MAX_PAGE_SIZE rows of ``queryset``, starting at ``offset``."""
+    if offset < 0:
+        raise GraphQLError('offset must not be negative')
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return queryset[offset:offset + limit]
+
+
+def note_last_modified(info, posts):
+    """Remember the newest updated_at among returned posts, sent as the response's Last-Modified."""
+    latest = max((post.updated_at for post in posts if post is not None), default=None)
+    current = getattr(info.context, 'posts_last_modified', None)
+    if latest is not None and (current is None or latest > current):
+        info.context.posts_last_modified = latest
+
+
+class ProfileLoader(DataLoader):
+    def batch_load_fn(self, keys):
+        profiles = models.Profile.objects.in_bulk(keys)
+        return Promise.resolve([profiles.get(key) for key in keys])
+
+
+class UserLoader(DataLoader):
+    def batch_load_fn(self, keys):
+        users = get_user_model().objects.select_related('profile').in_bulk(keys)
+        return Promise.resolve([users.get(key) for key in keys])
+
+
+class TagsByPostLoader(DataLoader):
+    def batch_load_fn(self, keys):
+        tags = {key: [] for key in keys}
+        links = models.Post.tags.through.objects.filter(post_id__in=keys).select_related('tag__index')
+        for link in links:
+            tags[link.post_id].append(link.tag)
+        return Promise.resolve([tags[key] for key in keys])
+
+
+class InteractionsByPostLoader(DataLoader):
+    def batch_load_fn(self, keys):
+        interactions = {key: [] for key in keys}
+        for interaction in models.Interaction.objects.filter(post_id__in=keys):
+            interactions[interaction.post_id].append(interaction)
+        return Promise.resolve([interactions[key] for key in keys])
+
+
+class Loaders:
+    """Per-request DataLoaders, so a page of posts resolves in a fixed number of queries."""
+
+    def __init__(self):
+        self.profile = ProfileLoader()
+        self.user = UserLoader()
+        self.tags_by_post = TagsByPostLoader()
+        self.interactions_by_post = InteractionsByPostLoader()
+
+
+def user_profile(user):
+    # The viewer (blog.viewer) and users from UserLoader come with their profile already joined
+    try:
+        return user.profile
+    except models.Profile.DoesNotExist:
+        return None
+
+
+def get_loaders(info):
+    # Loaders cache results, so they must never outlive the request they were created for
+    context = info.context
+    loaders = getattr(context, 'loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        context.loaders = loaders
+    return loaders
+
 
 class InteractionType(DjangoObjectType):
     class Meta:
         model = models.Interaction
         fields ='__all__'
        
+class ImageVariantType(graphene.ObjectType):
+    url = graphene.String()
+    width = graphene.Int()
+    height = graphene.Int()
+    format = graphene.String()
+    mime_type = graphene.String()
+
+
+class ResponsiveImageType(graphene.ObjectType):
+    """An uploaded image and its resized copies (blog/images.py), resolved from the image field's file."""
+    url = graphene.String()  # The original upload
+    width = graphene.Int()
+    height = graphene.Int()
+    formats = graphene.List(graphene.String)  # Best compression first, for <picture> sources
+    srcset = graphene.String(format=graphene.String(default_value='jpeg'))
+    variants = graphene.List(ImageVariantType)
+
+    def resolve_url(self, info):
+        return self.url
+
+    def resolve_width(self, info):
+        return images.record_for(self).get('width')
+
+    def resolve_height(self, info):
+        return images.record_for(self).get('height')
+
+    def resolve_formats(self, info):
+        formats = {variant['format'] for variant in images.record_for(self).get('variants', ())}
+        return [fmt for fmt in images.IMAGE_FORMATS if fmt in formats]
+
+    def resolve_srcset(self, info, format='jpeg'):
+        # Empty until the derivatives have been generated; clients fall back to url
+        return images.srcset(images.record_for(self), format, self.storage)
+
+    def resolve_variants(self, info):
+        return [
+            {**variant, 'url': self.storage.url(variant['name']), 'mime_type': images.MIME_TYPES[variant['format']]}
+            for variant in images.record_for(self).get('variants', ())
+        ]
+
+
 User = get_user_model()
 class UserType(DjangoObjectType):
     class Meta:
@@ -23,14 +204,23 @@ class UserType(DjangoObjectType):
         fields = ('id', 'username', 'first_name', 'last_name', 'email','is_active','is_staff', 'is_superuser', 'date_joined', 'last_login')
     bio = graphene.String()
     image = graphene.String()
+    image_set = graphene.Field(ResponsiveImageType)
     website = graphene.String()
 
     def resolve_bio(self, info):
-        profile = models.Profile.objects.filter(user=self).first()
+        profile = user_profile(self)
         return profile.bio if profile else None
 
+    def resolve_image(self, info):
+        profile = user_profile(self)
+        return profile.image.url if profile and profile.image else None
+
+    def resolve_image_set(self, info):
+        profile = user_profile(self)
+        return profile.image if profile and profile.image else None
+
     def resolve_website(self, info):
-        profile = models.Profile.objects.filter(user=self).first()
+        profile = user_profile(self)
         return profile.website if profile else None
     
 class ProfileType(DjangoObjectType):
@@ -40,9 +230,13 @@ class ProfileType(DjangoObjectType):
 
     # Explicitly define the user field to return UserType
     user = graphene.Field(UserType)
+    image_set = graphene.Field(ResponsiveImageType)
 
     def resolve_user(self, info):
-        return self.user  # Ensure this returns the related User instance
+        return get_loaders(info).user.load(self.user_id)  # Ensure this returns the related User instance
+
+    def resolve_image_set(self, info):
+        return self.image or None
     
 class PostType(DjangoObjectType):
     interactions = graphene.List(InteractionType)
@@ -53,7 +247,7 @@ class PostType(DjangoObjectType):
 
     class Meta:
         model = models.Post
-        fields = ('id', 'title', 'subtitle', 'excerpt', 'created_at', 'updated_at', 'publish_date', 'published', 'meta_description', 'slug', 'body', 'author', 'tags', 'interactions')
+        fields = ('id', 'title', 'subtitle', 'excerpt', 'created_at', 'updated_at', 'publish_date', 'published', 'meta_description', 'slug', 'body', 'author', 'tags', 'interactions', 'like_count', 'dislike_count', 'share_count')
     
     def resolve_is_admin_or_staff(self, info):
         user = info.context.user
@@ -68,23 +262,120 @@ class PostType(DjangoObjectType):
         return None
     
     def resolve_interactions(self, info):
-        interactions = models.Interaction.objects.filter(post=self)
-        return interactions if interactions.exists() else None # Return None instead of []
+        interactions = get_loaders(info).interactions_by_post.load(self.id)
+        return interactions.then(lambda items: items or None)  # Return None instead of []
 
     def resolve_author(self, info):
-        return self.author  # Ensure this returns a Profile object
+        return get_loaders(info).profile.load(self.author_id)  # Ensure this returns a Profile object
+
+    def resolve_tags(self, info):
+        return get_loaders(info).tags_by_post.load(self.id)
     
     def resolve_excerpt(self, info):
-        return self.body[:240]  # Return the first 240 characters of the body
+        return self.excerpt  # Precomputed on save, see Post.save
 class PaginatedPostType(graphene.ObjectType):
     posts = graphene.List(PostType, required=True)
     total_count = graphene.Int()  # total number of posts
     total_pages = graphene.Int()  # total pages based on page size
 
+    def __init__(self, queryset=None, page_size=None, **kwargs):
+        super().__init__(**kwargs)
+        self.queryset = queryset
+        self.page_size = page_size
+
+    # The count only runs when totalCount or totalPages is selected
+    def resolve_total_count(self, info):
+        if self.total_count is None and self.queryset is not None:
+            self.total_count = self.queryset.count()
+        return self.total_count
+
+    def resolve_total_pages(self, info):
+        if self.total_pages is None and self.page_size:
+            total_count = self.resolve_total_count(info)
+            self.total_pages = (total_count + self.page_size - 1) // self.page_size  # Calculate total pages
+        return self.total_pages
+
+
+class PostCursor:
+    """Opaque keyset cursor over posts, newest publish_date first and undated posts last."""
+
+    ORDERING = ('-publish_date', '-id')
+
+    @staticmethod
+    def encode(post):
+        publish_date = post.publish_date.isoformat() if post.publish_date else ''
+        return base64.urlsafe_b64encode(f'{publish_date}|{post.id}'.encode()).decode()
+
+    @staticmethod
+    def decode(cursor):
+        try:
+            publish_date, post_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return (datetime.fromisoformat(publish_date) if publish_date else None), int(post_id)
+        except (ValueError, UnicodeError):
+            raise GraphQLError('Invalid cursor')
+
+    @classmethod
+    def page(cls, queryset, cursor, limit):
+        """
+        Return up to ``limit`` posts following ``cursor``. Dated and undated posts are read
+        with separate queries so each one is a range scan over the (publish_date, id) index.
+        """
+        publish_date, post_id = cls.decode(cursor) if cursor else (None, None)
+        posts = []
+        if cursor is None or publish_date is not None:
+            dated = queryset.filter(publish_date__isnull=False)
+            if publish_date is not None:
+                dated = queryset.filter(publish_date__lte=publish_date).filter(
+                    Q(publish_date__lt=publish_date) | Q(id__lt=post_id)
+                )
+            posts = list(dated.order_by(*cls.ORDERING)[:limit])
+            post_id = None
+        if len(posts) < limit:
+            undated = queryset.filter(publish_date__isnull=True)
+            if post_id is not None:
+                undated = undated.filter(id__lt=post_id)
+            posts += undated.order_by(*cls.ORDERING)[:limit - len(posts)]
+        return posts
+
+
+class PostSearchResult(graphene.ObjectType):
+    post = graphene.Field(PostType)
+    rank = graphene.Float()
+    snippet = graphene.String()  # Escaped text with matches wrapped in <mark>
+
+
+class PostSearchConnection(graphene.relay.Connection):
+    class Meta:
+        node = PostSearchResult
+
+
+class PostConnection(graphene.relay.Connection):
+    class Meta:
+        node = PostType
+
+    total_count = graphene.Int()
+
+    def __init__(self, queryset=None, **kwargs):
+        super().__init__(**kwargs)
+        self.queryset = queryset
+
+    def resolve_total_count(self, info):
+        # Only counted when the client selects totalCount
+        return self.queryset.count()
+
 class TagType(DjangoObjectType):
     class Meta:
         model = models.Tag
 
+    post_count = graphene.Int()  # Published posts with this tag
+
+    def resolve_post_count(self, info):
+        # Every query that returns tags joins their TagIndex row
+        try:
+            return self.index.post_count
+        except models.TagIndex.DoesNotExist:
+            return 0
+
 class CreatePostInput(graphene.InputObjectType):
         title = graphene.String(required=True)
         subtitle = graphene.String(required=False)
@@ -101,15 +392,13 @@ class CreatePostMutation(graphene.Mutation):
         input = CreatePostInput(required=True)
 
     post = graphene.Field(PostType)
-    next_post_id = graphene.Int() # Return the predicted next ID
+    next_post_id = graphene.Int(deprecation_reason="Ids cannot be predicted; use post.id")
     success = graphene.Boolean()
     message = graphene.String()
 
     @staticmethod
     def mutate(root, info, input):
         user = info.context.user
-        print(f"User: {user}")
-        print("Headers:", info.context.headers)
 
         # Ensure the user is authenticated and is an admin
         if not user.is_authenticated:
@@ -117,23 +406,22 @@ class CreatePostMutation(graphene.Mutation):
         if not user.is_staff:  # Adjust this check if your admin logic is different
             return CreatePostMutation(success=False, message="Permission denied. Only admins can create posts.")
 
-        # Create the post
-        post = models.Post.objects.create(
-            title=input.title,
-            subtitle=input.subtitle,
-            slug=input.slug,
-            body=input.body,
-            author=user.profile,
-            created_at=input.createdAt,
-            updated_at=input.updatedAt,
-        )
-        if input.tags:
-            post.tags.set(input.tags)
+        # Create the post; indexing and tag counts are queued as jobs that commit with it
+        with transaction.atomic():
+            post = models.Post.objects.create(
+                title=input.title,
+                subtitle=input.subtitle,
+                slug=input.slug,  # Made unique by Post.save if another post already uses it
+                body=input.body,
+                author=user.profile,
+                created_at=input.createdAt,
+                updated_at=input.updatedAt,
+            )
+            if input.tags:
+                post.tags.set(input.tags)
 
-        # Get the last post and predict the next ID
-        last_post = models.Post.objects.order_by('-id').first()
-        next_post_id = (last_post.id + 1) if last_post else 1  # If no posts exist, start from 1
-        return CreatePostMutation(success=True, post=post, next_id=next_post_id, message="Post created successfully.")
+        # The old "next id" is the new post's id plus one; a query for it could never be right under concurrent writes
+        return CreatePostMutation(success=True, post=post, next_post_id=post.pk + 1, message="Post created successfully.")
 
 class DeletePostMutation(graphene.Mutation):
     class Arguments:
@@ -177,13 +465,45 @@ class TrackAdImpression(graphene.Mutation):
     success = graphene.Boolean()
 
     def mutate(self, info, ad_id):
+        # Buffered and flushed in batches, see blog/ad_tracking.py
         try:
-            ad = models.AdUnit.objects.get(id=ad_id)
-            ad.impressions += 1
-            ad.save()
-            return TrackAdImpression(success=True)
-        except models.AdUnit.DoesNotExist:
+            recorded = ad_counters.record_impressions([ad_id])
+        except ValueError:
             return TrackAdImpression(success=False)
+        return TrackAdImpression(success=bool(recorded))
+
+
+class TrackAdImpressions(graphene.Mutation):
+    """Record one impression for every ad unit rendered on a page."""
+
+    class Arguments:
+        ad_ids = graphene.List(graphene.ID, required=True)
+
+    success = graphene.Boolean()
+    recorded = graphene.Int()
+
+    def mutate(self, info, ad_ids):
+        if len(ad_ids) > MAX_AD_IDS:
+            return TrackAdImpressions(success=False, recorded=0)
+        try:
+            recorded = ad_counters.record_impressions(ad_ids)
+        except ValueError:
+            return TrackAdImpressions(success=False, recorded=0)
+        return TrackAdImpressions(success=True, recorded=recorded)
+
+
+class TrackAdClick(graphene.Mutation):
+    class Arguments:
+        ad_id = graphene.ID(required=True)
+
+    success = graphene.Boolean()
+
+    def mutate(self, info, ad_id):
+        try:
+            recorded = ad_counters.record_clicks([ad_id])
+        except ValueError:
+            return TrackAdClick(success=False)
+        return TrackAdClick(success=bool(recorded))
 class CustomObtainJSONWebToken(graphql_jwt.JSONWebTokenMutation):
     user = graphene.Field(UserType)
     success = graphene.Boolean()
@@ -214,21 +534,152 @@ class UpdateInteractions(graphene.Mutation):
     interactions= graphene.Field(InteractionType)  # Use DjangoObjectType
 
     def mutate(self, info, postId, action, sessionId=None):
-        try:
-            post = Post.objects.get(id=postId)
-        except Post.DoesNotExist:
+        if not Post.objects.filter(id=postId).exists():
             return UpdateInteractions(success=False, message="Post not found")
 
-        interaction, created = models.Interaction.objects.get_or_create(post=post, action=action)
-
-        interaction.count += 1
-        interaction.save()
+        # sessionId is the reader's client key; only its keyed hash is stored, no Session row
+        try:
+            actor_key = models.Interaction.actor_key_for(user=info.context.user, client_key=sessionId)
+        except ValueError as e:
+            return UpdateInteractions(success=False, message=str(e))
+        interaction = models.Interaction(
+            post_id=postId,
+            user=info.context.user if info.context.user.is_authenticated else None,
+            action=action,
+            actor_key=actor_key,
+        )
+        try:
+            with transaction.atomic():
+                interaction.save()
+        except IntegrityError:
+            return UpdateInteractions(success=False, message=f"Already recorded {action}")
 
         return UpdateInteractions(
             success=True,
             message=f"{action} updated successfully",
-            interaction=interaction
+            interactions=interaction
         )
+
+
+class InteractionEventInput(graphene.InputObjectType):
+    post_id = graphene.ID(required=True)
+    action = graphene.String(required=True)
+    client_key = graphene.String()
+
+
+class PostInteractionCounts(graphene.ObjectType):
+    post_id = graphene.ID()
+    like_count = graphene.Int()
+    dislike_count = graphene.Int()
+    share_count = graphene.Int()
+
+
+class EngagementGranularity(graphene.Enum):
+    HOUR = 'hour'
+    DAY = 'day'
+
+
+class EngagementPointType(graphene.ObjectType):
+    bucket = graphene.DateTime()  # Start of the hour or day, UTC
+    likes = graphene.Int()
+    dislikes = graphene.Int()
+    shares = graphene.Int()
+
+    def resolve_likes(self, info):
+        return self['like']
+
+    def resolve_dislikes(self, info):
+        return self['dislike']
+
+    def resolve_shares(self, info):
+        return self['share']
+
+
+class PostEngagementType(graphene.ObjectType):
+    """Interaction counts per bucket from the rollup tables (blog/rollups.py)."""
+    post_id = graphene.ID()
+    granularity = EngagementGranularity()
+    points = graphene.List(EngagementPointType)
+    rolled_up_until = graphene.DateTime()  # Interactions after this are not counted yet
+
+
+class RecordInteractions(graphene.Mutation):
+    """
+    Record a batch of interaction events. Repeats of the same (post, actor, action) are dropped, so
+    clients can safely retry a batch; anonymous readers must send the clientKey that identifies them.
+    """
+
+    class Arguments:
+        events = graphene.List(graphene.NonNull(InteractionEventInput), required=True)
+
+    success = graphene.Boolean()
+    message = graphene.String()
+    recorded = graphene.Int()  # Events that were new, so a retried batch reports 0
+    counts = graphene.List(PostInteractionCounts)
+
+    def mutate(self, info, events):
+        if len(events) > MAX_INTERACTION_BATCH:
+            return RecordInteractions(success=False, message=f"At most {MAX_INTERACTION_BATCH} events per batch")
+        actions = {action for action, _ in models.Interaction.ACTION_CHOICES}
+        try:
+            post_ids = {int(event.post_id) for event in events}
+        except ValueError:
+            return RecordInteractions(success=False, message="Invalid post id")
+        if any(event.action not in actions for event in events):
+            return RecordInteractions(success=False, message="Invalid action")
+
+        user = info.context.user if info.context.user.is_authenticated else None
+        if user is None and not all(event.client_key for event in events):
+            return RecordInteractions(success=False, message="clientKey is required for anonymous readers")
+        post_ids = set(Post.objects.filter(pk__in=post_ids).values_list('pk', flat=True))
+        # (post, actor, action) of each new event; repeats within the batch collapse here
+        wanted = {
+            (int(event.post_id), models.Interaction.actor_key_for(user=user, client_key=event.client_key), event.action)
+            for event in events
+            if int(event.post_id) in post_ids
+        }
+        def unrecorded():
+            existing = set(
+                models.Interaction.objects.filter(
+                    post_id__in={post_id for post_id, _, _ in wanted},
+                    actor_key__in={actor_key for _, actor_key, _ in wanted},
+                ).values_list('post_id', 'actor_key', 'action')
+            )
+            return sorted(wanted - existing)
+
+        new = unrecorded()
+        posts = Post.objects.filter(pk__in=post_ids)
+        if new:
+            try:
+                with transaction.atomic():
+                    models.Interaction.objects.bulk_create([
+                        models.Interaction(post_id=post_id, user=user, action=action, actor_key=actor_key)
+                        for post_id, actor_key, action in new
+                    ])
+                    # bulk_create skips the counter signals, so add the new rows to the counters in one UPDATE
+                    Post.add_interactions(Counter((post_id, action) for post_id, _, action in new))
+            except IntegrityError:
+                # A concurrent request recorded some of the same events first; keep what is still new, then recount
+                new = unrecorded()
+                models.Interaction.objects.bulk_create(
+                    [
+                        models.Interaction(post_id=post_id, user=user, action=action, actor_key=actor_key)
+                        for post_id, actor_key, action in new
+                    ],
+                    ignore_conflicts=True,
+                )
+                Post.recount_interactions(posts)
+        counts = [
+            PostInteractionCounts(post_id=pk, like_count=likes, dislike_count=dislikes, share_count=shares)
+            for pk, likes, dislikes, shares in posts.order_by('pk').values_list(
+                'pk', 'like_count', 'dislike_count', 'share_count'
+            )
+        ]
+        return RecordInteractions(
+            success=True, recorded=len(new), message=f"Recorded {len(new)} new events", counts=counts
+        )
+
+
 class Signup(graphene.Mutation):
     success = graphene.Boolean()
     message = graphene.String()
@@ -292,9 +743,13 @@ class BookType(DjangoObjectType):
     
     # Add a custom field for the excerpt
     excerpt = graphene.String()
+    cover_image_set = graphene.Field(ResponsiveImageType)
 
     def resolve_excerpt(self, info):
         return self.excerpt
+
+    def resolve_cover_image_set(self, info):
+        return self.cover_image or None
 class CreateBook(graphene.Mutation):
     class Arguments:
         title = graphene.String(required=True)
@@ -302,11 +757,21 @@ class CreateBook(graphene.Mutation):
         author = graphene.String(required=True)
         published_date = graphene.Date(required=True)
         price = graphene.Float(required=True)
-        cover_image = graphene.String(required=False)
+        cover_image = graphene.String(required=False)  # Name of a file already in book_covers/
+        cover_upload = Upload(required=False)
 
     book = graphene.Field(BookType)
 
-    def mutate(self, info, title, description, author, published_date, price,cover_image=None):
+    def mutate(self, info, title, description, author, published_date, price,cover_image=None, cover_upload=None):
+        if cover_upload is not None:
+            try:
+                cover_image = forms.ImageField().clean(cover_upload)  # Rejects files Pillow cannot read
+            except ValidationError as e:
+                raise GraphQLError(e.messages[0])
+        elif cover_image and (
+            not cover_image.startswith('book_covers/') or '..' in cover_image or not default_storage.exists(cover_image)
+        ):
+            raise GraphQLError('Unknown cover image')
         book = models.Book(
             title=title,
             description=description,
@@ -315,46 +780,117 @@ class CreateBook(graphene.Mutation):
             price=price,
             cover_image=cover_image,
         )
-        book.save()
+        book.save()  # Resized covers are generated in the background, see blog/images.py
         return CreateBook(book=book)
 
 class Query(graphene.ObjectType):
     me=graphene.Field(UserType)
     all_posts = graphene.Field(PaginatedPostType, page=graphene.Int(), page_size=graphene.Int())
+    posts_connection = graphene.Field(PostConnection, after=graphene.String(), first=graphene.Int())
+    search_posts = graphene.Field(
+        PostSearchConnection, query=graphene.String(required=True), first=graphene.Int(), after=graphene.String()
+    )
     allPostsCount = graphene.Int()
     author_by_username = graphene.Field(UserType, username=graphene.String())
     post_by_slug = graphene.Field(PostType, slug=graphene.String())
-    posts_by_author = graphene.List(PostType, username=graphene.String())
-    posts_by_tag = graphene.List(PostType, tag=graphene.String())
+    posts_by_author = graphene.List(PostType, username=graphene.String(), **LIST_ARGUMENTS)
+    posts_by_tag = graphene.List(PostType, tag=graphene.String(), **LIST_ARGUMENTS)
     post_by_id = graphene.Field(PostType, id=graphene.ID(required= True))
     
-    posts = graphene.List(PostType)
-    tags = graphene.List(TagType)
+    posts = graphene.List(PostType, **LIST_ARGUMENTS)
+    tags = graphene.List(TagType, **LIST_ARGUMENTS)
+    tag_cloud = graphene.List(TagType, limit=graphene.Int(default_value=30))
 
-    all_profiles = graphene.List(ProfileType)
+    all_profiles = graphene.List(ProfileType, **LIST_ARGUMENTS)
     user= graphene.Field(UserType)
 
     ad_units = graphene.List(AdUnitType, position=graphene.String())
-    interactions = graphene.List(InteractionType, post_id=graphene.ID(required=True))
+    interactions = graphene.List(
+        InteractionType,
+        post_id=graphene.ID(required=True),
+        deprecation_reason="Use postEngagement for counts",
+        **LIST_ARGUMENTS,
+    )
+    post_engagement = graphene.Field(
+        PostEngagementType,
+        post_id=graphene.ID(required=True),
+        from_=graphene.DateTime(name='from'),
+        to=graphene.DateTime(),
+        granularity=EngagementGranularity(),
+    )
     book_details = graphene.Field(BookType, id=graphene.ID(required=True))
-    def resolve_posts(self, info):
-        return models.Post.objects.all()
+    def resolve_posts(self, info, limit=MAX_PAGE_SIZE, offset=0):
+        return list_page(models.Post.objects.all(), limit, offset)
 
-    def resolve_tags(self, info):
-        return models.Tag.objects.all()
+    def resolve_tags(self, info, limit=MAX_PAGE_SIZE, offset=0):
+        return list_page(models.Tag.objects.select_related('index').order_by('name', 'pk'), limit, offset)
+
+    def resolve_tag_cloud(self, info, limit=30):
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        entries = models.TagIndex.objects.filter(post_count__gt=0).select_related('tag')
+        return [entry.tag for entry in entries.order_by('-post_count', 'normalized_name')[:limit]]
     def resolve_me(self, info):
         user = info.context.user
         if user.is_anonymous:
             raise Exception("Authentication required!")
         return user
 
-    def resolve_all_posts(self, info, page=1, page_size=10):
-        total_count = models.Post.objects.count()  # Get the total count of posts
-        total_pages = (total_count + page_size - 1) // page_size  # Calculate total pages
+    def resolve_all_posts(self, info, page=1, page_size=DEFAULT_PAGE_SIZE):
+        if page < 1:
+            raise GraphQLError('page must be 1 or more')
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+        queryset = models.Post.objects.all()
         offset = (page - 1) * page_size
-        posts = models.Post.objects.all()[offset:offset + page_size] # Fetch paginated posts
-        return PaginatedPostType(posts=posts, total_count=total_count, total_pages=total_pages)
-
+        posts = list(only_selected_post_columns(queryset, info, 'posts')[offset:offset + page_size]) # Fetch paginated posts
+        note_last_modified(info, posts)
+        return PaginatedPostType(posts=posts, queryset=queryset, page_size=page_size)
+
+    def resolve_posts_connection(self, info, after=None, first=10):
+        first = max(1, min(first, MAX_PAGE_SIZE))
+        queryset = models.Post.objects.all()
+        columns = only_selected_post_columns(queryset, info, 'edges', 'node', extra=['publish_date'])
+        posts = PostCursor.page(columns, after, first + 1)  # One extra row tells us whether there is a next page
+        has_next_page = len(posts) > first
+        posts = posts[:first]
+        note_last_modified(info, posts)
+        edges = [PostConnection.Edge(node=post, cursor=PostCursor.encode(post)) for post in posts]
+        page_info = graphene.relay.PageInfo(
+            has_next_page=has_next_page,
+            has_previous_page=bool(after),
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+        )
+        return PostConnection(edges=edges, page_info=page_info, queryset=queryset)
+
+
+    def resolve_search_posts(self, info, query, first=10, after=None):
+        first = max(1, min(first, MAX_PAGE_SIZE))
+        # Ranked results have no stable keyset, so the cursor is an offset into the ranking
+        offset = 0
+        if after:
+            position = cursor_to_offset(after)
+            if position is None:
+                raise GraphQLError('Invalid cursor')
+            offset = position + 1
+        hits = search.search_posts(query, first + 1, offset)
+        has_next_page = len(hits) > first
+        hits = hits[:first]
+        posts = only_selected_post_columns(models.Post.objects.all(), info, 'edges', 'node', 'post')
+        posts = posts.in_bulk([hit.post_id for hit in hits])
+        edges = [
+            PostSearchConnection.Edge(
+                node=PostSearchResult(post=posts.get(hit.post_id), rank=hit.rank, snippet=hit.snippet),
+                cursor=offset_to_cursor(offset + index),
+            )
+            for index, hit in enumerate(hits)
+        ]
+        page_info = graphene.relay.PageInfo(
+            has_next_page=has_next_page,
+            has_previous_page=offset > 0,
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+        )
+        return PostSearchConnection(edges=edges, page_info=page_info)
 
     def resolve_author_by_username(root, info, username):
         return models.Profile.objects.select_related("user").get(
@@ -362,29 +898,29 @@ class Query(graphene.ObjectType):
         )
 
     def resolve_post_by_slug(root, info, slug):
-        return models.Post.objects.filter(slug=slug).first()
+        post = models.Post.objects.filter(slug=slug).first()
+        note_last_modified(info, [post])
+        return post
     
     def resolve_post_by_id(self, info, id):
         try:
-            return models.Post.objects.get(pk=id)
+            post = models.Post.objects.get(pk=id)
         except models.Post.DoesNotExist:
             return None
-
-    def resolve_posts_by_author(root, info, username):
-        return (
-            models.Post.objects.prefetch_related("tags")
-            .select_related("author")
-            .filter(author__user__username=username)
-        )
-
-    def resolve_posts_by_tag(root, info, tag):
-        return (
-            models.Post.objects.prefetch_related("tags")
-            .select_related("author")
-            .filter(tags__name__iexact=tag)
-        )
-    def resolve_all_profiles(self, info):
-        return models.Profile.objects.select_related("user").all()
+        note_last_modified(info, [post])
+        return post
+
+    def resolve_posts_by_author(root, info, username, limit=MAX_PAGE_SIZE, offset=0):
+        # Authors and tags are batched by the request loaders
+        posts = models.Post.objects.filter(author__user__username=username)
+        return list_page(only_selected_post_columns(posts, info), limit, offset)
+
+    def resolve_posts_by_tag(root, info, tag, limit=MAX_PAGE_SIZE, offset=0):
+        tags = models.TagIndex.objects.filter(normalized_name=models.normalize_tag_name(tag)).values('tag_id')
+        posts = models.Post.objects.filter(tags__in=tags)
+        return list_page(only_selected_post_columns(posts, info), limit, offset)
+    def resolve_all_profiles(self, info, limit=MAX_PAGE_SIZE, offset=0):
+        return list_page(models.Profile.objects.select_related("user").order_by('pk'), limit, offset)
     
     def resolve_user(self, info):
         user = info.context.user
@@ -397,11 +933,27 @@ class Query(graphene.ObjectType):
             return models.AdUnit.objects.filter(position=position)
         return models.AdUnit.objects.all()
     
-    def resolve_interactions(self, info, post_id):
-        interactions = models.Interaction.objects.filter(post_id=post_id)
-        if not interactions.exists():
-            return []
-        return interactions # Ensure empty set is returned None instead of []
+    def resolve_interactions(self, info, post_id, limit=MAX_PAGE_SIZE, offset=0):
+        interactions = models.Interaction.objects.filter(post_id=post_id).order_by('pk')
+        return list_page(interactions, limit, offset)
+
+    def resolve_post_engagement(self, info, post_id, from_=None, to=None, granularity=None):
+        # Defaults: the last 48 hours by hour, or the last 30 days by day
+        granularity = granularity or EngagementGranularity.DAY.value
+        to = to or timezone.now()
+        if timezone.is_naive(to):
+            to = timezone.make_aware(to, dt_timezone.utc)
+        if from_ is None:
+            from_ = to - (timedelta(hours=48) if granularity == EngagementGranularity.HOUR.value else timedelta(days=30))
+        elif timezone.is_naive(from_):
+            from_ = timezone.make_aware(from_, dt_timezone.utc)
+        try:
+            points = rollups.engagement(int(post_id), from_, to, granularity)
+        except ValueError as e:
+            raise GraphQLError(str(e))
+        return PostEngagementType(
+            post_id=post_id, granularity=granularity, points=points, rolled_up_until=rollups.rolled_up_until()
+        )
     
     def resolve_book_details(root, info, id):
         return models.Book.objects.get(pk=id)
@@ -410,12 +962,15 @@ class Mutation(graphene.ObjectType):
     verify_token = graphql_jwt.Verify.Field()
     refresh_token = graphql_jwt.Refresh.Field()
     update_interactions = UpdateInteractions.Field()
+    record_interactions = RecordInteractions.Field()
     signup = Signup.Field()
     login = Login.Field()
     create_post = CreatePostMutation.Field()
     delete_post = DeletePostMutation.Field()
 
     track_ad_impression = TrackAdImpression.Field() # Track ad impressions
+    track_ad_impressions = TrackAdImpressions.Field()
+    track_ad_click = TrackAdClick.Field()
     authenticate_with_google = AuthenticateWithGoogle.Field()
 
     create_book = CreateBook.Field()
@@ -0,0 +1,139 @@
+# blog/search.py
+"""
+Full-text search over posts.
+
+Every post has a ``PostSearchIndex`` row holding its title, subtitle, tag names
+and HTML-stripped body. Postgres ranks matches with a generated, weighted
+``tsvector`` column under a GIN index; SQLite uses an FTS5 table kept in sync by
+triggers. Both are created in migration 0013.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+
+from blog.models import Post, PostSearchIndex, html_to_text
+
+# Control characters survive ts_headline/snippet untouched and never occur in post text
+HIGHLIGHT_START, HIGHLIGHT_STOP = '\x02', '\x03'
+
+POSTGRES_SEARCH = """
+    SELECT hit.post_id, hit.rank, ts_headline(
+        'english', hit.body, hit.query,
+        'StartSel=' || %s || ', StopSel=' || %s || ', MaxWords=35, MinWords=15'
+    )
+    FROM (
+        SELECT document.post_id, document.body, query.query, ts_rank_cd(document.search_vector, query.query) AS rank
+        FROM blog_postsearchindex document, websearch_to_tsquery('english', %s) AS query(query)
+        WHERE document.search_vector @@ query.query
+        ORDER BY rank DESC, document.post_id DESC
+        LIMIT %s OFFSET %s
+    ) hit
+    ORDER BY hit.rank DESC, hit.post_id DESC
+"""
+
+# bm25() is lower-is-better, and the column weights favour title over subtitle and tags over body
+SQLITE_SEARCH = """
+    SELECT rowid, -bm25(blog_postsearchindex_fts, 10.0, 4.0, 4.0, 1.0) AS rank,
+           snippet(blog_postsearchindex_fts, -1, %s, %s, '…', 24)
+    FROM blog_postsearchindex_fts
+    WHERE blog_postsearchindex_fts MATCH %s
+    ORDER BY rank DESC, rowid DESC
+    LIMIT %s OFFSET %s
+"""
+
+
+class SearchHit:
+    def __init__(self, post_id, rank, snippet):
+        self.post_id = post_id
+        self.rank = rank
+        self.snippet = highlight(snippet)
+
+
+def highlight(snippet):
+    """Escape a raw snippet and turn the highlight markers into <mark> tags."""
+    return escape(snippet or '').replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+
+
+def index_post(post_id):
+    """Create or refresh the search document for one post."""
+    post = Post.objects.filter(pk=post_id).values('title', 'subtitle', 'body').first()
+    if post is None:
+        return
+    tags = Post.tags.through.objects.filter(post_id=post_id).values_list('tag__name', flat=True)
+    PostSearchIndex.objects.update_or_create(
+        post_id=post_id,
+        defaults={
+            'title': post['title'],
+            'subtitle': post['subtitle'],
+            'tags': ' '.join(tags),
+            'body': html_to_text(post['body']),
+        },
+    )
+
+
+def fts5_query(query):
+    # Quote every term so user input can never be parsed as FTS5 syntax; the last term matches as a prefix
+    terms = ['"%s"' % term for term in re.findall(r'\w+', query)]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_posts(query, limit, offset=0):
+    """Return up to ``limit`` ranked ``SearchHit`` objects for ``query``, best match first."""
+    query = (query or '').strip()
+    if not query:
+        return []
+    if connection.vendor == 'postgresql':
+        params = [HIGHLIGHT_START, HIGHLIGHT_STOP, query, limit, offset]
+        sql = POSTGRES_SEARCH
+    elif connection.vendor == 'sqlite':
+        match = fts5_query(query)
+        if not match:
+            return []
+        params = [HIGHLIGHT_START, HIGHLIGHT_STOP, match, limit, offset]
+        sql = SQLITE_SEARCH
+    else:
+        return _search_without_index(query, limit, offset)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [SearchHit(*row) for row in cursor.fetchall()]
+
+
+def _search_without_index(query, limit, offset):
+    # Unranked fallback for databases without a full-text index
+    matches = Q()
+    for field in ('title', 'subtitle', 'tags', 'body'):
+        matches |= Q(**{f'{field}__icontains': query})
+    documents = PostSearchIndex.objects.filter(matches).order_by('-post_id')[offset:offset + limit]
+    return [SearchHit(document.post_id, 0.0, document.body[:200]) for document in documents]
+
+
+def search_post_ids(query, limit=1000):
+    return [hit.post_id for hit in search_posts(query, limit)]
+
+
+def matching_posts(query):
+    """A filter for every post matching ``query``, unranked and without a limit, e.g. for the admin."""
+    query = (query or '').strip()
+    if connection.vendor == 'postgresql' and query:
+        return Q(pk__in=RawSQL(
+            "SELECT post_id FROM blog_postsearchindex WHERE search_vector @@ websearch_to_tsquery('english', %s)",
+            [query],
+        ))
+    if connection.vendor == 'sqlite':
+        match = fts5_query(query)
+        if not match:
+            return Q(pk__in=[])
+        return Q(pk__in=RawSQL(
+            'SELECT rowid FROM blog_postsearchindex_fts WHERE blog_postsearchindex_fts MATCH %s', [match]
+        ))
+    if not query:
+        return Q(pk__in=[])
+    matches = Q()
+    for field in ('title', 'subtitle', 'tags', 'body'):
+        matches |= Q(**{f'search_index__{field}__icontains': query})
+    return matches
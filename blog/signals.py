@@ -1,12 +1,133 @@
 # myapp/signals.py
 # backend/blog/signals.py
 
-from django.db.models.signals import post_save
+from django.contrib.auth import get_user_model
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import Post
+from . import feeds, images, response_cache, tasks, viewer
+from .ad_tracking import ad_counters
+from .models import AdUnit, Book, Interaction, Post, Profile, Tag, TagIndex
 
 
+# Slow work runs in blog/tasks.py jobs, queued in the saving transaction and picked up by run_worker
+
 @receiver(post_save, sender=Post)
 def post_save_handler(instance, **kwargs):
-    # Your signal handling code here
-    pass
+    tasks.index_posts.delay([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Post)
+@receiver([post_save, post_delete], sender=Tag)
+@receiver([post_save, post_delete], sender=AdUnit)
+@receiver([post_save, post_delete], sender=Book)
+@receiver([post_save, post_delete], sender=Profile)
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_response_cache(**kwargs):
+    response_cache.invalidate()
+
+
+@receiver([post_save, post_delete], sender=AdUnit)
+def forget_known_ad_ids(**kwargs):
+    ad_counters.forget_known_ids()
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def forget_cached_viewer(instance, **kwargs):
+    viewer.forget_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Profile)
+def forget_cached_viewer_profile(instance, **kwargs):
+    viewer.forget_user(instance.user_id)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender=Book)
+def generate_image_variants(instance, **kwargs):
+    if images.needs_processing(instance):
+        tasks.generate_image_variants.delay(instance._meta.label, instance.pk)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def post_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        tasks.index_posts.delay([instance.pk])
+    elif pk_set:
+        # Tag.post_set changes name the posts directly
+        tasks.index_posts.delay(sorted(pk_set))
+
+
+@receiver(post_save, sender=Interaction)
+def increment_interaction_counter(instance, created, **kwargs):
+    if created:
+        field = Post.counter_field(instance.action)
+        Post.objects.filter(pk=instance.post_id).update(**{field: F(field) + 1})
+
+
+@receiver(post_delete, sender=Interaction)
+def decrement_interaction_counter(instance, **kwargs):
+    field = Post.counter_field(instance.action)
+    Post.objects.filter(pk=instance.post_id, **{f'{field}__gt': 0}).update(**{field: F(field) - 1})
+
+
+def refresh_tag_counts(tag_ids):
+    tag_ids = sorted(tag_ids)
+    if tag_ids:
+        tasks.refresh_tag_index.delay(tag_ids)
+
+
+@receiver(post_save, sender=Tag)
+def tag_saved(instance, **kwargs):
+    # Inline, so postsByTag finds a new or renamed tag straight away
+    TagIndex.refresh([instance.pk])
+
+
+@receiver(post_save, sender=Post)
+def post_publication_changed(instance, created, **kwargs):
+    # A new post has no tags yet; later saves may publish, unpublish or re-date it
+    if not created:
+        refresh_tag_counts(instance.tags.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_deleted_post_tags(instance, **kwargs):
+    instance.deleted_tag_ids = list(instance.tags.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(instance, **kwargs):
+    refresh_tag_counts(getattr(instance, 'deleted_tag_ids', ()))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def refresh_tag_index(instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # Tag.post_set changed: only that tag's counts move
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_tag_counts([instance.pk])
+    elif action == 'pre_clear':
+        instance.cleared_tag_ids = list(instance.tags.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        refresh_tag_counts(getattr(instance, 'cleared_tag_ids', ()))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        refresh_tag_counts(pk_set)
+
+
+@receiver([post_save, post_delete], sender=Post)
+def queue_feed_update(instance, **kwargs):
+    # Publishing, editing, unpublishing or deleting a post all change its sitemap shard and maybe the feeds
+    tasks.update_feeds.delay([feeds.shard_of(instance.pk)])
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def queue_feed_update_for_tags(instance, action, reverse, pk_set, **kwargs):
+    # Feed entries list their tags
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        tasks.update_feeds.delay([feeds.shard_of(instance.pk)])
+    elif pk_set:
+        tasks.update_feeds.delay(sorted({feeds.shard_of(post_id) for post_id in pk_set}))
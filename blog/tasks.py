@@ -0,0 +1,31 @@
+# blog/tasks.py
+"""Jobs queued by the save handlers in blog/signals.py and run by ``manage.py run_worker``."""
+from django.apps import apps
+
+from blog import feeds, images, response_cache, search
+from blog.jobs import task
+from blog.models import TagIndex
+
+
+@task
+def index_posts(post_ids):
+    for post_id in post_ids:
+        search.index_post(post_id)
+    # Cached search results were built from the old index
+    response_cache.invalidate()
+
+
+@task
+def refresh_tag_index(tag_ids):
+    TagIndex.refresh(tag_ids)
+    response_cache.invalidate()
+
+
+@task
+def generate_image_variants(model_label, pk):
+    images.process(apps.get_model(model_label), pk)
+
+
+@task
+def update_feeds(shards):
+    feeds.update(shards)
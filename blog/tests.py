@@ -1,3 +1,1461 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models import QuerySet
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from graphql import parse, validate
+from graphql_jwt.shortcuts import get_token
+from PIL import Image
+
+from blog import concurrent_execution, feeds, jobs, models, post_transfer, response_cache, rollups, tracing, viewer
+from blog.ad_tracking import ad_counters
+from blog.benchmarks import seed as benchmark_seed, suite as benchmark_suite
+from blog.persisted_queries import ValidatedDocumentBackend
+from blog.schema import schema
+from blog.search import search_post_ids
+from blog.views import async_graphql_view
+
+
+def make_request(user=None):
+    request = RequestFactory().post('/graphql/')
+    request.user = user or AnonymousUser()
+    return request
+
+
+def setUpModule():
+    # Jobs run by the tests rewrite the sitemap and feeds; keep them out of the project directory
+    feeds_root = tempfile.TemporaryDirectory()
+    unittest.addModuleCleanup(feeds_root.cleanup)
+    patcher = mock.patch.object(feeds, 'FEEDS_ROOT', feeds_root.name)
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+
+
+@jobs.task(max_attempts=2)
+def failing_task(value):
+    raise ValueError(f'Cannot handle {value}')
+
+
+class PostLoaderTests(TestCase):
+    PAGE_QUERY = '''
+        query ($pageSize: Int) {
+            allPosts(page: 1, pageSize: $pageSize) {
+                totalCount
+                posts {
+                    title
+                    author { bio user { username } }
+                    tags { name }
+                    interactions { action }
+                }
+            }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        tags = [models.Tag.objects.create(name=f'tag-{i}') for i in range(5)]
+        for i in range(10):
+            user = User.objects.create_user(username=f'author-{i}')
+            models.Profile.objects.create(user=user, bio=f'Bio {i}')
+        profiles = list(models.Profile.objects.all())
+        posts = [
+            models.Post.objects.create(title=f'Post {i}', slug=f'post-{i}', body='<p>Body</p>', author=profiles[i % 10])
+            for i in range(100)
+        ]
+        for i, post in enumerate(posts):
+            post.tags.set(tags[: i % 5 + 1])
+        models.Interaction.objects.bulk_create(
+            models.Interaction(post=post, action=action) for post in posts[::2] for action in ('like', 'share')
+        )
+
+    def test_page_resolves_in_fixed_number_of_queries(self):
+        # count, posts, profiles, users, tags, interactions
+        with self.assertNumQueries(6):
+            result = schema.execute(self.PAGE_QUERY, variables={'pageSize': 100}, context_value=make_request())
+        self.assertIsNone(result.errors)
+        posts = result.data['allPosts']['posts']
+        self.assertEqual(len(posts), 100)
+        self.assertTrue(all(post['author']['user']['username'].startswith('author-') for post in posts))
+        self.assertEqual(sum(len(post['tags']) for post in posts), 300)
+        self.assertEqual(sum(1 for post in posts if post['interactions'] is None), 50)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        with self.assertNumQueries(6):
+            schema.execute(self.PAGE_QUERY, variables={'pageSize': 5}, context_value=make_request())
+
+
+class InteractionCounterTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='writer')
+        profile = models.Profile.objects.create(user=user)
+        self.post = models.Post.objects.create(title='Counted', body='<p>Body</p>', author=profile)
+        self.readers = [User.objects.create_user(username=f'reader-{i}') for i in range(3)]
+
+    def interact(self, user, action):
+        return models.Interaction.objects.create(post=self.post, user=user, action=action)
+
+    def test_counters_follow_created_and_deleted_interactions(self):
+        for reader in self.readers:
+            self.interact(reader, 'like')
+        share = self.interact(self.readers[0], 'share')
+        self.interact(self.readers[1], 'dislike')
+        share.delete()
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.dislike_count, self.post.share_count), (3, 1, 0))
+
+    def test_recount_command_rebuilds_counters(self):
+        models.Interaction.objects.bulk_create(
+            models.Interaction(
+                post=self.post, user=reader, action='share', actor_key=models.Interaction.actor_key_for(user=reader)
+            )
+            for reader in self.readers
+        )
+        call_command('recount_interactions', stdout=StringIO())
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.share_count), (0, 3))
+
+    def test_anonymous_interactions_do_not_create_sessions(self):
+        with self.assertNumQueries(2):  # insert plus the counter update
+            interaction = self.interact(None, 'like')
+        self.assertTrue(interaction.actor_key.startswith('c:'))
+        self.assertFalse(Session.objects.exists())
+
+    def test_one_interaction_per_actor_and_action(self):
+        key = models.Interaction.actor_key_for(client_key='browser-1')
+        self.assertEqual(key, models.Interaction.actor_key_for(client_key='browser-1'))
+        self.assertNotIn('browser-1', key)
+        models.Interaction.objects.create(post=self.post, action='like', actor_key=key)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            models.Interaction.objects.create(post=self.post, action='like', actor_key=key)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.interact(self.readers[0], 'like')
+            self.interact(self.readers[0], 'like')
+
+    def test_update_interactions_mutation_dedupes_by_client_key(self):
+        mutation = '''
+            mutation ($postId: ID!) {
+                updateInteractions(postId: $postId, action: "like", sessionId: "browser-1") { success }
+            }
+        '''
+        results = [
+            schema.execute(mutation, variable_values={'postId': self.post.pk}, context_value=make_request())
+            for _ in range(2)
+        ]
+        self.assertEqual([r.data['updateInteractions']['success'] for r in results], [True, False])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertFalse(Session.objects.exists())
+
+    def test_record_interactions_batch_is_idempotent(self):
+        other = models.Post.objects.create(title='Other', body='<p>Body</p>', author=self.post.author)
+        mutation = '''
+            mutation ($events: [InteractionEventInput!]!) {
+                recordInteractions(events: $events) { success recorded counts { postId likeCount shareCount } }
+            }
+        '''
+        events = [
+            {'postId': self.post.pk, 'action': 'like', 'clientKey': 'browser-1'},
+            {'postId': self.post.pk, 'action': 'like', 'clientKey': 'browser-1'},
+            {'postId': self.post.pk, 'action': 'like', 'clientKey': 'browser-2'},
+            {'postId': other.pk, 'action': 'share', 'clientKey': 'browser-1'},
+            {'postId': 0, 'action': 'like', 'clientKey': 'browser-1'},
+        ]
+        expected = [
+            {'postId': str(self.post.pk), 'likeCount': 2, 'shareCount': 0},
+            {'postId': str(other.pk), 'likeCount': 0, 'shareCount': 1},
+        ]
+        # Posts, existing rows, savepoint, insert, counter update, release, counts; a retry inserts nothing
+        for queries, recorded in ((7, 3), (3, 0)):
+            with self.assertNumQueries(queries):
+                result = schema.execute(mutation, variable_values={'events': events}, context_value=make_request())
+            self.assertIsNone(result.errors)
+            self.assertEqual(result.data['recordInteractions']['recorded'], recorded)
+            self.assertEqual(result.data['recordInteractions']['counts'], expected)
+        self.assertEqual(models.Interaction.objects.count(), 3)
+
+        events[0]['action'] = 'love'
+        result = schema.execute(mutation, variable_values={'events': events}, context_value=make_request())
+        self.assertFalse(result.data['recordInteractions']['success'])
+
+    def test_record_interactions_increments_counters_and_needs_client_key(self):
+        mutation = '''
+            mutation ($events: [InteractionEventInput!]!) {
+                recordInteractions(events: $events) { success message counts { likeCount } }
+            }
+        '''
+        # Only new rows are added to the stored counter; the post's history is not counted again
+        models.Post.objects.filter(pk=self.post.pk).update(like_count=10)
+        events = [{'postId': self.post.pk, 'action': 'like', 'clientKey': 'browser-1'}]
+        result = schema.execute(mutation, variable_values={'events': events}, context_value=make_request())
+        self.assertEqual(result.data['recordInteractions']['counts'], [{'likeCount': 11}])
+
+        del events[0]['clientKey']
+        result = schema.execute(mutation, variable_values={'events': events}, context_value=make_request())
+        self.assertEqual(result.data['recordInteractions']['message'], 'clientKey is required for anonymous readers')
+        result = schema.execute(mutation, variable_values={'events': events}, context_value=make_request(self.readers[0]))
+        self.assertEqual(result.data['recordInteractions']['counts'], [{'likeCount': 12}])
+
+    def test_dedupe_command_keeps_first_interaction_per_reader(self):
+        reader = self.readers[0]
+        kept = self.interact(reader, 'like')
+        for i in range(3):  # rows keyed before actor keys existed
+            models.Interaction.objects.create(post=self.post, user=reader, action='like', actor_key=f'i:{i}')
+        self.interact(reader, 'share')
+        self.interact(None, 'like')
+        self.interact(None, 'like')
+
+        out = StringIO()
+        call_command('dedupe_interactions', '--dry-run', stdout=out)
+        self.assertIn('Would delete 3 duplicate', out.getvalue())
+        self.assertEqual(models.Interaction.objects.count(), 7)
+
+        call_command('dedupe_interactions', '--chunk-size', '2', stdout=StringIO())
+        self.assertTrue(models.Interaction.objects.filter(pk=kept.pk).exists())
+        self.assertEqual(models.Interaction.objects.count(), 4)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.share_count), (3, 1))
+
+    def test_counts_are_exposed_without_extra_queries(self):
+        self.interact(self.readers[0], 'like')
+        with self.assertNumQueries(1):
+            result = schema.execute('{ posts { likeCount dislikeCount shareCount } }', context_value=make_request())
+        self.assertEqual(result.data['posts'], [{'likeCount': 1, 'dislikeCount': 0, 'shareCount': 0}])
+
+
+class PostsConnectionTests(TestCase):
+    QUERY = '''
+        query ($after: String, $first: Int) {
+            postsConnection(after: $after, first: $first) {
+                edges { cursor node { id } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='writer')
+        profile = models.Profile.objects.create(user=user)
+        same_day = timezone.now()
+        for i in range(7):
+            # Ties on publish_date and undated posts must still page deterministically
+            publish_date = None if i == 6 else same_day - timezone.timedelta(days=i // 2)
+            models.Post.objects.create(title=f'Post {i}', body='<p>Body</p>', author=profile, publish_date=publish_date)
+
+    def test_walks_every_post_once_without_counting(self):
+        seen, after = [], None
+        while True:
+            # A second query only runs on the page that crosses from dated into undated posts
+            with CaptureQueriesContext(connection) as queries:
+                result = schema.execute(self.QUERY, variables={'after': after, 'first': 3}, context_value=make_request())
+            self.assertLessEqual(len(queries), 2)
+            self.assertIsNone(result.errors)
+            connection_data = result.data['postsConnection']
+            seen += [edge['node']['id'] for edge in connection_data['edges']]
+            if not connection_data['pageInfo']['hasNextPage']:
+                break
+            after = connection_data['pageInfo']['endCursor']
+
+        dated = models.Post.objects.filter(publish_date__isnull=False).order_by('-publish_date', '-id')
+        undated = models.Post.objects.filter(publish_date__isnull=True).order_by('-id')
+        self.assertEqual(seen, [str(post.id) for post in [*dated, *undated]])
+
+    def test_total_count_is_opt_in(self):
+        result = schema.execute('{ postsConnection(first: 2) { totalCount } }', context_value=make_request())
+        self.assertEqual(result.data['postsConnection']['totalCount'], 7)
+
+    def test_rejects_malformed_cursor(self):
+        result = schema.execute(self.QUERY, variables={'after': 'not-a-cursor'}, context_value=make_request())
+        self.assertEqual(result.errors[0].message, 'Invalid cursor')
+
+
+class PostListProjectionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='writer')
+        profile = models.Profile.objects.create(user=user)
+        tag = models.Tag.objects.create(name='News')
+        body = '<h1>Headline</h1>\n<p>First &amp; <em>second</em> paragraph.</p>' + '<p>filler text</p>' * 100
+        cls.post = models.Post.objects.create(title='Long read', body=body, author=profile)
+        cls.post.tags.add(tag)
+
+    def test_excerpt_is_plain_text_and_refreshed_on_save(self):
+        self.assertTrue(self.post.excerpt.startswith('Headline First & second paragraph. filler text'))
+        self.assertEqual(len(self.post.excerpt), 240)
+
+        self.post.body = '<p>Rewritten</p>'
+        self.post.save(update_fields=['body'])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.excerpt, 'Rewritten')
+
+    def test_listing_only_loads_selected_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(
+                '{ postsByTag(tag: "news") { ...card } } fragment card on PostType { title excerpt formattedDate }',
+                context_value=make_request(),
+            )
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['postsByTag'][0]['title'], 'Long read')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"body"', queries[0]['sql'])
+
+    def test_body_is_loaded_when_requested(self):
+        result = schema.execute('{ allPosts { posts { body } } }', context_value=make_request())
+        self.assertTrue(result.data['allPosts']['posts'][0]['body'].startswith('<h1>'))
+
+
+class AdTrackingTests(TestCase):
+    def setUp(self):
+        self.ads = [
+            models.AdUnit.objects.create(name=f'Ad {i}', position='sidebar', width=300, height=250) for i in range(2)
+        ]
+        self.addCleanup(ad_counters.flush)
+
+    def test_impressions_and_clicks_are_buffered_until_flush(self):
+        ad_ids = [str(ad.id) for ad in self.ads]
+        ad_counters.known_ids()
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                result = schema.execute(
+                    'mutation ($ids: [ID]!) { trackAdImpressions(adIds: $ids) { success recorded } }',
+                    variables={'ids': ad_ids}, context_value=make_request(),
+                )
+                self.assertEqual(result.data['trackAdImpressions'], {'success': True, 'recorded': 2})
+            schema.execute('mutation ($id: ID!) { trackAdImpression(adId: $id) { success } }',
+                           variables={'id': ad_ids[0]}, context_value=make_request())
+            schema.execute('mutation ($id: ID!) { trackAdClick(adId: $id) { success } }',
+                           variables={'id': ad_ids[1]}, context_value=make_request())
+
+        with self.assertNumQueries(2):
+            self.assertEqual(ad_counters.flush(), 2)
+
+        first, second = models.AdUnit.objects.order_by('id')
+        self.assertEqual((first.impressions, first.clicks), (4, 0))
+        self.assertEqual((second.impressions, second.clicks), (3, 1))
+
+    def test_rejects_malformed_ad_id(self):
+        result = schema.execute('mutation { trackAdClick(adId: "header") { success } }', context_value=make_request())
+        self.assertFalse(result.data['trackAdClick']['success'])
+
+    def test_unknown_ids_and_long_lists_are_not_counted(self):
+        mutation = 'mutation ($ids: [ID]!) { trackAdImpressions(adIds: $ids) { success recorded } }'
+        result = schema.execute(mutation, variables={'ids': [self.ads[0].pk, 99999]}, context_value=make_request())
+        self.assertEqual(result.data['trackAdImpressions'], {'success': True, 'recorded': 1})
+        result = schema.execute(
+            'mutation { trackAdClick(adId: 99999) { success } }', context_value=make_request()
+        )
+        self.assertFalse(result.data['trackAdClick']['success'])
+        result = schema.execute(mutation, variables={'ids': [self.ads[0].pk] * 51}, context_value=make_request())
+        self.assertEqual(result.data['trackAdImpressions'], {'success': False, 'recorded': 0})
+        self.assertEqual(ad_counters.flush(), 1)
+
+    def test_failed_flush_keeps_unwritten_counts(self):
+        ad_counters.record_impressions([ad.pk for ad in self.ads])
+        update = QuerySet.update
+        calls = []
+
+        def fail_second_update(queryset, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 2:
+                raise OperationalError('connection lost')
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', fail_second_update), self.assertRaises(OperationalError):
+            ad_counters.flush()
+        self.assertEqual(ad_counters.flush(), 1)
+        self.assertEqual(list(models.AdUnit.objects.order_by('pk').values_list('impressions', flat=True)), [1, 1])
+
+
+class SearchPostsTests(TestCase):
+    QUERY = '''
+        query ($query: String!, $after: String) {
+            searchPosts(query: $query, first: 1, after: $after) {
+                edges { cursor node { rank snippet post { title } } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='writer')
+        profile = models.Profile.objects.create(user=user)
+        cls.coffee = models.Post.objects.create(
+            title='Coffee ceremony', body='<p>How the <b>ceremony</b> is prepared &amp; served.</p>', author=profile
+        )
+        cls.market = models.Post.objects.create(
+            title='Market day', body='<p>Stalls selling spices, cloth and coffee beans.</p>', author=profile
+        )
+        models.Post.objects.create(title='Rainy season', body='<p>Nothing to see here.</p>', author=profile)
+        jobs.run_pending()
+
+    def search(self, query, after=None):
+        result = schema.execute(self.QUERY, variables={'query': query, 'after': after}, context_value=make_request())
+        self.assertIsNone(result.errors)
+        return result.data['searchPosts']
+
+    def test_ranks_title_matches_first_and_pages_with_cursor(self):
+        page = self.search('coffee')
+        self.assertEqual(page['edges'][0]['node']['post']['title'], 'Coffee ceremony')
+        self.assertTrue(page['pageInfo']['hasNextPage'])
+
+        page = self.search('coffee', after=page['pageInfo']['endCursor'])
+        self.assertEqual(page['edges'][0]['node']['post']['title'], 'Market day')
+        self.assertIn('<mark>coffee</mark>', page['edges'][0]['node']['snippet'])
+        self.assertFalse(page['pageInfo']['hasNextPage'])
+
+    def test_body_text_is_stripped_and_snippet_escaped(self):
+        snippet = self.search('served')['edges'][0]['node']['snippet']
+        self.assertIn('&amp; <mark>served</mark>', snippet)
+        self.assertNotIn('<b>', snippet)
+
+    def test_index_follows_tags_and_deletes(self):
+        self.market.tags.add(models.Tag.objects.create(name='Ethiopia'))
+        jobs.run_pending()
+        self.assertEqual(search_post_ids('ethiopia'), [self.market.id])
+
+        self.market.delete()
+        self.assertEqual(search_post_ids('ethiopia'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('coffee "cerem')['edges'][0]['node']['post']['title'], 'Coffee ceremony')
+        self.assertEqual(self.search('***')['edges'], [])
+
+    def test_admin_search_is_uncapped_and_matches_slugs(self):
+        post_admin = admin.site._registry[models.Post]
+        request = RequestFactory().get('/admin/blog/post/')
+        with mock.patch('blog.search.search_posts', side_effect=AssertionError('ranked search is capped')):
+            found, _ = post_admin.get_search_results(request, models.Post.objects.all(), 'coffee')
+        self.assertEqual(set(found), {self.coffee, self.market})
+        found, _ = post_admin.get_search_results(request, models.Post.objects.all(), 'rainy-sea')
+        self.assertEqual([post.title for post in found], ['Rainy season'])
+
+
+class ResponseCacheTests(TestCase):
+    QUERY = '{ allPosts { posts { title formattedDate } } }'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='editor', password='secret', is_staff=True)
+        profile = models.Profile.objects.create(user=cls.staff)
+        cls.post = models.Post.objects.create(
+            title='Cached', body='<p>Body</p>', author=profile, publish_date=timezone.now()
+        )
+
+    def setUp(self):
+        caches['graphql'].clear()
+
+    def graphql(self, query, **extra):
+        response = self.client.post('/graphql/', {'query': query}, content_type='application/json', **extra)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_repeated_anonymous_query_skips_the_database(self):
+        first = self.graphql(self.QUERY)
+        with self.assertNumQueries(0):
+            # Whitespace and comments do not change the normalized document
+            second = self.graphql('# homepage\n{ allPosts {\n posts { title formattedDate } } }')
+        self.assertEqual(first, second)
+
+    def test_staff_viewers_get_their_own_entry(self):
+        anonymous = self.graphql(self.QUERY)
+        token = get_token(self.staff)
+        staff = self.graphql(self.QUERY, HTTP_AUTHORIZATION=f'JWT {token}')
+        self.assertNotEqual(
+            anonymous['data']['allPosts']['posts'][0]['formattedDate'],
+            staff['data']['allPosts']['posts'][0]['formattedDate'],
+        )
+
+    def test_writes_invalidate_cached_responses(self):
+        self.graphql(self.QUERY)
+        self.post.title = 'Renamed'
+        self.post.save()
+        self.assertEqual(self.graphql(self.QUERY)['data']['allPosts']['posts'][0]['title'], 'Renamed')
+
+    def test_viewer_specific_and_failed_queries_are_not_cached(self):
+        self.graphql('{ me { username } }')
+        self.graphql('{ bookDetails(id: 1) { title } }')
+        # Interactions change without invalidating the cache
+        self.graphql(f'{{ interactions(postId: {self.post.pk}) {{ action }} }}')
+        self.assertEqual(len(caches['graphql']._cache), 0)
+
+
+class PersistedQueryTests(TestCase):
+    QUERY = '{ tags { name } }'
+
+    def setUp(self):
+        caches['graphql'].clear()
+        models.Tag.objects.create(name='Culture')
+        self.extensions = {'persistedQuery': {'version': 1, 'sha256Hash': hashlib.sha256(self.QUERY.encode()).hexdigest()}}
+
+    def post(self, payload):
+        return self.client.post('/graphql/', payload, content_type='application/json').json()
+
+    def test_hash_is_registered_on_miss_and_reused(self):
+        miss = self.post({'extensions': self.extensions})
+        self.assertEqual(miss['errors'][0]['message'], 'PersistedQueryNotFound')
+
+        registered = self.post({'query': self.QUERY, 'extensions': self.extensions})
+        self.assertEqual(registered['data'], {'tags': [{'name': 'Culture'}]})
+        self.assertEqual(self.post({'extensions': self.extensions}), registered)
+
+    def test_persisted_queries_work_over_get(self):
+        self.post({'query': self.QUERY, 'extensions': self.extensions})
+        response = self.client.get('/graphql/', {'extensions': json.dumps(self.extensions)}, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['data'], {'tags': [{'name': 'Culture'}]})
+
+    def test_rejects_query_that_does_not_match_hash(self):
+        result = self.post({'query': '{ posts { id } }', 'extensions': self.extensions})
+        self.assertEqual(result['errors'][0]['message'], 'provided sha does not match query')
+
+    def test_documents_are_parsed_and_validated_once(self):
+        backend = ValidatedDocumentBackend()
+        with mock.patch('blog.persisted_queries.validate', wraps=validate) as validate_spy:
+            first = backend.document_from_string(schema, '{ posts { nope } }')
+            second = backend.document_from_string(schema, '{ posts { nope } }')
+        self.assertIs(first, second)
+        self.assertEqual(validate_spy.call_count, 1)
+        self.assertTrue(first.execute().invalid)
+
+    def test_document_cache_is_bounded(self):
+        backend = ValidatedDocumentBackend(max_size=2)
+        for query in ('{ posts { id } }', '{ tags { id } }', '{ adUnits { id } }'):
+            backend.document_from_string(schema, query)
+        self.assertEqual([query for _, query in backend._documents], ['{ tags { id } }', '{ adUnits { id } }'])
+
+
+class ConditionalResponseTests(TestCase):
+    QUERY = 'query ($slug: String) { postBySlug(slug: $slug) { title body } }'
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='writer')
+        profile = models.Profile.objects.create(user=user)
+        cls.post = models.Post.objects.create(title='Versioned', body='<p>Body</p>', author=profile)
+
+    def setUp(self):
+        caches['graphql'].clear()
+
+    def read(self, **headers):
+        return self.client.post(
+            '/graphql/', {'query': self.QUERY, 'variables': {'slug': 'versioned'}}, content_type='application/json', **headers
+        )
+
+    def get(self, **headers):
+        params = {'query': self.QUERY, 'variables': json.dumps({'slug': 'versioned'})}
+        return self.client.get('/graphql/', params, HTTP_ACCEPT='application/json', **headers)
+
+    def test_matching_etag_returns_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertEqual(response['Last-Modified'], http_date(self.post.updated_at.timestamp()))
+
+        revalidated = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b'')
+        self.assertEqual(revalidated['ETag'], response['ETag'])
+
+    def test_post_ignores_validators(self):
+        etag = self.read()['ETag']
+        response = self.read(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['data']['postBySlug']['title'], 'Versioned')
+
+    def test_etag_changes_when_post_changes(self):
+        etag = self.get()['ETag']
+        self.post.body = '<p>Edited</p>'
+        self.post.save()
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_get_honours_if_modified_since(self):
+        first = self.get()
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+    def test_mutations_are_not_validated(self):
+        self.addCleanup(ad_counters.flush)
+        response = self.client.post(
+            '/graphql/', {'query': 'mutation { trackAdClick(adId: 1) { success } }'}, content_type='application/json'
+        )
+        self.assertFalse(response.has_header('ETag'))
+
+
+class QueryPlanTests(TestCase):
+    """Every resolver on a hot path must be answered from an index, never a full table scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        tags = [models.Tag.objects.create(name=f'Topic {i}') for i in range(20)]
+        profiles = [
+            models.Profile.objects.create(user=User.objects.create_user(username=f'author-{i}')) for i in range(10)
+        ]
+        now = timezone.now()
+        posts = models.Post.objects.bulk_create(
+            models.Post(
+                title=f'Post {i}', slug=f'post-{i}', body='<p>Body</p>', author=profiles[i % 10],
+                published=i % 3 != 0, publish_date=now - timezone.timedelta(hours=i) if i % 7 else None,
+            )
+            for i in range(200)
+        )
+        Tagged = models.Post.tags.through
+        Tagged.objects.bulk_create(Tagged(post=post, tag=tags[i % 20]) for i, post in enumerate(posts))
+        models.Interaction.objects.bulk_create(
+            models.Interaction(post=post, action=action) for post in posts for action in ('like', 'share')
+        )
+        models.AdUnit.objects.bulk_create(
+            models.AdUnit(name=f'Ad {i}', position=f'slot-{i}', width=300, height=250) for i in range(50)
+        )
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tiny tables make a seq scan the cheapest plan; this checks an index can serve the query
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] if connection.vendor == 'sqlite' else row[0] for row in cursor.fetchall()]
+
+    def assertNoSequentialScans(self, query, variables=None):
+        with CaptureQueriesContext(connection) as queries:
+            result = schema.execute(query, variables=variables, context_value=make_request())
+        self.assertIsNone(result.errors)
+        self.assertTrue(queries.captured_queries)
+        for captured in queries.captured_queries:
+            plan = self.explain(captured['sql'])
+            # Walking an index in order is only acceptable for unfiltered, paginated reads
+            filtered = ' WHERE ' in captured['sql']
+            full_scans = [
+                line for line in plan
+                if 'Seq Scan' in line
+                or (line.startswith('SCAN ') and 'VIRTUAL TABLE' not in line and (filtered or ' USING ' not in line))
+            ]
+            self.assertEqual(full_scans, [], f"{captured['sql']}\n" + '\n'.join(plan))
+
+    def test_all_posts_page(self):
+        self.assertNoSequentialScans(
+            '{ allPosts(page: 3, pageSize: 20) { totalCount posts { title author { user { username } } tags { name } interactions { action } } } }'
+        )
+
+    def test_posts_connection_page(self):
+        first = schema.execute('{ postsConnection(first: 150) { pageInfo { endCursor } } }', context_value=make_request())
+        after = first.data['postsConnection']['pageInfo']['endCursor']
+        self.assertNoSequentialScans(
+            'query ($after: String) { postsConnection(first: 20, after: $after) { edges { node { title } } } }',
+            {'after': after},
+        )
+
+    def test_post_by_slug(self):
+        self.assertNoSequentialScans('{ postBySlug(slug: "post-42") { title } }')
+
+    def test_post_by_id(self):
+        post_id = models.Post.objects.values_list('id', flat=True).first()
+        self.assertNoSequentialScans('query ($id: ID!) { postById(id: $id) { title } }', {'id': post_id})
+
+    def test_posts_by_tag(self):
+        self.assertNoSequentialScans('{ postsByTag(tag: "topic 7") { title tags { name } } }')
+
+    def test_posts_by_author(self):
+        self.assertNoSequentialScans('{ postsByAuthor(username: "author-3") { title } }')
+
+    def test_ad_units_by_position(self):
+        self.assertNoSequentialScans('{ adUnits(position: "slot-4") { name } }')
+
+    def test_interactions_by_post(self):
+        post_id = models.Post.objects.values_list('id', flat=True).first()
+        self.assertNoSequentialScans('query ($id: ID!) { interactions(postId: $id) { action } }', {'id': post_id})
+
+    def test_search_posts(self):
+        self.assertNoSequentialScans('{ searchPosts(query: "post") { edges { node { post { title } } } } }')
+
+
+class SlugAllocationTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='writer', is_staff=True)
+        self.profile = models.Profile.objects.create(user=user)
+
+    def create(self, title, **fields):
+        return models.Post.objects.create(title=title, body='<p>Body</p>', author=self.profile, **fields)
+
+    def test_common_titles_get_sequential_suffixes_in_constant_queries(self):
+        self.create('Weekly Roundup: extra')  # Shares the prefix but is not a collision
+        slugs, query_counts = [], []
+        for i in range(12):
+            with CaptureQueriesContext(connection) as queries:
+                slugs.append(self.create('Weekly Roundup' + '!' * i).slug)
+            query_counts.append(len(queries))
+        self.assertEqual(slugs, ['weekly-roundup'] + [f'weekly-roundup-{n}' for n in range(1, 12)])
+        self.assertEqual(len(set(query_counts)), 1)
+
+    def test_client_supplied_slug_is_made_unique(self):
+        self.create('First', slug='launch')
+        result = schema.execute(
+            '''mutation { createPost(input: {title: "Second", subtitle: "", slug: "launch", body: "<p>x</p>", author: "writer",
+                                             createdAt: "2025-01-01T00:00:00", updatedAt: "2025-01-01T00:00:00"})
+                          { success post { slug } } }''',
+            context_value=make_request(self.profile.user),
+        )
+        self.assertEqual(result.data['createPost'], {'success': True, 'post': {'slug': 'launch-1'}})
+
+    def test_retries_when_a_concurrent_insert_takes_the_slug(self):
+        self.create('Breaking')
+        stale = iter(['breaking'])  # What a concurrent writer saw before our insert
+        allocate = models.Post.allocate_slug
+
+        def allocate_with_race(post, base):
+            return next(stale, None) or allocate(post, base)
+
+        with mock.patch.object(models.Post, 'allocate_slug', allocate_with_race):
+            post = self.create('Breaking!')
+        self.assertEqual(post.slug, 'breaking-1')
+
+    def test_editing_keeps_the_slug(self):
+        post = self.create('Stable', slug='stable')
+        post.title = 'Stable, renamed'
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.slug, 'stable')
+
+
+class QueryCostTests(TestCase):
+    def setUp(self):
+        caches['graphql'].clear()
+
+    def post(self, query, variables=None):
+        return self.client.post('/graphql/', {'query': query, 'variables': variables}, content_type='application/json')
+
+    def test_cost_is_reported_in_extensions(self):
+        response = self.post('query ($first: Int) { postsConnection(first: $first) { edges { node { id author { id } } } } }', {'first': 5})
+        self.assertEqual(response.status_code, 200)
+        cost = response.json()['extensions']['cost']
+        # postsConnection, edges, node and author, each per page item
+        self.assertEqual((cost['requestedQueryCost'], cost['depth']), (5 * 4, 5))
+
+    def test_nested_lists_over_budget_are_rejected_before_execution(self):
+        with self.assertNumQueries(0):
+            response = self.post('{ posts { interactions { post { interactions { id } } } } }')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Query cost', response.json()['errors'][0]['message'])
+
+    def test_page_size_variables_multiply_cost(self):
+        query = 'query ($size: Int) { allPosts(pageSize: $size) { posts { id tags { name } } } }'
+        small = self.post(query, {'size': 2}).json()['extensions']['cost']['requestedQueryCost']
+        large = self.post(query, {'size': 40}).json()['extensions']['cost']['requestedQueryCost']
+        self.assertEqual(large, 20 * small)
+
+    def test_page_sizes_are_clamped_to_what_the_cost_assumes(self):
+        author = models.Profile.objects.create(user=User.objects.create_user(username='writer'))
+        models.Post.objects.bulk_create(
+            models.Post(title=f'Post {i}', slug=f'post-{i}', body='', author=author) for i in range(105)
+        )
+        response = self.post('{ allPosts(pageSize: 100000) { posts { id } } }').json()
+        self.assertEqual(len(response['data']['allPosts']['posts']), 100)
+        self.assertEqual(response['extensions']['cost']['requestedQueryCost'], 100 * 2)
+        response = self.post('{ allPosts(page: 0) { posts { id } } }').json()
+        self.assertEqual(response['errors'][0]['message'], 'page must be 1 or more')
+
+        response = self.post('{ posts(limit: 1000) { id } tags { id } }').json()
+        self.assertEqual(len(response['data']['posts']), 100)
+        self.assertEqual(len(self.post('{ posts(offset: 100) { id } }').json()['data']['posts']), 5)
+
+    def test_lists_inside_paged_lists_are_estimated(self):
+        response = self.post('{ posts(limit: 10) { body interactions { id } } }')
+        # 10 posts, each with an estimated LIST_SIZE_ESTIMATE interactions
+        self.assertEqual(response.json()['extensions']['cost']['requestedQueryCost'], 10 * (1 + 20))
+        self.assertEqual(self.post('{ posts { body interactions { id } } }').status_code, 400)
+
+    def test_depth_limit(self):
+        query = '{ postById(id: 1) { ' + 'interactions { post { ' * 5 + 'id' + ' } }' * 5 + ' } }'
+        response = self.post(query)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Query depth', response.json()['errors'][0]['message'])
+
+    def test_introspection_is_free(self):
+        response = self.post('{ __schema { types { name fields { name type { name ofType { name ofType { name } } } } } } }')
+        self.assertEqual(response.json()['extensions']['cost']['requestedQueryCost'], 0)
+
+
+class TracingTests(TestCase):
+    QUERY = '{ posts { title author { id } } }'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='editor', is_staff=True)
+        profile = models.Profile.objects.create(user=cls.staff)
+        for i in range(3):
+            models.Post.objects.create(title=f'Traced {i}', body='<p>Body</p>', author=profile)
+
+    def setUp(self):
+        caches['graphql'].clear()
+
+    def post(self, **headers):
+        return self.client.post('/graphql/', {'query': self.QUERY}, content_type='application/json', **headers).json()
+
+    def test_staff_get_resolver_timings_and_sql_counts(self):
+        token = get_token(self.staff)
+        result = self.post(HTTP_AUTHORIZATION=f'JWT {token}', HTTP_X_GRAPHQL_TRACE='1')
+        resolvers = result['extensions']['tracing']['execution']['resolvers']
+        by_path = {tuple(r['path']): r for r in resolvers}
+        self.assertEqual(by_path[('posts',)]['sqlQueries'], 1)
+        self.assertEqual(by_path[('posts', 0, 'author')]['parentType'], 'PostType')
+        # The three authors are batched into one query that runs after every author resolver returned
+        self.assertEqual(result['extensions']['tracing']['sqlQueries'], 2)
+
+    def test_tracing_needs_header_and_permission(self):
+        self.assertNotIn('tracing', self.post().get('extensions', {}))
+        self.assertNotIn('tracing', self.post(HTTP_X_GRAPHQL_TRACE='1').get('extensions', {}))
+
+    def test_metrics_endpoint(self):
+        self.post()
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('text/plain', response['Content-Type'])
+        body = response.content.decode()
+        self.assertIn('graphql_resolver_sql_queries_bucket{field="Query.posts",le="1"}', body)
+        self.assertIn('graphql_request_duration_seconds_count{operation="anonymous"}', body)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 403)
+
+
+class BenchmarkTests(TestCase):
+    def test_suite_runs_every_operation_on_seeded_data(self):
+        counts = benchmark_seed.seed(profiles=2, posts=12, tags=4, interactions=40, ad_units=4)
+        self.assertEqual((counts['posts'], counts['tags']), (12, 4))
+        self.assertEqual(models.Post.objects.filter(search_index__isnull=True).count(), 0)
+        # Reads over the seeded data must find something, or the suite times empty results
+        result = schema.execute('{ tagCloud { name postCount } postsByTag(tag: "culture") { id } }', context_value=make_request())
+        self.assertEqual(len(result.data['tagCloud']), 4)
+        self.assertTrue(all(tag['postCount'] for tag in result.data['tagCloud']))
+        self.assertTrue(result.data['postsByTag'])
+
+        results = benchmark_suite.run(iterations=2, warmup=0)
+        self.assertEqual(set(results['operations']), {operation.name for operation in benchmark_suite.OPERATIONS})
+        for result in results['operations'].values():
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['queries'], 0)
+        json.dumps(results)
+
+    def test_compare_flags_slowdowns_and_extra_queries(self):
+        baseline = {'operations': {'allPosts': {'p50_ms': 10, 'p95_ms': 20, 'queries': 3}}}
+        current = {'operations': {
+            'allPosts': {'p50_ms': 10.5, 'p95_ms': 30, 'queries': 4},
+            'postBySlug': {'p50_ms': 1, 'p95_ms': 2, 'queries': 1},
+        }}
+        self.assertEqual(
+            benchmark_suite.compare(current, baseline),
+            ['allPosts: p95_ms 20 -> 30', 'allPosts: queries 3 -> 4'],
+        )
+
+
+class AsyncEndpointTests(TransactionTestCase):
+    """The async view runs on other threads with their own connections, so the data must be committed."""
+
+    QUERY = '{ allPosts(pageSize: 2) { posts { title author { id } } } adUnits { name } tags { name } }'
+
+    def setUp(self):
+        caches['graphql'].clear()
+        profile = models.Profile.objects.create(user=User.objects.create_user(username='writer'))
+        tag = models.Tag.objects.create(name='Culture')
+        for i in range(3):
+            post = models.Post.objects.create(title=f'Async {i}', body='<p>Body</p>', author=profile)
+            post.tags.add(tag)
+        models.AdUnit.objects.create(name='Banner', position='header', width=728, height=90)
+
+    def execute(self, query, user=None, **headers):
+        request = RequestFactory().post('/graphql/', {'query': query}, content_type='application/json', **headers)
+        request.user = user or AnonymousUser()
+        return async_to_sync(async_graphql_view)(request)
+
+    def test_root_fields_resolve_on_separate_threads(self):
+        threads = []
+
+        def execute_part(*args):
+            threads.append(threading.current_thread().name)
+            return concurrent_execution.execute(*args[:2], context_value=args[2], **args[3])
+
+        with mock.patch.object(concurrent_execution, 'execute_part', side_effect=execute_part):
+            response = self.execute(self.QUERY)
+        data = json.loads(response.content)['data']
+        self.assertEqual(list(data), ['allPosts', 'adUnits', 'tags'])
+        self.assertEqual(len(data['allPosts']['posts']), 2)
+        self.assertEqual(data['adUnits'], [{'name': 'Banner'}])
+        self.assertEqual(data['tags'], [{'name': 'Culture'}])
+        self.assertEqual(len(threads), 3)
+        self.assertTrue(all(name.startswith('graphql-field') for name in threads))
+        self.assertIn('Last-Modified', response)
+
+    def test_traces_count_the_sql_of_every_part(self):
+        def one_query_observations():
+            return tracing.RESOLVER_SQL_QUERIES.counts['Query.tags'][1]  # The le="1" bucket alone
+
+        before = one_query_observations()
+        self.execute(self.QUERY)
+        self.assertEqual(one_query_observations(), before + 1)
+
+        staff = User.objects.create_user(username='editor', is_staff=True)
+        response = self.execute(self.QUERY, user=staff, HTTP_X_GRAPHQL_TRACE='1')
+        trace = json.loads(response.content)['extensions']['tracing']
+        by_path = {tuple(r['path']): r for r in trace['execution']['resolvers']}
+        self.assertEqual([by_path[(field,)]['sqlQueries'] for field in ('allPosts', 'adUnits', 'tags')], [1, 1, 1])
+        self.assertEqual(trace['sqlQueries'], 4)  # Plus the batched authors
+
+    def test_mutations_and_single_fields_run_whole(self):
+        split = concurrent_execution.split_root_fields
+        self.assertIsNone(split(parse('mutation { a: trackAdClick(adId: 1) { success } b: trackAdClick(adId: 2) { success } }')))
+        self.assertIsNone(split(parse('{ tags { name } }')))
+        self.assertEqual(len(split(parse('query Page { tags { ...T } adUnits { id } } fragment T on TagType { name }'), 'Page')), 2)
+        self.assertIsNone(split(parse('{ a: tags { name } a: tags { id } }')))
+
+    def test_repeated_response_keys_run_in_one_part(self):
+        parts = concurrent_execution.split_root_fields(parse('{ a: tags { name } adUnits { id } a: tags { id } }'))
+        self.assertEqual([len(part.definitions[0].selection_set.selections) for part in parts], [2, 1])
+        response = self.execute('{ a: allPosts(pageSize: 2) { posts { id } } tags { name } a: allPosts(pageSize: 2) { posts { title } } }')
+        data = json.loads(response.content)['data']
+        self.assertEqual(list(data), ['a', 'tags'])
+        self.assertEqual(set(data['a']['posts'][0]), {'id', 'title'})
+
+
+class ViewerTests(TestCase):
+    QUERY = '{ me { username bio website } }'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader')
+        cls.profile = models.Profile.objects.create(user=cls.user, bio='Reads a lot', website='https://example.com')
+
+    def setUp(self):
+        caches['graphql'].clear()
+        self.token = get_token(self.user)
+
+    def me(self):
+        response = self.client.post(
+            '/graphql/', {'query': self.QUERY}, content_type='application/json', HTTP_AUTHORIZATION=f'JWT {self.token}'
+        )
+        return response.json()
+
+    def test_viewer_and_profile_are_loaded_once_and_cached(self):
+        expected = {'username': 'reader', 'bio': 'Reads a lot', 'website': 'https://example.com'}
+        with self.assertNumQueries(1):
+            self.assertEqual(self.me()['data']['me'], expected)
+        with self.assertNumQueries(0), mock.patch('blog.viewer.get_payload') as get_payload:
+            self.assertEqual(self.me()['data']['me'], expected)
+        get_payload.assert_not_called()
+
+    def test_saving_profile_or_user_drops_cached_viewer(self):
+        self.me()
+        self.profile.bio = 'Writes too'
+        self.profile.save()
+        self.assertEqual(self.me()['data']['me']['bio'], 'Writes too')
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(self.me()['data']['me'])
+
+    def test_changes_saved_elsewhere_apply_once_the_entry_expires(self):
+        self.me()
+        # An update without signals, as another process's save would look to this one
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.me()['data']['me']['username'], 'reader')
+        later = time.time() + viewer.USER_CACHE_TTL + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertIsNone(self.me()['data']['me'])
+
+    def test_invalid_token_is_reported(self):
+        self.token = 'not-a-token'
+        self.assertEqual(self.me()['errors'][0]['message'], 'Error decoding signature')
+
+
+class TagIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='writer')
+        cls.profile = models.Profile.objects.create(user=user)
+        cls.culture, cls.sport, cls.drafts = (
+            models.Tag.objects.create(name=name) for name in ('Culture', 'Sport', 'Drafts')
+        )
+        cls.posts = [
+            models.Post.objects.create(
+                title=f'Post {i}', slug=f'post-{i}', body='<p>Body</p>', author=cls.profile, published=True
+            )
+            for i in range(3)
+        ]
+        for post in cls.posts:
+            post.tags.add(cls.culture)
+        cls.posts[0].tags.add(cls.sport)
+        jobs.run_pending()
+
+    def counts(self):
+        jobs.run_pending()
+        return dict(models.TagIndex.objects.values_list('tag__name', 'post_count'))
+
+    def test_counts_follow_tags_and_publication(self):
+        self.assertEqual(self.counts(), {'Culture': 3, 'Sport': 1, 'Drafts': 0})
+
+        self.posts[1].tags.add(self.sport)
+        self.posts[0].tags.remove(self.culture)
+        self.assertEqual(self.counts(), {'Culture': 2, 'Sport': 2, 'Drafts': 0})
+
+        self.posts[1].published = False
+        self.posts[1].save()
+        self.assertEqual(self.counts(), {'Culture': 1, 'Sport': 1, 'Drafts': 0})
+
+        self.posts[0].tags.clear()
+        self.sport.post_set.add(self.posts[2])
+        self.posts[2].delete()
+        self.assertEqual(self.counts(), {'Culture': 0, 'Sport': 0, 'Drafts': 0})
+
+    def test_tag_cloud_is_one_query(self):
+        with self.assertNumQueries(1):
+            result = schema.execute('{ tagCloud(limit: 5) { name postCount } }', context_value=make_request())
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data['tagCloud'], [{'name': 'Culture', 'postCount': 3}, {'name': 'Sport', 'postCount': 1}])
+
+        result = schema.execute('{ tagCloud(limit: 1) { name } }', context_value=make_request())
+        self.assertEqual(result.data['tagCloud'], [{'name': 'Culture'}])
+
+    def test_posts_by_tag_ignores_case_and_spacing(self):
+        result = schema.execute('{ postsByTag(tag: " CULTURE ") { title } }', context_value=make_request())
+        self.assertEqual(len(result.data['postsByTag']), 3)
+
+
+class ImageVariantTests(TestCase):
+    QUERY = '''
+        query ($id: ID!) {
+            bookDetails(id: $id) { coverImageSet { url width formats srcset(format: "webp") variants { url width format } } }
+        }
+    '''
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+    def upload(self, name, size=(800, 400), mode='RGB'):
+        output = BytesIO()
+        Image.new(mode, size, 'red').save(output, 'PNG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+    def create_book(self, **fields):
+        return models.Book.objects.create(
+            title='Fikir Eske Mekabir', description='A novel', author='Haddis Alemayehu',
+            published_date='1965-01-01', price=10, **fields
+        )
+
+    def test_saving_a_cover_generates_variants(self):
+        book = self.create_book(cover_image=self.upload('cover.png', mode='RGBA'))
+        self.assertEqual(jobs.run_pending(), 1)
+        book.refresh_from_db()
+        self.assertEqual(book.cover_variants['width'], 800)
+        widths = sorted({variant['width'] for variant in book.cover_variants['variants']})
+        self.assertEqual(widths, [320, 640, 800])
+        for variant in book.cover_variants['variants']:
+            self.assertRegex(variant['name'], rf'^book_covers/cover\.[0-9a-f]{{12}}\.{variant["width"]}w\.(webp|jpg|avif)$')
+            self.assertTrue(default_storage.exists(variant['name']))
+
+        result = schema.execute(self.QUERY, variables={'id': book.pk}, context_value=make_request())
+        self.assertIsNone(result.errors)
+        cover = result.data['bookDetails']['coverImageSet']
+        self.assertEqual(cover['url'], '/media/' + book.cover_image.name)
+        self.assertIn('webp', cover['formats'])
+        self.assertEqual(cover['srcset'].count('w, '), 2)
+        self.assertTrue(cover['srcset'].endswith('.800w.webp 800w'))
+
+    def test_replacing_an_image_removes_old_variants(self):
+        book = self.create_book(cover_image=self.upload('first.png'))
+        jobs.run_pending()
+        book.refresh_from_db()
+        old = [variant['name'] for variant in book.cover_variants['variants']]
+
+        book.cover_image = self.upload('second.png', size=(300, 300))
+        book.save()
+        jobs.run_pending()
+        book.refresh_from_db()
+        self.assertEqual([variant['width'] for variant in book.cover_variants['variants'][:1]], [300])
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+
+    def test_command_backfills_existing_images(self):
+        user = User.objects.create_user(username='photographer')
+        name = default_storage.save('profile_images/me.png', self.upload('me.png', size=(2000, 1000)))
+        models.Profile.objects.bulk_create([models.Profile(user=user, image=name)])  # No signals
+
+        call_command('generate_image_variants', '--workers', '1', stdout=StringIO())
+        profile = models.Profile.objects.get(user=user)
+        self.assertEqual(
+            sorted({variant['width'] for variant in profile.image_variants['variants']}), [320, 640, 1024, 1600]
+        )
+
+        result = schema.execute('{ allProfiles { imageSet { width } user { image } } }', context_value=make_request())
+        self.assertEqual(result.data['allProfiles'][0]['imageSet'], {'width': 2000})
+        self.assertEqual(result.data['allProfiles'][0]['user']['image'], '/media/profile_images/me.png')
+
+    def test_create_book_rejects_unknown_cover_names(self):
+        result = schema.execute(
+            'mutation { createBook(title: "T", description: "D", author: "A", publishedDate: "2024-01-01", '
+            'price: 1, coverImage: "../settings.py") { book { id } } }',
+            context_value=make_request(),
+        )
+        self.assertEqual(result.errors[0].message, 'Unknown cover image')
+        self.assertFalse(models.Book.objects.exists())
+
+
+class JobQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='editor', is_staff=True)
+        cls.profile = models.Profile.objects.create(user=user)
+
+    def test_identical_pending_jobs_are_queued_once(self):
+        post = models.Post.objects.create(title='Queued', body='<p>Body</p>', author=self.profile)
+        post.save()
+        self.assertEqual(
+            sorted(models.Job.objects.values_list('name', 'args')),
+            [('blog.tasks.index_posts', [[post.pk]]), ('blog.tasks.update_feeds', [[feeds.shard_of(post.pk)]])],
+        )
+        self.assertFalse(models.PostSearchIndex.objects.exists())
+
+        self.assertEqual(jobs.run_pending(), 2)
+        self.assertTrue(models.PostSearchIndex.objects.filter(post=post).exists())
+        self.assertFalse(models.Job.objects.exists())
+
+    def test_failures_are_retried_with_backoff_then_kept(self):
+        failing_task.delay('this')
+        self.assertEqual(jobs.run_pending(), 1)
+        job = models.Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (models.Job.PENDING, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertEqual(jobs.run_pending(), 0)  # Not due yet
+
+        models.Job.objects.update(run_at=timezone.now())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (models.Job.FAILED, 2))
+        self.assertIn('Cannot handle this', job.last_error)
+
+    def test_claimed_jobs_are_not_claimed_twice(self):
+        failing_task.delay('once')
+        first, second = jobs.Worker('first'), jobs.Worker('second')
+        self.assertEqual(len(first.claim()), 1)
+        self.assertEqual(second.claim(), [])
+
+        # Running jobs do not block the next identical call, and stuck ones are put back
+        failing_task.delay('once')
+        self.assertEqual(models.Job.objects.count(), 2)
+        stuck = models.Job.objects.filter(status=models.Job.RUNNING)
+        stuck.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.release_stale_jobs(), 0)  # The pending copy already covers it
+        self.assertEqual(list(models.Job.objects.values_list('status', flat=True)), [models.Job.PENDING])
+
+    def test_create_post_returns_before_indexing(self):
+        result = schema.execute(
+            '''mutation { createPost(input: {title: "Fresh", subtitle: "", slug: "fresh", body: "<p>x</p>", author: "editor",
+                                             createdAt: "2025-01-01T00:00:00", updatedAt: "2025-01-01T00:00:00"})
+                          { success } }''',
+            context_value=make_request(self.profile.user),
+        )
+        self.assertTrue(result.data['createPost']['success'])
+        self.assertEqual(search_post_ids('fresh'), [])
+
+        call_command('run_worker', '--once', stdout=StringIO())
+        self.assertEqual(search_post_ids('fresh'), [models.Post.objects.get().pk])
+
+    def test_indexing_jobs_invalidate_cached_responses(self):
+        post = models.Post.objects.create(title='Queued', body='<p>Body</p>', author=self.profile)
+        generation = response_cache.get_cache().get(response_cache.GENERATION_KEY, 0)
+        jobs.run_pending()
+        self.assertGreater(response_cache.get_cache().get(response_cache.GENERATION_KEY, 0), generation)
+        self.assertTrue(models.PostSearchIndex.objects.filter(post=post).exists())
+
+    def test_cron_endpoint_runs_jobs_for_app_engine_only(self):
+        failing_task.delay('cron')
+        self.assertEqual(self.client.get('/tasks/run', HTTP_X_APPENGINE_CRON='true').status_code, 403)
+        with self.settings(TASK_CRON_ENABLED=True):
+            self.assertEqual(self.client.get('/tasks/run').status_code, 403)
+            response = self.client.get('/tasks/run', HTTP_X_APPENGINE_CRON='true')
+        self.assertEqual(response.content, b'Ran 1 jobs\n')
+        self.assertEqual(models.Job.objects.get().attempts, 1)
+
+
+class FeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='writer')
+        profile = models.Profile.objects.create(user=user)
+        cls.tag = models.Tag.objects.create(name='Culture')
+        cls.posts = [
+            models.Post.objects.create(
+                title=f'Story {i}', slug=f'story-{i}', body='<p>Body</p>', author=profile, published=True,
+                publish_date=timezone.now() - timedelta(days=i),
+            )
+            for i in range(3)
+        ]
+        cls.posts[0].tags.add(cls.tag)
+        cls.draft = models.Post.objects.create(title='Draft', slug='draft', body='<p>Body</p>', author=profile)
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        self.enterContext(mock.patch.object(feeds, 'FEEDS_ROOT', self.root))
+        self.enterContext(mock.patch.object(feeds, 'SITEMAP_SHARD_SIZE', 2))
+        jobs.run_pending()
+
+    def read(self, name):
+        with open(f'{self.root}/{name}') as f:
+            return f.read()
+
+    def test_jobs_write_sitemap_shards_and_feeds(self):
+        shards = sorted({post.pk // 2 for post in self.posts})
+        index = self.read('sitemap.xml')
+        for shard in shards:
+            self.assertIn(f'/sitemap-{shard}.xml</loc>', index)
+        urls = ''.join(self.read(f'sitemap-{shard}.xml') for shard in shards)
+        self.assertEqual(urls.count('<url>'), 3)
+        self.assertIn('https://addisperspective.onrender.com/post/story-1</loc>', urls)
+        self.assertNotIn('draft', urls)
+
+        rss = self.read('feed.xml')
+        self.assertLess(rss.index('Story 0'), rss.index('Story 2'))
+        self.assertIn('<category>Culture</category>', rss)
+        self.assertIn('<entry>', self.read('atom.xml'))
+
+    def test_edits_rewrite_only_their_shard(self):
+        post = self.posts[1]
+        post.title = 'Story one, revised'
+        post.save()
+        with mock.patch.object(feeds, 'build_shard', wraps=feeds.build_shard) as build_shard:
+            jobs.run_pending()
+        build_shard.assert_called_once_with(post.pk // 2)
+        self.assertIn('Story one, revised', self.read('feed.xml'))
+
+    def test_unpublished_posts_leave_the_sitemap(self):
+        for post in self.posts:
+            post.published = False
+            post.save()
+        jobs.run_pending()
+        self.assertNotIn('<sitemap>', self.read('sitemap.xml'))
+        self.assertEqual([name for name in os.listdir(self.root) if name.startswith('sitemap-')], [])
+
+    def test_files_are_served_compressed_with_cache_headers(self):
+        response = self.client.get('/feed.xml', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        self.assertIn('Story 0', gzip.decompress(b''.join(response.streaming_content)).decode())
+
+        response = self.client.get('/sitemap.xml', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/sitemap.xml', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class PostTransferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.editor = User.objects.create_user(username='editor', is_staff=True)
+        models.Profile.objects.create(user=cls.editor)
+
+    def records(self, count, start=0, **fields):
+        return [
+            {
+                'title': f'Imported {i}', 'slug': f'imported-{i}', 'body': f'<p>Body {i}</p>', 'author': 'editor',
+                'published': True, 'created_at': '2020-01-02T03:04:05+00:00', 'tags': ['Archive', f'Year {i % 2}'],
+                **fields,
+            }
+            for i in range(start, start + count)
+        ]
+
+    def ndjson(self, records):
+        return [json.dumps(record) + '\n' for record in records]
+
+    def test_import_keeps_fields_and_export_round_trips(self):
+        importer = post_transfer.Importer(batch_size=2)
+        progress = list(importer.run(self.ndjson(self.records(3))))
+        self.assertEqual([step['line'] for step in progress], [2, 3])
+        self.assertEqual(importer.summary(), {'imported': 3, 'skipped': 0, 'errors': 0})
+
+        post = models.Post.objects.get(slug='imported-1')
+        self.assertEqual(post.created_at.isoformat(), '2020-01-02T03:04:05+00:00')
+        self.assertEqual(post.excerpt, 'Body 1')
+        self.assertEqual(sorted(post.tags.values_list('name', flat=True)), ['Archive', 'Year 1'])
+        jobs.run_pending()
+        self.assertEqual(models.TagIndex.objects.get(tag__name='Archive').post_count, 3)
+        self.assertEqual(sorted(search_post_ids('imported')), sorted(models.Post.objects.values_list('pk', flat=True)))
+
+        out = StringIO()
+        call_command('export_posts', '--batch-size', '2', stdout=out)
+        exported = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([record['slug'] for record in exported], ['imported-0', 'imported-1', 'imported-2'])
+        self.assertEqual(exported[1]['tags'], ['Archive', 'Year 1'])
+
+        # Importing the export again finds every slug taken
+        again = post_transfer.Importer()
+        list(again.run(self.ndjson(exported)))
+        self.assertEqual(again.summary(), {'imported': 0, 'skipped': 3, 'errors': 0})
+
+    def test_batch_queries_do_not_grow_with_batch_size(self):
+        counts = []
+        for start, size in ((0, 5), (100, 50)):
+            with CaptureQueriesContext(connection) as queries:
+                list(post_transfer.Importer(batch_size=size).run(self.ndjson(self.records(size, start))))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(models.Post.objects.count(), 55)
+
+    def test_bad_records_are_reported_and_checkpoint_resumes(self):
+        lines = self.ndjson(self.records(2)) + ['not json\n'] + self.ndjson(
+            self.records(1, start=2, author='nobody') + self.records(2, start=3)
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        checkpoint = os.path.join(directory.name, 'import.json')
+
+        # Stop after the first batch, as if the process had been killed
+        first = post_transfer.Importer(batch_size=2, checkpoint=checkpoint)
+        next(first.run(lines))
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f)['line'], 2)
+
+        resumed = post_transfer.Importer(batch_size=2, checkpoint=checkpoint)
+        list(resumed.run(lines))
+        self.assertEqual(resumed.summary(), {'imported': 2, 'skipped': 0, 'errors': 2})
+        self.assertEqual([number for number, _ in resumed.errors], [3, 4])
+        self.assertEqual(models.Post.objects.count(), 4)
+
+    def test_slug_collisions_and_unreadable_lines(self):
+        list(post_transfer.Importer().run(self.ndjson(self.records(1))))
+        lines = self.ndjson(
+            # Same slug, different post; then two new records sharing a slug in one batch
+            self.records(1, title='Imported 0, revised') + self.records(2, start=1, slug='imported-0')
+            + self.records(1, start=3, tags=['x' * 51])
+        ) + [b'\x9e{"title": "Broken"}\n']
+        importer = post_transfer.Importer()
+        list(importer.run(lines))
+        self.assertEqual(importer.summary(), {'imported': 3, 'skipped': 0, 'errors': 2})
+        self.assertEqual(
+            importer.errors, [(4, 'tag names must be at most 50 characters'), (5, 'Not valid UTF-8')]
+        )
+        self.assertEqual(
+            dict(models.Post.objects.values_list('title', 'slug')),
+            {'Imported 0': 'imported-0', 'Imported 0, revised': 'imported-0-1',
+             'Imported 1': 'imported-0-2', 'Imported 2': 'imported-0-3'},
+        )
+
+    def test_streaming_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get('/posts.ndjson').status_code, 403)
+
+        headers = {'HTTP_AUTHORIZATION': f'JWT {get_token(self.editor)}'}
+        response = self.client.post(
+            '/posts.ndjson?batch_size=1', ''.join(self.ndjson(self.records(2))),
+            content_type='application/x-ndjson', **headers,
+        )
+        progress = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(progress[-1], {'line': 2, 'imported': 2, 'skipped': 0, 'errors': 0})
+
+        response = self.client.get('/posts.ndjson', **headers)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        exported = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([record['title'] for record in exported], ['Imported 0', 'Imported 1'])
+
+
+class InteractionRollupTests(TestCase):
+    QUERY = '''
+        query ($postId: ID!, $from: DateTime, $to: DateTime, $granularity: EngagementGranularity) {
+            postEngagement(postId: $postId, from: $from, to: $to, granularity: $granularity) {
+                granularity points { bucket likes shares }
+            }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username='writer')
+        profile = models.Profile.objects.create(user=user)
+        cls.post = models.Post.objects.create(title='Popular', body='<p>Body</p>', author=profile)
+        cls.start = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=2)
+
+    def record(self, action, hours, count=1):
+        """Record interactions ``hours`` after the start of the test window."""
+        created = models.Interaction.objects.bulk_create(
+            models.Interaction(post=self.post, action=action, actor_key=f'c:{action}-{hours}-{n}-{models.Interaction.objects.count()}')
+            for n in range(count)
+        )
+        models.Interaction.objects.filter(pk__in=[i.pk for i in created]).update(
+            created_at=self.start + timedelta(hours=hours, minutes=30)
+        )
+
+    def rollup(self, model):
+        return {
+            (bucket - self.start, action): count
+            for bucket, action, count in model.objects.values_list('bucket', 'action', 'count')
+        }
+
+    def test_rollups_only_add_interactions_past_the_watermark(self):
+        self.record('like', 1, count=3)
+        self.record('share', 1)
+        self.record('like', 26, count=2)
+        self.assertEqual(rollups.roll_up(chunk_size=2, settle_seconds=0), 6)
+        self.assertEqual(rollups.roll_up(settle_seconds=0), 0)
+
+        self.record('like', 1)
+        self.assertEqual(rollups.roll_up(settle_seconds=0), 1)
+        self.assertEqual(self.rollup(models.HourlyInteractionRollup), {
+            (timedelta(hours=1), 'like'): 4, (timedelta(hours=1), 'share'): 1, (timedelta(hours=26), 'like'): 2,
+        })
+        self.assertEqual(self.rollup(models.DailyInteractionRollup), {
+            (timedelta(0), 'like'): 4, (timedelta(0), 'share'): 1, (timedelta(days=1), 'like'): 2,
+        })
+
+        call_command('rollup_interactions', '--rebuild', '--settle-seconds', '0', stdout=StringIO())
+        self.assertEqual(models.DailyInteractionRollup.objects.get(bucket=self.start, action='like').count, 4)
+
+    def test_unsettled_interactions_wait_for_the_next_run(self):
+        interaction = models.Interaction.objects.create(post=self.post, action='like')
+        self.assertEqual(rollups.roll_up(), 0)
+        # Coverage ends where the settle window starts, not when the run happened
+        self.assertLess(rollups.rolled_up_until(), interaction.created_at)
+        self.assertEqual(rollups.roll_up(settle_seconds=0), 1)
+        self.assertGreater(rollups.rolled_up_until(), interaction.created_at)
+
+    def test_post_engagement_reads_rollups(self):
+        self.record('like', 2, count=2)
+        self.record('share', 3)
+        rollups.roll_up(settle_seconds=0)
+
+        variables = {
+            'postId': self.post.pk, 'granularity': 'HOUR',
+            'from': self.start.isoformat(), 'to': (self.start + timedelta(hours=4)).isoformat(),
+        }
+        with self.assertNumQueries(2):  # Rollup rows and the watermark
+            result = schema.execute(self.QUERY, variables=variables, context_value=make_request())
+        self.assertIsNone(result.errors)
+        engagement = result.data['postEngagement']
+        self.assertEqual(engagement['granularity'], 'HOUR')
+        self.assertEqual([(point['likes'], point['shares']) for point in engagement['points']], [(0, 0), (0, 0), (2, 0), (0, 1)])
+
+        variables['to'] = (self.start + timedelta(days=60)).isoformat()
+        result = schema.execute(self.QUERY, variables=variables, context_value=make_request())
+        self.assertEqual(result.errors[0].message, 'At most 1000 buckets can be requested at once')
@@ -0,0 +1,230 @@
+# blog/tracing.py
+"""
+Per-resolver timing and SQL instrumentation for GraphQL requests.
+
+BlogGraphQLView opens a Trace around each execution. TracingMiddleware times
+every resolver and attributes the SQL queries run meanwhile to its path. The
+totals feed process-wide histograms served by the ``/metrics`` view in the
+Prometheus text format. When the request sends the TRACING_HEADER and is
+allowed to see it, the full trace is also returned as an Apollo tracing block
+under ``extensions.tracing``.
+
+The histograms live in process memory, so every worker exposes its own.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import QuerySet
+from promise import is_thenable
+
+TRACING_HEADER = getattr(settings, 'GRAPHQL_TRACING_HEADER', 'X-GraphQL-Trace')
+# Upper bounds, in seconds, of the latency histogram buckets
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, label):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        self.counts = defaultdict(lambda: [0] * (len(buckets) + 1))  # The last slot is +Inf
+        self.sums = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            counts = self.counts[label_value]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.sums[label_value] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_value in sorted(self.counts):
+                label = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), self.counts[label_value]):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_sum{{{label}}} {self.sums[label_value]:.6f}')
+                lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'graphql_request_duration_seconds', 'Wall time of GraphQL operations.', DURATION_BUCKETS, 'operation'
+)
+RESOLVER_DURATION = Histogram(
+    'graphql_resolver_duration_seconds', 'Wall time of resolvers, including their SQL.', DURATION_BUCKETS, 'field'
+)
+RESOLVER_SQL_QUERIES = Histogram(
+    'graphql_resolver_sql_queries', 'SQL queries issued per resolver call.', QUERY_COUNT_BUCKETS, 'field'
+)
+RESOLVER_SQL_DURATION = Histogram(
+    'graphql_resolver_sql_duration_seconds', 'Time spent in SQL per resolver call.', DURATION_BUCKETS, 'field'
+)
+HISTOGRAMS = (REQUEST_DURATION, RESOLVER_DURATION, RESOLVER_SQL_QUERIES, RESOLVER_SQL_DURATION)
+
+
+def render_metrics():
+    return '\n'.join(line for histogram in HISTOGRAMS for line in histogram.render()) + '\n'
+
+
+class Span:
+    """
+    One resolver call. Only ``info`` is kept while resolving; the path and type names are read
+    from it when the span is reported, so untraced fields cost no string building.
+    """
+    __slots__ = ('info', 'start', 'end', 'sql_queries', 'sql_duration')
+
+    def __init__(self, info, start):
+        self.info = info
+        self.start = start
+        self.end = None
+        self.sql_queries = 0
+        self.sql_duration = 0.0
+
+    @property
+    def path(self):
+        return list(self.info.path)
+
+    @property
+    def parent_type(self):
+        return str(self.info.parent_type)
+
+    @property
+    def field_name(self):
+        return self.info.field_name
+
+    @property
+    def return_type(self):
+        return str(self.info.return_type)
+
+    @property
+    def field(self):
+        return f'{self.parent_type}.{self.field_name}'
+
+
+class Trace:
+    """Timings of one GraphQL execution."""
+
+    def __init__(self, operation_name=None):
+        self.operation_name = operation_name or 'anonymous'
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.end = None
+        self.spans = []
+        self.current = None  # Span whose resolver is running, for attributing SQL
+        self.sql_queries = 0
+
+    def resolve(self, next, root, info, args):
+        span = Span(info, time.perf_counter())
+        self.spans.append(span)
+        parent, self.current = self.current, span
+        try:
+            result = next(root, info, **args)
+            value = result.value if is_thenable(result) and result.is_fulfilled else result
+            if isinstance(value, QuerySet):
+                # Evaluate lazy querysets here rather than in the executor, so their SQL counts for this resolver
+                len(value)
+        finally:
+            self.current = parent
+        if is_thenable(result) and result.is_pending:
+            # Batched loaders resolve later; the span lasts until the value arrives
+            return result.then(lambda value: self.finish_span(span, value))
+        span.end = time.perf_counter()
+        return result
+
+    def finish_span(self, span, value):
+        span.end = time.perf_counter()
+        return value
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_queries += 1
+            if self.current is not None:
+                self.current.sql_queries += 1
+                self.current.sql_duration += time.perf_counter() - start
+
+    def merge(self, other):
+        """Add the spans and SQL of a trace run for part of this execution on another thread."""
+        self.spans.extend(other.spans)
+        self.sql_queries += other.sql_queries
+
+    def record(self):
+        self.end = time.perf_counter()
+        REQUEST_DURATION.observe(self.operation_name, self.end - self.start)
+        for span in self.spans:
+            # Only resolvers that do work are kept, so plain attribute reads do not flood the metrics
+            if span.end is None or (
+                span.sql_queries == 0 and span.end - span.start < DURATION_BUCKETS[0]
+            ) or span.info.parent_type.name.startswith('__'):
+                continue
+            RESOLVER_DURATION.observe(span.field, span.end - span.start)
+            RESOLVER_SQL_QUERIES.observe(span.field, span.sql_queries)
+            RESOLVER_SQL_DURATION.observe(span.field, span.sql_duration)
+
+    def as_extension(self):
+        """The trace in the Apollo tracing format, plus SQL counts and durations per resolver."""
+        def ns(seconds):
+            return int(seconds * 1e9)
+
+        return {
+            'version': 1,
+            'startTime': self.started_at.isoformat(),
+            'endTime': datetime.now(timezone.utc).isoformat(),
+            'duration': ns(self.end - self.start),
+            'sqlQueries': self.sql_queries,
+            'execution': {
+                'resolvers': [
+                    {
+                        'path': span.path,
+                        'parentType': span.parent_type,
+                        'fieldName': span.field_name,
+                        'returnType': span.return_type,
+                        'startOffset': ns(span.start - self.start),
+                        'duration': ns((span.end or self.end) - span.start),
+                        'sqlQueries': span.sql_queries,
+                        'sqlDuration': ns(span.sql_duration),
+                    }
+                    for span in self.spans
+                ]
+            },
+        }
+
+
+@contextmanager
+def trace_request(request, operation_name=None):
+    """Trace the GraphQL execution run inside the block, exposing it to TracingMiddleware through the request."""
+    trace = request.graphql_trace = Trace(operation_name)
+    try:
+        with connection.execute_wrapper(trace.execute_wrapper):
+            yield trace
+    finally:
+        del request.graphql_trace
+        trace.record()
+
+
+class TracingMiddleware:
+    """Graphene middleware timing each resolver of a traced request; other executions pass straight through."""
+
+    def resolve(self, next, root, info, **args):
+        trace = getattr(info.context, 'graphql_trace', None)
+        if trace is None:
+            return next(root, info, **args)
+        return trace.resolve(next, root, info, args)
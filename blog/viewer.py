@@ -0,0 +1,89 @@
+# blog/viewer.py
+"""
+Cached JWT verification and viewer loading.
+
+A verified token is remembered by its hash for a short while, and the user it
+belongs to is loaded together with their profile in one query and kept for
+VIEWER_USER_CACHE_TTL. Saving or deleting the user or the profile drops the
+cached copy (see blog/signals.py). The signal only reaches the cache of the
+process that saved, so with several workers the cache must be a shared
+backend; otherwise a deactivated user keeps access elsewhere until the entry
+expires, which the short TTL bounds. The GraphQL view resolves the viewer once
+per request before execution, so JSONWebTokenMiddleware finds request.user
+already set and resolvers read the profile without touching the database.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import get_http_authorization, get_payload
+
+CACHE_ALIAS = getattr(settings, 'VIEWER_CACHE_ALIAS', 'graphql')
+TOKEN_CACHE_TTL = getattr(settings, 'VIEWER_TOKEN_CACHE_TTL', 60)  # seconds
+USER_CACHE_TTL = getattr(settings, 'VIEWER_USER_CACHE_TTL', 60)  # seconds
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def token_key(token):
+    return 'viewer:token:' + hashlib.sha256(token.encode()).hexdigest()
+
+
+def user_key(user_id):
+    return f'viewer:user:{user_id}'
+
+
+def load_user(**lookup):
+    User = get_user_model()
+    return User._default_manager.select_related('profile').filter(**lookup).first()
+
+
+def user_from_token(token, context=None):
+    """Return the active user a token belongs to, raising JSONWebTokenError when it does not verify."""
+    cache = get_cache()
+    user_id = cache.get(token_key(token))
+    user = cache.get(user_key(user_id)) if user_id is not None else None
+    if user is None:
+        if user_id is None:
+            payload = get_payload(token, context)
+            username = jwt_settings.JWT_PAYLOAD_GET_USERNAME_HANDLER(payload)
+            if not username:
+                raise JSONWebTokenError('Invalid payload')
+            user = load_user(**{get_user_model().USERNAME_FIELD: username})
+            ttl = TOKEN_CACHE_TTL
+            if jwt_settings.JWT_VERIFY_EXPIRATION and 'exp' in payload:
+                ttl = min(ttl, payload['exp'] - time.time())
+            if user is not None and ttl > 0:
+                cache.set(token_key(token), user.pk, ttl)
+        else:
+            user = load_user(pk=user_id)
+        if user is None:
+            raise JSONWebTokenError('Invalid token')
+        cache.set(user_key(user.pk), user, USER_CACHE_TTL)
+    if not user.is_active:
+        raise JSONWebTokenError('User is disabled')
+    return user
+
+
+def resolve(request):
+    """
+    Set request.user from the request's token and return it. A token that does not verify leaves
+    the request anonymous, for JSONWebTokenMiddleware to report.
+    """
+    token = get_http_authorization(request)
+    if token and request.user.is_anonymous:
+        try:
+            request.user = user_from_token(token, request)
+        except JSONWebTokenError:
+            pass
+    return request.user
+
+
+def forget_user(user_id):
+    get_cache().delete(user_key(user_id))
@@ -1,6 +1,21 @@
 # example/views.py
-from django.http import JsonResponse
-from graphene_django.views import GraphQLView
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import (
+    HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed, HttpResponseNotModified,
+    JsonResponse, StreamingHttpResponse,
+)
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from graphene_django.views import GraphQLView, HttpError
+from graphene_file_upload.django import FileUploadGraphQLView
+from blog import jobs, post_transfer, response_cache, tracing, viewer
+from blog.persisted_queries import PersistedQueryError, document_backend, resolve_query
 from blog.schema import schema
 from django.views.decorators.csrf import ensure_csrf_cookie
 
@@ -10,6 +25,237 @@ def graphql_view(request):
     return JsonResponse(response.content)
 
 
+class BlogGraphQLView(FileUploadGraphQLView):
+    """
+    GraphQL endpoint that accepts automatic persisted queries, reuses parsed and
+    validated documents and serves repeated public read queries from the response cache.
+    Successful read queries carry an ETag; GET and HEAD requests get 304 when the client already has them.
+    """
+
+    http_max_age = getattr(settings, 'GRAPHQL_HTTP_MAX_AGE', 60)  # seconds, for public responses
+
+    execution_failed = False
+    extensions = None  # Of the last executed operation, e.g. its query cost
+    tracing = False  # Whether the client asked for, and may see, extensions.tracing
+    concurrent_root_fields = False  # Resolve independent root fields of queries in parallel
+    resolved_params = None
+    cache_control = None  # Set by get_response when the response may be revalidated
+    last_modified = None
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        if self.cache_control is not None and response.status_code == 200:
+            return self.conditional_response(request, response)
+        return response
+
+    def conditional_response(self, request, response):
+        # A digest of the exact bytes is strong: it also changes when counters or tags change
+        # without touching Post.updated_at
+        etag = '"%s"' % hashlib.sha256(response.content).hexdigest()
+        headers = {'ETag': etag}
+        if self.last_modified is not None:
+            headers['Last-Modified'] = http_date(self.last_modified.timestamp())
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if request.method not in ('GET', 'HEAD'):
+            not_modified = False  # 304 is only defined for GET and HEAD; other methods ignore the validators
+        elif if_none_match is not None:
+            not_modified = etag in parse_etags(if_none_match) or if_none_match.strip() == '*'
+        else:
+            not_modified = (
+                if_modified_since is not None and self.last_modified is not None
+                and int(self.last_modified.timestamp()) <= if_modified_since
+            )
+        if not_modified:
+            response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        patch_cache_control(response, **self.cache_control)
+        patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def get_backend(self, request):
+        return document_backend
+
+    def get_graphql_params(self, request, data):
+        # Called twice per request (cache lookup and execution), so resolve each payload once
+        if self.resolved_params is not None and self.resolved_params[0] is data:
+            return self.resolved_params[1]
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        try:
+            query = resolve_query(query, extensions)
+        except PersistedQueryError as e:
+            # Clients retry with the full query text when they see this error
+            raise HttpError(HttpResponse(), str(e))
+        self.resolved_params = (data, (query, variables, operation_name, id))
+        return self.resolved_params[1]
+
+    def get_response(self, request, data, show_graphiql=False):
+        # Resolve the viewer once, from the cache when possible; JSONWebTokenMiddleware then has nothing to do
+        viewer.resolve(request)
+        self.tracing = self.tracing_requested(request)
+        key = None
+        # Traced responses describe one execution, so they are neither served from nor stored in the cache
+        if not self.batch and not show_graphiql and not self.tracing:
+            query, variables, operation_name, _ = self.get_graphql_params(request, data)
+            key = response_cache.cache_key(request, self.get_document(request, query), variables, operation_name)
+        if key is not None:
+            cached = response_cache.lookup(key)
+            if cached is not None:
+                result, self.last_modified = cached
+                self.set_cache_control(request, public=True)
+                return result, 200
+
+        result, status_code = super().get_response(request, data, show_graphiql)
+        if status_code == 200 and result and not self.execution_failed and self.is_read(request, data):
+            self.last_modified = getattr(request, 'posts_last_modified', None)
+            self.set_cache_control(request, public=key is not None)
+            if key is not None:
+                response_cache.store(key, (result, self.last_modified))
+        return result, status_code
+
+    def is_read(self, request, data):
+        if self.batch:
+            return False
+        query, _, operation_name, _ = self.get_graphql_params(request, data)
+        document = self.get_document(request, query)
+        return document is not None and document.get_operation_type(operation_name) == 'query'
+
+    def set_cache_control(self, request, public):
+        if public and request.user.is_anonymous:
+            self.cache_control = {'public': True, 'max_age': self.http_max_age}
+        else:
+            self.cache_control = {'private': True, 'no_cache': True}
+
+    def get_document(self, request, query):
+        if not query:
+            return None
+        try:
+            return self.get_backend(request).document_from_string(self.schema, query)
+        except Exception:
+            return None  # Reported by execute_graphql_request
+
+    def tracing_requested(self, request):
+        if not request.headers.get(tracing.TRACING_HEADER):
+            return False
+        return settings.DEBUG or response_cache.viewer_class(request) == 'staff'
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        request.concurrent_root_fields = self.concurrent_root_fields
+        with tracing.trace_request(request, operation_name) as trace:
+            execution_result = super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+        if execution_result and self.tracing:
+            execution_result.extensions['tracing'] = trace.as_extension()
+        self.execution_failed = bool(execution_result and execution_result.errors)
+        self.extensions = execution_result.extensions if execution_result else None
+        return execution_result
+
+    def json_encode(self, request, d, pretty=False):
+        if self.extensions and isinstance(d, dict):
+            d = {**d, 'extensions': self.extensions}
+        return super().json_encode(request, d, pretty)
+
+
+# Threads that run GraphQL requests for the ASGI endpoint. Each holds at most one database connection; the
+# root-field pool (blog/concurrent_execution.py) holds up to GRAPHQL_ROOT_FIELD_WORKERS more, so together the
+# two pool sizes bound the connections a process opens for GraphQL
+async_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'GRAPHQL_ASYNC_WORKERS', 8), thread_name_prefix='graphql'
+)
+
+
+def async_graphql(view):
+    """
+    Wrap a synchronous GraphQL view for ASGI. Django would run a sync view in a thread of the request's
+    own ThreadSensitiveContext, with no limit on how many run at once, and every such thread opens its
+    own database connection. This runs requests on the bounded async_executor pool instead, so a burst
+    of queries waits on the event loop rather than exhausting the database's connection limit.
+    """
+    def run(request, *args, **kwargs):
+        # Pool threads keep their own connections, so close them the way Django does around a request
+        close_old_connections()
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            close_old_connections()
+
+    async def async_view(request, *args, **kwargs):
+        return await sync_to_async(run, thread_sensitive=False, executor=async_executor)(request, *args, **kwargs)
+
+    async_view.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    return async_view
+
+
+class ConcurrentBlogGraphQLView(BlogGraphQLView):
+    """BlogGraphQLView for the async endpoint: the root fields of a query resolve side by side."""
+
+    concurrent_root_fields = True
+
+
+async_graphql_view = async_graphql(ConcurrentBlogGraphQLView.as_view(graphiql=True, schema=schema))
+
+
+def metrics(request):
+    """GraphQL timing histograms in the Prometheus text format, for scrapers on the allowed addresses only."""
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+        return HttpResponseForbidden()
+    return HttpResponse(tracing.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def run_jobs(request):
+    """
+    Run the due background jobs, for App Engine cron (cron.yaml) where no ``run_worker`` process runs.
+    App Engine strips X-Appengine-Cron from outside requests, so only its scheduler can send it.
+    """
+    if not getattr(settings, 'TASK_CRON_ENABLED', False) or request.headers.get('X-Appengine-Cron') != 'true':
+        return HttpResponseForbidden()
+    jobs.release_stale_jobs()
+    ran = jobs.run_pending(limit=100)
+    return HttpResponse(f'Ran {ran} jobs\n', content_type='text/plain')
+
+
+def posts_ndjson(request):
+    """
+    Staff only. GET streams every post as NDJSON (``?after_id=`` resumes); POST imports an NDJSON body and
+    streams a progress line per committed batch, then a line per rejected record.
+    """
+    user = viewer.resolve(request)
+    if not user.is_staff:
+        return HttpResponseForbidden()
+    try:
+        batch_size = int(request.GET.get('batch_size', post_transfer.BATCH_SIZE))
+        after_id = int(request.GET.get('after_id', 0))
+    except ValueError:
+        return HttpResponseBadRequest('batch_size and after_id must be integers')
+    if not 1 <= batch_size <= post_transfer.BATCH_SIZE * 10:
+        return HttpResponseBadRequest('batch_size is out of range')
+
+    if request.method == 'GET':
+        lines = post_transfer.export_lines(batch_size=batch_size, after_id=after_id)
+    elif request.method == 'POST':
+        lines = import_progress(post_transfer.Importer(batch_size=batch_size), request)
+    else:
+        return HttpResponseNotAllowed(['GET', 'POST'])
+    return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+
+def import_progress(importer, request):
+    # Reading the request line by line keeps the body out of memory
+    for progress in importer.run(request):
+        yield json.dumps(progress) + '\n'
+    for number, message in importer.errors:
+        yield json.dumps({'line': number, 'error': message}) + '\n'
+
+
 @ensure_csrf_cookie
 def get_csrf_token(request):
     return JsonResponse({"detail": "CSRF cookie set"})